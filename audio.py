@@ -0,0 +1,186 @@
+import hashlib
+import os
+from threading import Thread
+import wave
+import alsaaudio
+import numpy as np
+
+import config
+
+
+def native_format(device=config.AUDIO_DEVICE):
+    """
+    Query the rate and channel count the output device runs at without ALSA plugin conversion. The raw hw device
+    behind a plughw device is asked for the configured preferred format and returns the nearest it supports.
+    :return: (rate, channels)
+    """
+    if config.AUDIO_NATIVE_FORMAT is not None:
+        return config.AUDIO_NATIVE_FORMAT
+    rate, channels = config.AUDIO_PREFERRED_FORMAT
+    try:
+        stream = alsaaudio.PCM(type=alsaaudio.PCM_PLAYBACK, mode=alsaaudio.PCM_NONBLOCK,
+                               device=device.replace('plughw', 'hw', 1))
+        stream.setformat(alsaaudio.PCM_FORMAT_S16_LE)
+        channels = stream.setchannels(channels)
+        rate = stream.setrate(rate)
+        stream.close()
+    except alsaaudio.ALSAAudioError as e:
+        print(f"Could not query native format of {device} ({e}), using {rate} Hz {channels} channels")
+    return rate, channels
+
+
+def read_wav(filename):
+    """ :return: (float samples array of shape (frames, channels) scaled to +/-1, frame rate) """
+    with wave.open(filename, "rb") as f:
+        width = f.getsampwidth()
+        channels = f.getnchannels()
+        rate = f.getframerate()
+        data = f.readframes(f.getnframes())
+    if width == 1:
+        samples = (np.frombuffer(data, dtype=np.uint8).astype(np.float64) - 128) / 128
+    elif width == 2:
+        samples = np.frombuffer(data, dtype='<i2').astype(np.float64) / 32768
+    elif width == 4:
+        samples = np.frombuffer(data, dtype='<i4').astype(np.float64) / 2147483648
+    else:
+        raise ValueError(f"{filename}: unsupported sample width {width}")
+    return samples.reshape(-1, channels), rate
+
+
+def mix_channels(samples, channels):
+    """ Down mix to mono by averaging, up mix by copying the mono mix to every output channel. """
+    if samples.shape[1] == channels:
+        return samples
+    mono = samples.mean(axis=1, keepdims=True)
+    return np.repeat(mono, channels, axis=1)
+
+
+def resample(samples, rate, target_rate, taps=63):
+    """
+    Resample every channel by linear interpolation. When reducing the rate the signal is first low pass filtered
+    with a windowed sinc at the new Nyquist frequency to avoid aliasing.
+    """
+    if rate == target_rate or len(samples) == 0:
+        return samples
+    if target_rate < rate:
+        n = np.arange(taps) - (taps - 1) / 2
+        kernel = np.sinc(n * target_rate / rate) * np.hamming(taps)
+        kernel /= kernel.sum()
+        samples = np.stack([np.convolve(samples[:, c], kernel, mode='same') for c in range(samples.shape[1])], axis=1)
+    positions = np.arange(int(round(len(samples) * target_rate / rate))) * (rate / target_rate)
+    frames = np.arange(len(samples))
+    return np.stack([np.interp(positions, frames, samples[:, c]) for c in range(samples.shape[1])], axis=1)
+
+
+def write_wav(filename, samples, rate):
+    """ Write float samples as 16 bit little endian PCM. The file is written to a temporary name and renamed. """
+    data = (np.clip(samples, -1, 1 - 1 / 32768) * 32768).astype('<i2').tobytes()
+    tmp = filename + ".tmp"
+    with wave.open(tmp, "wb") as f:
+        f.setnchannels(samples.shape[1])
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(data)
+    os.replace(tmp, filename)
+
+
+class TranscodeCache(object):
+    """
+    On disk cache of wav files converted to the output device's native format. Entries are keyed by a hash of the
+    source file contents and the target format, so an edited prompt or a different sound card is converted again.
+    """
+    def __init__(self, directory=config.AUDIO_CACHE_DIR):
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+
+    def get(self, filename, rate, channels):
+        """ :return: path of filename converted to rate and channels, converting it if it is not cached yet. """
+        with open(filename, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        cached = os.path.join(self.directory, f"{digest}-{rate}-{channels}-s16le.wav")
+        if not os.path.exists(cached):
+            print(f"Converting {filename} to {rate} Hz {channels} channels")
+            samples, source_rate = read_wav(filename)
+            write_wav(cached, resample(mix_channels(samples, channels), source_rate, rate), rate)
+        return cached
+
+
+class AudioPlayer(object):
+    """
+    Plays the notification wav files (dial tone, prompts) on the handset audio device. There is a single output
+    device, so one player is shared by everything that plays prompts and starting a file stops the one playing.
+    After prepare() the files are played from copies in the device's native format, so no conversion is left to
+    the ALSA plug plugin while playing.
+    """
+    CHUNK = 1024
+
+    def __init__(self, device=config.AUDIO_DEVICE):
+        self.device = device
+        self.stop_audio = False
+        self.playing_audio = False
+        self._thread = None
+        self.native = None          # (rate, channels) of the output device once prepared
+        self._prepared = {}         # wav file name -> converted copy
+        self._cache = None
+
+    def prepare(self, directory=os.path.dirname(os.path.abspath(__file__))):
+        """ Find the output device's native format and convert every wav file in directory to it. """
+        self.native = native_format(self.device)
+        self._cache = TranscodeCache()
+        print(f"Audio output {self.device} native format {self.native[0]} Hz {self.native[1]} channels")
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(".wav"):
+                self._prepared[name] = self._cache.get(os.path.join(directory, name), *self.native)
+
+    def start_file(self, filename, loop=False):
+        """
+        Start a thread reproducing an audio file
+        :param filename: The name of the file to play
+        :param loop: If the file should be played as a loop (like in the case of the dial tone)
+        """
+        print("Play file {0}".format(filename))
+        self.stop_file()
+        if self._thread is not None:
+            self._thread.join()
+        self.stop_audio = False
+        self._thread = Thread(target=self.__play_file, args=[filename, loop], name="AudioPlayer")
+        self._thread.start()
+        self.playing_audio = True
+
+    def __play_file(self, filename, loop):
+        """
+        Private function handling the wav file replay
+        :param filename: The name of the file to play
+        :param loop: If the file should be played as a loop (like in the case of the dial tone)
+        """
+        # Prompts are looked up by name, so they are found wherever the callers think the files live
+        if os.path.basename(filename) in self._prepared:
+            filename = self._prepared[os.path.basename(filename)]
+        elif self.native is not None:
+            filename = self._cache.get(filename, *self.native)
+        # open a wav format music. Both handles are closed however playing ends so none leak over months of use.
+        with wave.open(filename, "rb") as f:
+            # open stream
+            stream = alsaaudio.PCM(type=alsaaudio.PCM_PLAYBACK, mode=alsaaudio.PCM_NORMAL, device=self.device)
+            try:
+                stream.setformat(alsaaudio.PCM_FORMAT_S16_LE)
+                stream.setchannels(f.getnchannels())
+                stream.setrate(f.getframerate())
+
+                # play stream, from the start again each time round if looping
+                while not self.stop_audio:
+                    f.rewind()
+                    data = f.readframes(self.CHUNK)
+                    while data and not self.stop_audio:
+                        stream.write(data)
+                        data = f.readframes(self.CHUNK)
+                    if not loop:
+                        break
+            finally:
+                stream.close()
+        self.playing_audio = False
+
+    def stop_file(self):
+        self.stop_audio = True
+        self.playing_audio = False
+        print("stopping sound")
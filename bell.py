@@ -0,0 +1,157 @@
+"""
+The ringer process: rings the bell as told by commands on its stdin. ringer.Ringer starts it as
+
+    python3 bell.py <pin> <enable pin> <frequency> <cadences as JSON> [--priority N] [--stats FILE]
+
+It only imports the standard library and RPi.GPIO, not config or the rest of the phone (dbus, alsaaudio, numpy), so
+the process is small and starts quickly. Commands are one per line:
+
+    ring <cadence>  ring with the cadence at that index
+    quiet           bell off
+    stop            bell off and exit
+
+Between commands the process sleeps in select() on stdin, waking only for a command, the next pulse of the cadence
+or the parent check every PARENT_CHECK_INTERVAL. To fail safe the bell is switched off and the process exits as soon
+as stdin is closed or the parent has gone.
+"""
+import argparse
+import json
+import os
+import select
+import time
+
+# Longest the ringer process sleeps before checking that its parent is still there (units: s)
+PARENT_CHECK_INTERVAL = 1.0
+
+
+def set_realtime_priority(priority):
+    """ Give the calling process a real time scheduling priority, or at least a better nice value. """
+    try:
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+        print(f"Ringer running with SCHED_FIFO priority {priority}")
+    except (AttributeError, PermissionError, OSError):
+        try:
+            os.nice(-10)
+            print("Ringer running with nice -10")
+        except (PermissionError, OSError):
+            print("Ringer running with normal priority")
+
+
+class BellControl(object):
+    """ State of the bell as set by the commands read from fd. """
+    def __init__(self, fd, parent_pid):
+        self.fd = fd
+        self.parent_pid = parent_pid
+        self.ringing = False
+        self.cadence = 0
+        self.stopped = False
+        self._buffer = b''
+
+    def wait(self, timeout):
+        """
+        Block for up to timeout seconds, or until commands arrive.
+        :return: True if the state may have changed, False on timeout.
+        """
+        readable, _, _ = select.select([self.fd], [], [], min(timeout, PARENT_CHECK_INTERVAL))
+        if os.getppid() != self.parent_pid:
+            self.stopped = True
+            return True
+        if len(readable) == 0:
+            return False
+        data = os.read(self.fd, 4096)
+        if data == b'':
+            self.stopped = True     # the parent closed the pipe or has gone
+            return True
+        *lines, self._buffer = (self._buffer + data).split(b'\n')
+        for line in lines:
+            self._command(line.decode().split())
+        return True
+
+    def _command(self, words):
+        if words[:1] == ['ring']:
+            self.ringing = True
+            self.cadence = int(words[1]) if len(words) > 1 else 0
+        elif words == ['quiet']:
+            self.ringing = False
+        elif words == ['stop']:
+            self.ringing = False
+            self.stopped = True
+
+
+def ring(pin, enable_pin, control, cadences, frequency, stats=None):
+    """
+    Ring the bell as told by control until it is stopped.
+    Each pulse is timed against absolute deadlines so a late wake up does not stretch the rest of the cadence.
+    :param stats: optional text stream; the lateness of every pulse switch (seconds) is written to it, one a line.
+    """
+    import RPi.GPIO as GPIO
+
+    def keep_ringing(cadence):
+        return control.ringing and control.cadence == cadence and not control.stopped
+
+    def wait_until(deadline, cadence):
+        while keep_ringing(cadence):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return True
+            control.wait(remaining)
+        return False
+
+    GPIO.setmode(GPIO.BCM)
+    GPIO.setup(pin, GPIO.OUT)
+    # set the PWM GPIO to control the ringer.
+    ringer = GPIO.PWM(pin, frequency)
+    ringer.start(0)
+    # Configure the enable pin
+    GPIO.setup(enable_pin, GPIO.OUT)
+    GPIO.output(enable_pin, 0)
+    try:
+        while not control.stopped:
+            if control.ringing:
+                GPIO.output(enable_pin, 1)
+                cadence = control.cadence
+                deadline = time.monotonic()
+                for x, duration in enumerate(cadences[cadence]):
+                    """
+                        Note there is a bug in the RPi.GPIO module that means you can not repeatedly turn the
+                        ringer on an off. Changing the duty cycle is the workaround
+                    """
+                    ringer.ChangeDutyCycle(50 if x % 2 == 0 else 0)
+                    if stats is not None:
+                        stats.write(f"{time.monotonic() - deadline}\n")
+                    deadline += duration
+                    if not wait_until(deadline, cadence):
+                        break
+                ringer.ChangeDutyCycle(0)
+            else:
+                GPIO.output(enable_pin, 0)
+                control.wait(PARENT_CHECK_INTERVAL)
+    finally:
+        ringer.ChangeDutyCycle(0)
+        GPIO.output(enable_pin, 0)
+        ringer.stop()
+        GPIO.cleanup([pin, enable_pin])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ringer process, controlled through stdin")
+    parser.add_argument("pin", type=int)
+    parser.add_argument("enable_pin", type=int)
+    parser.add_argument("frequency", type=float)
+    parser.add_argument("cadences", type=json.loads, help="list of cadences, each a list of on/off times in s")
+    parser.add_argument("--priority", type=int, help="SCHED_FIFO priority, normal scheduling if not given")
+    parser.add_argument("--stats", help="file to write the lateness of every pulse switch to")
+    args = parser.parse_args()
+    if args.priority is not None:
+        set_realtime_priority(args.priority)
+    control = BellControl(0, os.getppid())
+    stats = open(args.stats, 'w') if args.stats is not None else None
+    try:
+        ring(args.pin, args.enable_pin, control, args.cadences, args.frequency, stats)
+    finally:
+        if stats is not None:
+            stats.close()
+
+
+if __name__ == '__main__':
+    main()
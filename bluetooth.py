@@ -3,6 +3,7 @@ import dbus.service
 import dbus_custom_services
 import subprocess
 import config
+import reconnect
 
 
 class connection(object):
@@ -13,22 +14,32 @@ class connection(object):
         returned by ofono.Manager.GetModems() Note that modem can be present but there may be no active
         connection i.e. it is offline. In order to start accepting or making call the Modem must be present and online.
     """
-    def __init__(self,_bus, _loop_started, _status_service):
+    def __init__(self,_bus, _loop_started, _status_service, _proxy_cache, _snapshot=None):
 
         if not _loop_started:
             raise Exception("Main loop must be started before creating a connection.")
 
         self.bus = _bus
+        self.proxy_cache = _proxy_cache  # Shared dbus_cache.ProxyCache
         self.pairing_agent = None       # Application defined pairing agent.
         self.discoverable_status = 0    # Takes value 0 or 1 (not a boolean)
         self.has_modems = False         # Flag indicating if at least one modem ( BT device has been paired)
         self.is_online = False
         self.all_modem_objects = {}     # dictionary of all modem objects
         self.all_modem_handlers = {}
+        self.all_modem_matches = {}     # PropertyChanged signal matches per modem, removed when ofono restarts
+        self.manager_matches = []       # ModemAdded/ModemRemoved signal matches
         self.modem_object = None        # The modem path object
         self.modem_name = None    # properties of the modem. Array[dbus.String]
         self.bt_device = None           # RPi bluetooth adapter (Hardware)
         self.manager = None             # ofono manager object
+        self.reconnect_manager = None   # Thread actively reconnecting to the last used phone(s)
+        self.reconnect_times = []       # Seconds taken by each active reconnect, used to tune the backoff.
+        self.snapshot = _snapshot       # snapshot.StateSnapshot of the last known modems, or None
+        self.last_online_modem = None   # Path of the modem online when the snapshot was last saved
+        if self.snapshot is not None:
+            self.modem_name = self.snapshot.get("modem_name")
+            self.last_online_modem = self.snapshot.get("online_modem")
 
         """ 
             Status_service is a reference to the BT_link_ready service instance created by the phone manager.
@@ -36,8 +47,15 @@ class connection(object):
             connected and ready to start using.
         """
         self.status_service = _status_service
+
+    def connect(self):
+        """
+        Register the pairing agent, enumerate the modems known to ofono and subscribe to their changes.
+        These are blocking calls to bluez and ofono, so with a warm start snapshot the PhoneManager runs this in the
+        background.
+        """
         self._register_pairing_agent()
-        self.manager = dbus.Interface(self.bus.get_object('org.ofono', '/'), 'org.ofono.Manager')
+        self.manager = self.proxy_cache.get_interface('org.ofono', '/', 'org.ofono.Manager')
         """Set up modem listener even if a modem ( ie. phone) is connected in case another phone wants to take over"""
         self._listen_for_modems()
 
@@ -52,24 +70,58 @@ class connection(object):
             for k, v in self.all_modem_objects.items():
                 print(f"Modem: {k}, name {v[1]}")
 
+        """ A known phone that is offline at startup is reconnected actively rather than waiting for it to connect."""
+        if self.has_modems and not self.is_online:
+            self._start_reconnect()
+
 
     def get_all_modem_objects(self):
         """ Get all modems and set listeners for status change.
             use each time a modem is added or removed (refresh)
         """
         # get list of modems
-        all_modems = None
+        all_modems = []
+        listed = False
         try:
             all_modems = self.manager.GetModems()
+            listed = True
         except:
             pass
-        # and get objects
+        # forget modems that have been removed
+        present = [m[0] for m in all_modems]
+        for path in list(self.all_modem_objects):
+            if path not in present:
+                self.all_modem_matches.pop(path).remove()
+                del self.all_modem_objects[path]
+                del self.all_modem_handlers[path]
+        self.has_modems = len(all_modems) > 0
+        # and get objects. Modems already known keep their listener so refreshing does not add duplicate handlers.
         if len(all_modems) > 0:
-            self.has_modems = True
             for m in all_modems:
-                self.all_modem_objects[m[0]] = [self.bus.get_object('org.ofono', m[0]), m[1][dbus.String("Name")]]
-                self.all_modem_handlers[m[0]] = self._unique_modem_handler(m[0])
-                self.all_modem_objects[m[0]][0].connect_to_signal('PropertyChanged', self.all_modem_handlers[m[0]])
+                if m[0] not in self.all_modem_matches:
+                    self.all_modem_objects[m[0]] = [self.proxy_cache.get_object('org.ofono', m[0]),
+                                                    m[1][dbus.String("Name")]]
+                    self.all_modem_handlers[m[0]] = self._unique_modem_handler(m[0])
+                    self.all_modem_matches[m[0]] = self.all_modem_objects[m[0]][0].connect_to_signal(
+                        'PropertyChanged', self.all_modem_handlers[m[0]])
+                if m[1].get(dbus.String("Online"), False):
+                    if self.modem_object is None or self.modem_object.object_path != m[0]:
+                        # Already online when we started: remember it as if it had just connected
+                        reconnect.remember_device(reconnect.modem_to_device_path(m[0]))
+                    self.is_online = True
+                    self.modem_object = self.all_modem_objects[m[0]][0]
+                    self.modem_name = self.all_modem_objects[m[0]][1]
+        # A failed GetModems (ofono not up yet) must not overwrite the last known modems
+        if listed:
+            self._save_snapshot()
+
+    def _save_snapshot(self):
+        """ Save the online modem, if any, for the next warm start. """
+        if self.snapshot is None:
+            return
+        online = self.is_online and self.modem_object is not None
+        self.snapshot.update(online_modem=str(self.modem_object.object_path) if online else None,
+                             modem_name=str(self.modem_name) if self.modem_name is not None else None)
 
     def _unique_modem_handler(self, path):
         """ Curried handler that wraps the path into the handler. Otherwise there is no way to get the sender info"""
@@ -88,17 +140,73 @@ class connection(object):
                     print("Previously paired mobile phone has just connected.")
                     self.modem_object = self.all_modem_objects[path][0]
                     self.modem_name = self.all_modem_objects[path][1]
+                    self.is_online = True
+                    self._stop_reconnect()
+                    reconnect.remember_device(reconnect.modem_to_device_path(path))
+                    self._save_snapshot()
                     self._refresh_pulseaudio_cards()
                     print("fire signal to indicate that we can start listening for calls")
                     self.status_service.emit(config.READY)
                 else:
                     print("phone has disconnected from RPi")
+                    self.is_online = False
+                    self._save_snapshot()
         return _modem_status_change
 
+    def _start_reconnect(self):
+        """ Start actively reconnecting to the most recently used phones known to ofono. """
+        known_devices = [reconnect.modem_to_device_path(p) for p in self.all_modem_objects]
+        device_paths = [d for d in reconnect.load_last_devices() if d in known_devices]
+        if len(device_paths) == 0:
+            device_paths = known_devices[:config.RECONNECT_MAX_DEVICES]
+        self.reconnect_manager = reconnect.ReconnectManager(self.pairing_agent, device_paths)
+        self.reconnect_manager.start()
+
+    def _stop_reconnect(self):
+        if self.reconnect_manager is not None:
+            elapsed = self.reconnect_manager.stop()
+            if elapsed is not None:
+                self.reconnect_times.append(elapsed)
+            self.reconnect_manager = None
+
     def _listen_for_modems(self):
         print("create listener for modems add/remove")
-        self.manager.connect_to_signal('ModemAdded', self._modemAdded)
-        self.manager.connect_to_signal('ModemRemoved', self._modemRemoved)
+        for match in self.manager_matches:
+            match.remove()
+        self.manager_matches = [self.manager.connect_to_signal('ModemAdded', self._modemAdded),
+                                self.manager.connect_to_signal('ModemRemoved', self._modemRemoved)]
+
+    def ofono_lost(self):
+        """ ofono has left the bus. Forget the modems; their objects no longer exist. """
+        print("ofono has gone away, clearing modems")
+        for match in self.manager_matches + list(self.all_modem_matches.values()):
+            match.remove()
+        self.manager_matches = []
+        self.all_modem_matches = {}
+        self.all_modem_objects = {}
+        self.all_modem_handlers = {}
+        self.modem_object = None
+        self.modem_name = None
+        self.has_modems = False
+        self.is_online = False
+        self.proxy_cache.invalidate(bus_name='org.ofono')
+
+    def rebuild_ofono(self):
+        """
+        Rebuild the ofono manager, the modem registry and all modem listeners after ofono has (re)started.
+        If a modem is already online readiness is re-emitted so that call listeners are rebuilt too.
+        """
+        self._stop_reconnect()
+        self.ofono_lost()
+        self.manager = self.proxy_cache.get_interface('org.ofono', '/', 'org.ofono.Manager')
+        self._listen_for_modems()
+        self.get_all_modem_objects()
+        if self.is_online:
+            self._refresh_pulseaudio_cards()
+            print("fire signal to indicate that we can start listening for calls")
+            self.status_service.emit(config.READY)
+        elif self.has_modems:
+            self._start_reconnect()
 
     def _modemAdded(self, path, properties):
         """ Handler for a modem being added. When a modem is added it is automatically online."""
@@ -110,6 +218,10 @@ class connection(object):
 
     def _modemRemoved(self, path):
         print("A modem is been removed {:s} ".format(self.all_modem_objects[path][1]))
+        if self.modem_object is not None and self.modem_object.object_path == path:
+            self.modem_object = None
+            self.modem_name = None
+            self.is_online = False
         self.get_all_modem_objects()
         self._refresh_pulseaudio_cards()
 
@@ -127,8 +239,8 @@ class connection(object):
         Set the RPi BT device to discoverable and pairable for 30 seconds. This is used only for pairing
         device (e.g. a mobile phone) that has not previously been paired.
         """
-        self.bt_device = dbus.Interface(self.bus.get_object("org.bluez", "/org/bluez/hci0"),
-                                        "org.freedesktop.DBus.Properties")
+        self.bt_device = self.proxy_cache.get_interface("org.bluez", "/org/bluez/hci0",
+                                                        "org.freedesktop.DBus.Properties")
         # Check if the device is already in discoverable mode and if not then set a short discoverable period
         self.discoverable_status = self.bt_device.Get("org.bluez.Adapter1", "Discoverable")
         if self.discoverable_status == 0:
@@ -148,13 +260,24 @@ class connection(object):
 
     def _register_pairing_agent(self):
         """Registered bluetooth pairing agent that will autoaccept pairing requests"""
+        path = "/RPi/Agent"
         if self.pairing_agent is None:
             print("registering auto accept pairing agent")
-            path = "/RPi/Agent"
-            self.pairing_agent = dbus_custom_services.AutoAcceptAgent(self.bus, path)
-            # Register application's agent for headless operation
-            bt_agent_manager = dbus.Interface(self.bus.get_object("org.bluez", "/org/bluez"), "org.bluez.AgentManager1")
+            self.pairing_agent = dbus_custom_services.AutoAcceptAgent(self.bus, path, self.proxy_cache)
+        # Register application's agent for headless operation
+        bt_agent_manager = self.proxy_cache.get_interface("org.bluez", "/org/bluez", "org.bluez.AgentManager1")
+        try:
             bt_agent_manager.RegisterAgent(path, "NoInputNoOutput")
-            bt_agent_manager.RequestDefaultAgent(path)
+        except dbus.exceptions.DBusException as e:
+            # Registered already by the watchdog when bluetoothd came up after the phone
+            if e.get_dbus_name() != 'org.bluez.Error.AlreadyExists':
+                raise
+        bt_agent_manager.RequestDefaultAgent(path)
+
+    def rebuild_bluez(self):
+        """ bluetoothd has (re)started and forgotten our agent, so register it again. """
+        self.proxy_cache.invalidate(bus_name='org.bluez')
+        self.bt_device = None
+        self._register_pairing_agent()
 
 
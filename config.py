@@ -13,6 +13,11 @@ DISCOVERABLE_TIMEOUT = 20
 RINGER_FREQUENCY = 25
 # Ringer pattern in seconds
 RINGER_PATTERN = array([0.4, 0.2, 0.4, 2])   # time on,off,on,off
+# Ring cadences selectable by index (cadence id): incoming call, intercom call between extensions
+RINGER_CADENCES = [RINGER_PATTERN, array([1.0, 3.0])]
+INTERCOM_CADENCE = 1
+# SCHED_FIFO priority of the ringer process (1-99). Needs root or CAP_SYS_NICE, otherwise it runs niced.
+RINGER_RT_PRIORITY = 50
 # ringer gpio pin on RPi3B+
 RINGER_PIN = 12
 # Ringer on pin - adds/removes power from bell.
@@ -36,12 +41,96 @@ VOLUME_PIN_DICT = {'VOLUME_UP_PIN': 23,
                    'VOLUME_MUTE_PIN': 25
                    }
 
+""" 
+    Multi-line mode. Each extension is a handset with its own dial, receiver and bell. The handsets share the
+    bluetooth connection and the audio output. Set to None for a single handset on the pins above.
+"""
+EXTENSIONS = None
+# EXTENSIONS = [{'NS_PIN': 19, 'HOERER_PIN': 13, 'RINGER_PIN': 12, 'RINGER_ENABLE_PIN': 18},
+#               {'NS_PIN': 5, 'HOERER_PIN': 6, 'RINGER_PIN': 16, 'RINGER_ENABLE_PIN': 26}]
+# Dial this followed by the extension number (1 for the first extension) to ring another extension.
+INTERCOM_PREFIX = "00"
+
+
+""" GPIO input backend: "RPi.GPIO", or "gpiod" for the GPIO character device with kernel edge timestamps """
+GPIO_BACKEND = "RPi.GPIO"
+# GPIO chip for the gpiod backend. Line offsets on it are the BCM pin numbers above.
+GPIO_CHIP = "/dev/gpiochip0"
+
+
 """ Phone hardware constants """
 # Switch bounce times for edge detection (units: ms)
 DIAL_BOUNCE_TIME = 90
 BUTTON_BOUNCE_TIME = 200
-RECEIVER_BOUNCE_TIME = 100
+# The hook switch level is confirmed once it has been stable this long (units: s)
+HOOK_SETTLE_TIME = 0.02
+# Receiver down for no longer than this is a hook flash rather than a hang up (units: s)
+HOOK_FLASH_MAX = 0.6
+# Gap with no dial pulses after which a digit is complete (units: s)
+DIAL_PULSE_GAP = 0.2
 VOLUME_INCREMENT = 5
+# Seconds without a new digit after which the dialed number is complete
+DIAL_TIMEOUT = 5
+# Digits dialed during a call within this many seconds of the last tones sent are sent together (units: s)
+DTMF_BATCH_WINDOW = 0.3
+# Wait between stopping the bell and answering an incoming call (units: s)
+ANSWER_DELAY = 2
+
+
+""" Bluetooth auto-reconnect """
+# File holding the most recently used bluez device paths, most recent first.
+LAST_DEVICES_FILE = "last_devices.yaml"
+# Number of recently used devices to remember and try to reconnect to.
+RECONNECT_MAX_DEVICES = 3
+# Backoff between reconnect rounds (units: s). The delay doubles each round up to the maximum.
+RECONNECT_INITIAL_DELAY = 2
+RECONNECT_MAX_DELAY = 60
+# Random extra delay added to each wait, as a fraction of the current delay.
+RECONNECT_JITTER = 0.5
+
+
+""" Audio """
+# ALSA device for the handset earpiece
+AUDIO_DEVICE = 'plughw:1,0'
+# Format asked of the output device when querying its native format: (rate in Hz, channels)
+AUDIO_PREFERRED_FORMAT = (48000, 2)
+# Set to (rate, channels) to skip querying the output device.
+AUDIO_NATIVE_FORMAT = None
+# Prompts converted to the native format are kept here between boots.
+AUDIO_CACHE_DIR = "audio_cache"
+
+
+""" Warm start (snapshot.py) """
+# Last online phone, volume levels and speed dial phonebook, so the handset is usable before ofono answers
+STATE_SNAPSHOT_FILE = "state_snapshot.json"
+# Start from the snapshot and read ofono and bluez in the background. telefonoa.py --cold-start turns it off.
+WARM_START = True
+# Seconds a number dialed during a warm start waits for the live modem state
+WARM_START_RECONCILE_TIMEOUT = 10
+# Seconds before reading ofono and bluez again when one of them is not up yet (e.g. at boot), doubling up to the max.
+# A service getting a new owner on the bus tries again at once.
+RECONCILE_RETRY_INITIAL_DELAY = 1
+RECONCILE_RETRY_MAX_DELAY = 30
+
+
+""" Caller ID from the phone's contacts (contacts.py) """
+# sqlite cache of contacts synced from phones
+CONTACTS_DB = "contacts.db"
+# File obexd writes the pulled phonebook to while syncing
+CONTACTS_TRANSFER_FILE = "contacts_transfer.vcf"
+# Numbers are matched on this many trailing digits, so national and international forms match
+CONTACT_NUMBER_DIGITS = 9
+
+
+""" Sampling profiler (profiler.py), started with SIGUSR1 """
+# Seconds to profile for when started by the signal
+PROFILER_DURATION = 30
+# Seconds between stack samples
+PROFILER_INTERVAL = 0.005
+# Collapsed stack profiles are written here
+PROFILER_OUTPUT_DIR = "profiles"
+# Unix socket accepting "profile <seconds>" commands. None for no socket.
+PROFILER_SOCKET = None
 
 
 """ Misc constants """
@@ -0,0 +1,218 @@
+"""
+Caller ID from the connected phone's address book.
+
+Once the modem comes online the phone's contacts are pulled over PBAP through obexd in a background thread and
+stored in a local sqlite cache indexed by phone number, so an incoming number can be turned into a name quickly.
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import time
+from threading import Thread
+from threading import Lock
+
+import dbus
+
+import config
+
+
+def device_address(modem_path):
+    """ /hfp/org/bluez/hci0/dev_AA_BB_CC_DD_EE_FF -> AA:BB:CC:DD:EE:FF """
+    return str(modem_path).rsplit("dev_", 1)[-1].replace("_", ":")
+
+
+def number_key(number):
+    """
+    Key for matching numbers written in different ways (+61 419 239 384, 0419239384): the last
+    config.CONTACT_NUMBER_DIGITS digits.
+    """
+    digits = "".join(c for c in str(number) if c.isdigit())
+    return digits[-config.CONTACT_NUMBER_DIGITS:]
+
+
+_ESCAPE = re.compile(r"\\(.)")
+
+
+def _unescape(value):
+    """ Undo vCard escapes in one pass, so an escaped backslash followed by n stays a backslash and an n. """
+    return _ESCAPE.sub(lambda m: " " if m.group(1) in "nN" else m.group(1), value)
+
+
+def parse_vcards(stream):
+    """
+    Parse a vCard 2.1/3.0 stream one card at a time, without reading the whole stream into memory.
+    :param stream: iterable of text lines, e.g. an open file
+    :return: generator of (key, name, [numbers]); key identifies the card's content for incremental updates.
+    """
+    card = None
+    for line in _unfold(stream):
+        name, _, value = line.partition(":")
+        field = name.split(";")[0].upper()
+        if field == "BEGIN" and value.upper() == "VCARD":
+            card = {"lines": [], "name": None, "numbers": []}
+        elif card is None:
+            continue
+        elif field == "END" and value.upper() == "VCARD":
+            key = hashlib.sha1("\n".join(card["lines"]).encode()).hexdigest()
+            yield key, card["name"], card["numbers"]
+            card = None
+        else:
+            card["lines"].append(line)
+            if field == "FN":
+                card["name"] = _unescape(value)
+            elif field == "N" and card["name"] is None:
+                parts = [p for p in value.split(";") if p]
+                card["name"] = _unescape(" ".join(reversed(parts[:2])))
+            elif field == "TEL" and value != "":
+                card["numbers"].append(value)
+
+
+def _unfold(lines):
+    """ Join folded lines (continuations start with a space or tab) back into logical lines. """
+    logical = None
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if line[:1] in (" ", "\t") and logical is not None:
+            logical += line[1:]
+            continue
+        if logical is not None:
+            yield logical
+        logical = line
+    if logical is not None:
+        yield logical
+
+
+class ContactCache(object):
+    """
+    sqlite cache of the contacts of every phone synced, with an index on number_key for caller ID lookups.
+    Each card is stored under a hash of its content, so a resync only writes the cards that have changed.
+    """
+    def __init__(self, filename=config.CONTACTS_DB):
+        self._lock = Lock()
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS cards (address TEXT, key TEXT, name TEXT, "
+                             "PRIMARY KEY (address, key))")
+            self._db.execute("CREATE TABLE IF NOT EXISTS numbers (address TEXT, key TEXT, number TEXT, "
+                             "number_key TEXT)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS numbers_by_key ON numbers (number_key)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS numbers_by_card ON numbers (address, key)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS sync_state (address TEXT PRIMARY KEY, version TEXT)")
+
+    def lookup(self, number):
+        """ :return: the name for number, or None if it is not a known contact. """
+        with self._lock:
+            row = self._db.execute("SELECT cards.name FROM numbers JOIN cards USING (address, key) "
+                                   "WHERE numbers.number_key = ? LIMIT 1", (number_key(number),)).fetchone()
+        return row[0] if row is not None else None
+
+    def version(self, address):
+        with self._lock:
+            row = self._db.execute("SELECT version FROM sync_state WHERE address = ?", (address,)).fetchone()
+        return row[0] if row is not None else None
+
+    def update(self, address, cards, version):
+        """
+        Bring the cache for address in line with cards (as produced by parse_vcards): new cards are added and cards
+        no longer on the phone removed. Cards are consumed one at a time.
+        :return: (added, removed) card counts
+        """
+        with self._lock, self._db:
+            existing = set(row[0] for row in self._db.execute("SELECT key FROM cards WHERE address = ?", (address,)))
+            seen = set()
+            added = 0
+            for key, name, numbers in cards:
+                if key in existing or key in seen or name is None:
+                    seen.add(key)
+                    continue
+                seen.add(key)
+                self._db.execute("INSERT OR REPLACE INTO cards VALUES (?, ?, ?)", (address, key, name))
+                self._db.executemany("INSERT INTO numbers VALUES (?, ?, ?, ?)",
+                                     [(address, key, n, number_key(n)) for n in numbers])
+                added += 1
+            removed = existing - seen
+            for key in removed:
+                self._db.execute("DELETE FROM cards WHERE address = ? AND key = ?", (address, key))
+                self._db.execute("DELETE FROM numbers WHERE address = ? AND key = ?", (address, key))
+            self._db.execute("INSERT OR REPLACE INTO sync_state VALUES (?, ?)", (address, version))
+        return added, len(removed)
+
+
+class ContactSync(Thread):
+    """
+    Background thread pulling a phone's address book over PBAP via obexd (org.bluez.obex on the session bus).
+    Notes:
+        If the phone reports PBAP database counters and they have not changed since the last sync nothing is
+        transferred. Otherwise the phonebook is pulled to a file, parsed card by card and only the differences are
+        written to the cache.
+    """
+    def __init__(self, cache, address):
+        Thread.__init__(self, name="ContactSync")
+        self.daemon = True
+        self.cache = cache
+        self.address = address
+
+    def run(self):
+        start = time.monotonic()
+        try:
+            bus = dbus.SessionBus()
+            client = dbus.Interface(bus.get_object("org.bluez.obex", "/org/bluez/obex"), "org.bluez.obex.Client1")
+            session = client.CreateSession(self.address, {"Target": "PBAP"})
+        except dbus.exceptions.DBusException as e:
+            print(f"Contact sync with {self.address} not possible: {e.get_dbus_name()}")
+            return
+        try:
+            self._sync(bus, session)
+            print(f"Contact sync with {self.address} took {time.monotonic() - start:.1f} seconds")
+        except dbus.exceptions.DBusException as e:
+            print(f"Contact sync with {self.address} failed: {e.get_dbus_name()}")
+        finally:
+            try:
+                client.RemoveSession(session)
+            except dbus.exceptions.DBusException:
+                pass
+
+    def _sync(self, bus, session):
+        pbap = dbus.Interface(bus.get_object("org.bluez.obex", session), "org.bluez.obex.PhonebookAccess1")
+        pbap.Select("int", "pb")
+        properties = dbus.Interface(bus.get_object("org.bluez.obex", session), "org.freedesktop.DBus.Properties")
+        version = self._version(properties)
+        if version is not None and version == self.cache.version(self.address):
+            print("Contacts unchanged since last sync")
+            return
+
+        filename = os.path.abspath(config.CONTACTS_TRANSFER_FILE)
+        transfer, _ = pbap.PullAll(filename, {"Format": "vcard30", "Fields": dbus.Array(["FN", "N", "TEL"],
+                                                                                         signature="s")})
+        self._wait_for(bus, transfer)
+        try:
+            with open(filename, "r", encoding="utf-8", errors="replace") as stream:
+                added, removed = self.cache.update(self.address, parse_vcards(stream), version)
+            print(f"Contacts synced: {added} added, {removed} removed")
+        finally:
+            os.remove(filename)
+
+    def _version(self, properties):
+        """ PBAP 1.2 database identifier and counters, or None if the phone does not report them. """
+        try:
+            values = properties.GetAll("org.bluez.obex.PhonebookAccess1")
+        except dbus.exceptions.DBusException:
+            return None
+        if "PrimaryCounter" not in values:
+            return None
+        return f"{values.get('DatabaseIdentifier', '')}:{values['PrimaryCounter']}"
+
+    def _wait_for(self, bus, transfer):
+        properties = dbus.Interface(bus.get_object("org.bluez.obex", transfer), "org.freedesktop.DBus.Properties")
+        while True:
+            try:
+                status = properties.Get("org.bluez.obex.Transfer1", "Status")
+            except dbus.exceptions.DBusException:
+                # obexd removes the transfer object as soon as it is complete
+                return
+            if status == "complete":
+                return
+            if status == "error":
+                raise dbus.exceptions.DBusException("Phonebook transfer failed", name="org.bluez.obex.Error.Failed")
+            time.sleep(0.5)
@@ -0,0 +1,87 @@
+import dbus
+from threading import Lock
+
+
+class ProxyCache(object):
+    """
+    Shared cache of dbus proxy objects and interfaces keyed by (bus name, object path, interface).
+    Building a proxy can cost introspection round trips, so proxies are built once and reused.
+    Notes:
+        Entries are dropped when the owner of a bus name changes (e.g. ofono or bluetoothd restarted), when ofono
+        removes a modem (all objects below the modem path) and when ofono removes a call.
+        Owner changes are watched with one NameOwnerChanged match per cached bus name (filtered on arg0), added when
+        the first proxy for that name is built, so clients coming and going on the bus do not wake us.
+    """
+    def __init__(self, bus):
+        self.bus = bus
+        self._entries = {}
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._owner_matches = {}    # bus name -> its NameOwnerChanged match
+
+        self.bus.add_signal_receiver(self._object_removed, signal_name='ModemRemoved',
+                                     dbus_interface='org.ofono.Manager', bus_name='org.ofono')
+        self.bus.add_signal_receiver(self._object_removed, signal_name='CallRemoved',
+                                     dbus_interface='org.ofono.VoiceCallManager', bus_name='org.ofono')
+
+    def get_object(self, bus_name, path):
+        """ Return the (cached) proxy object for path on bus_name. """
+        return self._get(bus_name, path, None)
+
+    def get_interface(self, bus_name, path, interface):
+        """ Return the (cached) dbus.Interface for interface on path on bus_name. """
+        return self._get(bus_name, path, interface)
+
+    def _get(self, bus_name, path, interface):
+        key = (str(bus_name), str(path), interface)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                return entry
+            self.misses += 1
+            watch = key[0] not in self._owner_matches
+            if watch:
+                self._owner_matches[key[0]] = None
+        if watch:
+            self._owner_matches[key[0]] = self.bus.add_signal_receiver(
+                self._name_owner_changed, signal_name='NameOwnerChanged', dbus_interface='org.freedesktop.DBus',
+                bus_name='org.freedesktop.DBus', path='/org/freedesktop/DBus', arg0=key[0])
+        if interface is None:
+            entry = self.bus.get_object(bus_name, path)
+        else:
+            entry = dbus.Interface(self._get(bus_name, path, None), interface)
+        with self._lock:
+            self._entries[key] = entry
+        return entry
+
+    def invalidate(self, bus_name=None, path=None):
+        """
+        Drop cached entries for bus_name and/or every object at or below path.
+        With no arguments the whole cache is cleared.
+        """
+        with self._lock:
+            for key in list(self._entries):
+                if bus_name is not None and key[0] != str(bus_name):
+                    continue
+                if path is not None and not (key[1] == str(path) or key[1].startswith(str(path) + "/")):
+                    continue
+                del self._entries[key]
+                self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'invalidations': self.invalidations,
+                    'entries': len(self._entries)}
+
+    def _name_owner_changed(self, name, old_owner, new_owner):
+        with self._lock:
+            cached = any(key[0] == name for key in self._entries)
+        if cached:
+            print(f"Owner of {name} changed, dropping cached proxies")
+            self.invalidate(bus_name=name)
+
+    def _object_removed(self, path):
+        self.invalidate(bus_name='org.ofono', path=path)
@@ -8,10 +8,11 @@ class AutoAcceptAgent(dbus.service.Object):
 
     AGENT_INTERFACE = 'org.bluez.Agent1'
 
-    def __init__(self, bus, path):
+    def __init__(self, bus, path, proxy_cache):
         self.exit_on_release = True
         super().__init__(bus, path)
-        self.bus = dbus.SystemBus()
+        self.bus = bus
+        self.proxy_cache = proxy_cache
 
     def ask(self, prompt):
         try:
@@ -20,11 +21,11 @@ class AutoAcceptAgent(dbus.service.Object):
             return input(prompt)
 
     def set_trusted(self, path):
-        props = dbus.Interface(self.bus.get_object("org.bluez", path), "org.freedesktop.DBus.Properties")
+        props = self.proxy_cache.get_interface("org.bluez", path, "org.freedesktop.DBus.Properties")
         props.Set("org.bluez.Device1", "Trusted", dbus.Boolean(True, variant_level=1))
 
     def dev_connect(self, path):
-        dev = dbus.Interface(self.bus.get_object("org.bluez", path), "org.bluez.Device1")
+        dev = self.proxy_cache.get_interface("org.bluez", path, "org.bluez.Device1")
         dev.Connect()
 
     def set_exit_on_release(self, exit_on_release):
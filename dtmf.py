@@ -0,0 +1,68 @@
+import queue as Queue
+import time
+from threading import Thread
+
+import dbus
+
+import config
+
+
+class ToneSender(Thread):
+    """
+    Thread that sends digits dialed during a call as DTMF tones, e.g. for IVR menus and voicemail PINs.
+    Notes:
+        The first digit after a quiet spell is sent straight away. Digits that arrive while it is being sent, or
+        within config.DTMF_BATCH_WINDOW seconds after, are sent together in one SendTones call so a burst of digits
+        costs one D-Bus round trip instead of one each.
+    """
+    def __init__(self, send_tones, window=config.DTMF_BATCH_WINDOW):
+        Thread.__init__(self, name="ToneSender")
+        self.daemon = True
+        self.send_tones = send_tones    # callable taking a string of tones, e.g. VoiceCallManager.SendTones
+        self.window = window
+        self.finish = False
+        self._digits = Queue.Queue()
+        self._cleared = 0   # bumped by clear(), so a batch being collected when the call ends is dropped too
+
+    def put(self, digit):
+        self._digits.put(str(digit))
+
+    def clear(self):
+        """ Drop digits not sent yet, e.g. when the call ends. """
+        self._cleared += 1
+        self._drain()
+
+    def run(self):
+        while not self.finish:
+            try:
+                tones = self._digits.get(timeout=1)
+            except Queue.Empty:
+                continue
+            cleared = self._cleared
+            while tones != '' and not self.finish and cleared == self._cleared:
+                self._send(tones)
+                deadline = time.monotonic() + self.window
+                tones = self._drain()
+                while time.monotonic() < deadline:
+                    try:
+                        tones += self._digits.get(timeout=deadline - time.monotonic())
+                    except Queue.Empty:
+                        break
+
+    def _drain(self):
+        tones = ''
+        while True:
+            try:
+                tones += self._digits.get_nowait()
+            except Queue.Empty:
+                return tones
+
+    def _send(self, tones):
+        print(f"Sending tones {tones}")
+        try:
+            self.send_tones(tones)
+        except dbus.exceptions.DBusException as e:
+            print(e.get_dbus_name())
+        except Exception as e:
+            # This thread serves every call, so one failed send must not stop it
+            print(f"Could not send tones {tones}: {e!r}")
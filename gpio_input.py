@@ -0,0 +1,128 @@
+"""
+GPIO inputs (dial, hook switch and buttons) behind one small interface with two backends, chosen by
+config.GPIO_BACKEND:
+
+    "RPi.GPIO"  add_event_detect callbacks. Edges are timestamped when the callback thread gets round to them.
+    "gpiod"     The Linux GPIO character device (libgpiod 2.x bindings). Edges are read in batches with the time
+                the kernel saw them, so pulse timing does not depend on Python scheduling. Works with the gpio-sim
+                and gpio-mockup kernel modules by pointing config.GPIO_CHIP at the simulated chip.
+
+Callbacks are called as callback(pin, level, timestamp): level is 1 (high) or 0 (low) after the edge and
+timestamp is in seconds on the time.monotonic() clock.
+"""
+import select
+import time
+from threading import Thread
+
+import config
+
+RISING = "rising"
+FALLING = "falling"
+BOTH = "both"
+
+
+def create_inputs():
+    if config.GPIO_BACKEND == "gpiod":
+        return GpiodInputs(config.GPIO_CHIP)
+    return RPiGPIOInputs()
+
+
+class RPiGPIOInputs(object):
+    """ Inputs through RPi.GPIO. The bounce filtering is RPi.GPIO's own bouncetime. """
+    def __init__(self):
+        import RPi.GPIO as GPIO
+        self.GPIO = GPIO
+        GPIO.setmode(GPIO.BCM)
+
+    def setup(self, pin, pull_up=True):
+        self.GPIO.setup(pin, self.GPIO.IN, pull_up_down=self.GPIO.PUD_UP if pull_up else self.GPIO.PUD_DOWN)
+
+    def read(self, pin):
+        return 1 if self.GPIO.input(pin) else 0
+
+    def add_event(self, pin, edge, callback, bouncetime=None):
+        """ Call callback for every edge of the given kind on pin, ignoring edges within bouncetime (ms). """
+        def _callback(pin_num):
+            callback(pin_num, self.read(pin_num), time.monotonic())
+        edges = {RISING: self.GPIO.RISING, FALLING: self.GPIO.FALLING, BOTH: self.GPIO.BOTH}
+        if bouncetime is None:
+            self.GPIO.add_event_detect(pin, edges[edge], callback=_callback)
+        else:
+            self.GPIO.add_event_detect(pin, edges[edge], callback=_callback, bouncetime=bouncetime)
+
+    def start(self):
+        pass
+
+    def close(self):
+        self.GPIO.cleanup()
+
+
+class GpiodInputs(Thread):
+    """
+    Inputs through the GPIO character device. Each pin is requested as its own line request; one thread waits on
+    all of their file descriptors and reads whatever edges have queued up in a batch. Bounce filtering is done here
+    with the kernel timestamps, with the same rule as RPi.GPIO: edges within bouncetime of the last one passed on
+    are dropped.
+    """
+    MAX_EVENTS = 64
+
+    def __init__(self, chip):
+        Thread.__init__(self, name="GpiodInputs")
+        self.daemon = True
+        import gpiod
+        from gpiod import line
+        self.gpiod = gpiod
+        self.line = line
+        self.chip = chip
+        self.finish = False
+        self._requests = {}     # pin -> line request
+        self._pull_ups = {}     # pin -> True for pull up, False for pull down
+        self._handlers = {}     # pin -> [callback, bouncetime in s, time of last edge passed on]
+
+    def _settings(self, pull_up, edge=None):
+        edges = {None: self.line.Edge.NONE, RISING: self.line.Edge.RISING, FALLING: self.line.Edge.FALLING,
+                 BOTH: self.line.Edge.BOTH}
+        return self.gpiod.LineSettings(direction=self.line.Direction.INPUT,
+                                       bias=self.line.Bias.PULL_UP if pull_up else self.line.Bias.PULL_DOWN,
+                                       edge_detection=edges[edge], event_clock=self.line.Clock.MONOTONIC)
+
+    def setup(self, pin, pull_up=True):
+        self._requests[pin] = self.gpiod.request_lines(self.chip, consumer="bluetooth-phone",
+                                                       config={pin: self._settings(pull_up)})
+        self._pull_ups[pin] = pull_up
+
+    def read(self, pin):
+        return 1 if self._requests[pin].get_value(pin) == self.line.Value.ACTIVE else 0
+
+    def add_event(self, pin, edge, callback, bouncetime=None):
+        self._requests[pin].reconfigure_lines(config={pin: self._settings(self._pull_ups[pin], edge)})
+        self._handlers[pin] = [callback, (bouncetime or 0) / 1000, None]
+
+    def run(self):
+        requests = {request.fd: pin for pin, request in self._requests.items() if pin in self._handlers}
+        while not self.finish:
+            ready, _, _ = select.select(list(requests), [], [], 1)
+            for fd in ready:
+                pin = requests[fd]
+                for event in self._requests[pin].read_edge_events(self.MAX_EVENTS):
+                    self._dispatch(event)
+
+    def _dispatch(self, event):
+        handler = self._handlers[event.line_offset]
+        timestamp = event.timestamp_ns / 1e9
+        if handler[2] is not None and timestamp - handler[2] < handler[1]:
+            return
+        handler[2] = timestamp
+        level = 1 if event.event_type == self.gpiod.EdgeEvent.Type.RISING_EDGE else 0
+        try:
+            handler[0](event.line_offset, level, timestamp)
+        except Exception as e:
+            # One thread reads every line: a failing handler must not leave the dial, hook and buttons dead
+            print(f"GPIO {event.line_offset} handler failed: {e!r}")
+
+    def close(self):
+        self.finish = True
+        if self.is_alive():
+            self.join(2)
+        for request in self._requests.values():
+            request.release()
@@ -0,0 +1,103 @@
+import time
+from threading import Thread
+from threading import Condition
+
+import config
+
+OFF_HOOK = "OFFHOOK"   # Receiver lifted
+ON_HOOK = "ONHOOK"     # Receiver put down (for longer than a hook flash)
+FLASH = "FLASH"        # Receiver briefly put down and lifted again
+
+
+class HookDebouncer(object):
+    """
+    Timestamp based debouncer for the hook switch. Holds no threads or pins so it can be driven by recorded or
+    synthetic edges.
+    Notes:
+        A new level is confirmed as soon as it has been stable for settle_time seconds, so lifting the receiver is
+        reported settle_time after the last bounce rather than after a fixed bounce window.
+        Going on hook from off hook is only reported once the receiver has stayed down for flash_max
+        seconds. If it is lifted again before that the whole pulse is reported as a hook flash instead.
+        Levels are the pin levels: 1 (high) is receiver up, 0 (low) is receiver down.
+    """
+    def __init__(self, initial_level, settle_time=config.HOOK_SETTLE_TIME, flash_max=config.HOOK_FLASH_MAX):
+        self.settle_time = settle_time
+        self.flash_max = flash_max
+        self.level = initial_level          # Confirmed level
+        self._raw_level = initial_level     # Level after the last edge
+        self._raw_since = None              # Time of the last edge
+        self._down_since = None             # Time the receiver went down from off hook, until reported or flashed
+
+    def edge(self, level, t):
+        """ Record the pin level read at time t (seconds). Repeated levels are ignored. """
+        if level != self._raw_level:
+            self._raw_level = level
+            self._raw_since = t
+
+    def poll(self, t):
+        """ :return: list of (event, time the event was confirmed) that are due at time t. """
+        events = []
+        if self._raw_since is not None and self._raw_level != self.level and t >= self._raw_since + self.settle_time:
+            confirmed_at = self._raw_since + self.settle_time
+            self.level = self._raw_level
+            if self.level == 1:
+                if self._down_since is not None:
+                    events.append((FLASH, confirmed_at))
+                    self._down_since = None
+                else:
+                    events.append((OFF_HOOK, confirmed_at))
+            else:
+                self._down_since = self._raw_since
+        if self._down_since is not None and self.level == 0 and t >= self._down_since + self.flash_max:
+            events.append((ON_HOOK, self._down_since + self.flash_max))
+            self._down_since = None
+        return events
+
+    def next_deadline(self):
+        """ :return: the time at which poll() may next produce an event, or None if nothing is pending. """
+        deadlines = []
+        if self._raw_since is not None and self._raw_level != self.level:
+            deadlines.append(self._raw_since + self.settle_time)
+        if self._down_since is not None and self.level == 0:
+            deadlines.append(self._down_since + self.flash_max)
+        return min(deadlines) if len(deadlines) > 0 else None
+
+
+class HookSwitch(Thread):
+    """
+    Thread that feeds hook switch edges into a HookDebouncer and calls the handlers with confirmed events.
+    edge() is the GPIO callback; it only timestamps the level and wakes the thread so the callback returns quickly.
+    """
+    def __init__(self, initial_level, on_change, on_flash):
+        Thread.__init__(self, name="HookSwitch")
+        self.daemon = True
+        self.debouncer = HookDebouncer(initial_level)
+        self.on_change = on_change      # Called with True when the receiver is lifted, False when it is put down
+        self.on_flash = on_flash
+        self.finish = False
+        self._condition = Condition()
+
+    def edge(self, level, t=None):
+        with self._condition:
+            self.debouncer.edge(level, time.monotonic() if t is None else t)
+            self._condition.notify()
+
+    def run(self):
+        while not self.finish:
+            with self._condition:
+                deadline = self.debouncer.next_deadline()
+                if deadline is None:
+                    self._condition.wait(1)
+                else:
+                    self._condition.wait(max(0, deadline - time.monotonic()))
+                events = self.debouncer.poll(time.monotonic())
+            for event, _ in events:
+                # A failing handler (e.g. ofono refusing to answer a call the caller has just hung up) must not
+                # stop the hook switch for good.
+                try:
+                    if event == FLASH:
+                        self.on_flash()
+                    else:
+                        self.on_change(event == OFF_HOOK)
+                except Exception as e:
+                    print(f"Hook switch: handler for {event} failed: {e!r}")
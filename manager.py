@@ -4,18 +4,22 @@ import dbus.mainloop.glib
 from gi.repository import GLib
 import time
 from threading import Thread
-import wave
-import alsaaudio
+from threading import Event
+from threading import Lock
 
+import audio
+import contacts
 import dbus_custom_services
+import dbus_cache
+import dtmf
 import bluetooth
+import service_watchdog
+import snapshot
 import config
 
 
 class PhoneManager(object):
 
-    CHUNK = 1024
-
     def __init__(self):
         """
         The PhoneManager class manages the setup and pull down of calls on an open bluetooth connection.
@@ -25,47 +29,158 @@ class PhoneManager(object):
         self.loop_started = False
         self.active_call_path = None  # path of phone (ofono modem object) currently connected
         self.call_in_progress = False
+        self.call_ringing = False  # An incoming call has not been answered yet
+        self.live_calls = set()  # paths of the calls ofono has added and not yet removed, held or waiting ones too
+        self.ringers = []  # RingerManagers of the handset(s), rung directly rather than over the D-Bus
+        self.audio = audio.AudioPlayer()  # Single audio player for prompts, shared with the handset(s)
+        self.audio.prepare()
+        # Digits dialed during a call are sent as DTMF tones
+        self.tone_sender = dtmf.ToneSender(self.send_tones)
+        self.tone_sender.start()
+        # Contacts synced from the phone for caller ID
+        self.contact_cache = contacts.ContactCache()
+        self.contact_sync = None
+        self.call_matches = []  # CallAdded/CallRemoved signal matches, replaced whenever the modem becomes ready
+        # Serializes replacing the call listeners and proxies: the modem ready signal (GLib thread), the warm start
+        # reconcile and ofono going away can all do it at once.
+        self._listen_lock = Lock()
+        self.voice_call_manager = None
+        # Last known state saved for a warm start, or None when warm starts are turned off
+        self.snapshot = snapshot.StateSnapshot(config.STATE_SNAPSHOT_FILE) if config.WARM_START else None
+        # Set once the live ofono/bluez state has been read, or reading it has failed and is retried in the background
+        self.reconciled = Event()
+        self._reconcile_wakeup = Event()  # cuts the wait before the next try short
+        self.closed = False
 
         # Set up mainloop for Dbus services and start status_service that is used to broadcast call readiness of phone
         dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
         self.bus = dbus.SystemBus()
         self.status_service = dbus_custom_services.phone_status_service()
         self._setup_dbus_loop()  # spawn thread that monitors the mainloop.
+        # Shared cache of dbus proxies so they are not rebuilt (and re-introspected) on every action.
+        self.proxy_cache = dbus_cache.ProxyCache(self.bus)
 
         # bt connection object that wraps ofono functions related to bt connection
-        self.bt_conn = bluetooth.connection(self.bus, self.loop_started, self.status_service)
+        self.bt_conn = bluetooth.connection(self.bus, self.loop_started, self.status_service, self.proxy_cache,
+                                            self.snapshot)
         # ofono object that controls volume functions. Note these functions called from telephone object.
         self.volume_controller = None
         self.mic_volume = None
         self.speaker_volume = None
         self.muted = None  # Not implemented: Ofono has an open bug from 2014 identifying that this feature is not implemented.
+        if self.snapshot is not None:
+            self.speaker_volume = self.snapshot.get("speaker_volume")
+            self.mic_volume = self.snapshot.get("mic_volume")
 
-        # A modem must be present and it must be online to start listening for calls.
-        if self.bt_conn.has_modems and self.bt_conn.is_online:
-            self._listen_for_calls(config.ALREADY_ON)
-        else:
-            # if not then listen on the dbus status_service for the modem to be available and online.
-            self._listen_to_phone_ready_service()
+        # Rebuild ofono/bluez subscriptions if either service restarts.
+        self.watchdog = service_watchdog.ServiceWatchdog(self.bus, self.bt_conn, self.ofono_lost, self._service_back)
+
+        # Listen on the dbus status_service for the modem to become available and online (again).
+        self._listen_to_phone_ready_service()
+
+        if self.snapshot is not None and self.snapshot.loaded:
+            """
+            Warm start: the handset is usable straight away with the last known state while ofono and bluez are
+            queried in the background.
+            """
+            print(f"Warm start, last online phone {self.bt_conn.modem_name} ({self.bt_conn.last_online_modem})")
+            self._use_last_online_modem()
+            self._start_reconcile()
+        elif not self._reconcile_once():
+            self._start_reconcile()
 
         print("Bluetooth connection configured")
 
+    def close(self):
+        """ Stop the threads and subscriptions of the phone manager. """
+        self.closed = True
+        self._reconcile_wakeup.set()
+        self.tone_sender.finish = True
+        self.watchdog.close()
+        self.loop.quit()
+
     def _setup_dbus_loop(self):
         """
         Start the mainloop inside a new thread. this must be executed before creating new services or subscribing to signals.
         """
         dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
         self.loop = GLib.MainLoop()
-        self._thread = Thread(target=self.loop.run)
+        self._thread = Thread(target=self.loop.run, name="GLibLoop")
         self._thread.start()
         self.loop_started = True
 
 
+    def _use_last_online_modem(self):
+        """
+        Dial and set the volume through the modem that was online when the snapshot was saved, until the live state
+        is known. Building the proxies does not wait for ofono.
+        """
+        path = self.bt_conn.last_online_modem
+        if path is None:
+            return
+        try:
+            self.voice_call_manager = self.proxy_cache.get_interface('org.ofono', path, 'org.ofono.VoiceCallManager')
+            self.volume_controller = self.proxy_cache.get_interface('org.ofono', path, 'org.ofono.CallVolume')
+        except dbus.exceptions.DBusException as e:
+            print(f"Last online phone not usable: {e.get_dbus_name()}")
+            self.voice_call_manager = None
+            self.volume_controller = None
+
+    def _start_reconcile(self):
+        reconcile = Thread(target=self._reconcile, name="Reconcile")
+        reconcile.daemon = True
+        reconcile.start()
+
+    def _reconcile(self):
+        """
+        Read the live state until it succeeds. ofono or bluez may not be up yet, e.g. at boot, so every failure waits
+        longer before the next try.
+        """
+        delay = config.RECONCILE_RETRY_INITIAL_DELAY
+        while not self._reconcile_once():
+            # Dialing waits for the live state, not for every try to fail
+            self.reconciled.set()
+            print(f"Reading ofono and bluez state again in {delay} seconds")
+            self._reconcile_wakeup.wait(delay)
+            self._reconcile_wakeup.clear()
+            if self.closed:
+                return
+            delay = min(delay * 2, config.RECONCILE_RETRY_MAX_DELAY)
+
+    def _reconcile_once(self):
+        """
+        Read the live modem state from ofono and bluez, replacing whatever the snapshot said.
+        :return: False if ofono or bluez could not be read
+        """
+        start = time.monotonic()
+        try:
+            self.bt_conn.connect()
+        except Exception as e:
+            print(f"Could not read ofono and bluez state: {e!r}")
+            return False
+        # A modem must be present and it must be online to start listening for calls.
+        if self.bt_conn.has_modems and self.bt_conn.is_online:
+            self._listen_for_calls(config.ALREADY_ON)
+        else:
+            with self._listen_lock:
+                if len(self.call_matches) == 0:
+                    # No phone online after all: stop using the one from the snapshot
+                    self.voice_call_manager = None
+                    self.volume_controller = None
+        self.reconciled.set()
+        print(f"ofono and bluez state read in {time.monotonic() - start:.2f} seconds")
+        return True
+
+    def _service_back(self, name):
+        """ ofono or bluez has a new owner on the bus: a reconcile waiting to try again can go now. """
+        self._reconcile_wakeup.set()
+
     def _listen_to_phone_ready_service(self):
         """
-            Listen for the emit signal from custom service org.frank. Only necesary when no modem was
-            present at startup
+            Listen for the emit signal from custom service org.frank. Fired when a modem comes online, including
+            after a reconnect or an ofono restart.
         """
-        status_service_interface = dbus.Interface(self.bus.get_object('org.frank', '/'), "phone.status")
+        status_service_interface = self.proxy_cache.get_interface('org.frank', '/', "phone.status")
         status_service_interface.connect_to_signal('emit', self._listen_for_calls)
 
     def _listen_for_calls(self, value):
@@ -76,16 +191,69 @@ class PhoneManager(object):
         else:
             return None
 
+        with self._listen_lock:
+            self._replace_call_listeners()
+
+    def _replace_call_listeners(self):
         if self.bt_conn.has_modems:
             print("Create listener for calls")
-            self.voice_call_manager = dbus.Interface(self.bt_conn.modem_object, 'org.ofono.VoiceCallManager')
+            for match in self.call_matches:
+                match.remove()
+            self.live_calls.clear()
+            self.call_in_progress = False
+            if self.call_ringing:
+                # The call ringing before the modem was (re)connected can never send CallRemoved now
+                self.call_ringing = False
+                self.ring(config.RING_STOP)
+            self.voice_call_manager = self.proxy_cache.get_interface('org.ofono', self.bt_conn.modem_object.object_path,
+                                                                     'org.ofono.VoiceCallManager')
             print("Device name = {:s} ".format(self.bt_conn.modem_name))
-            self.bt_conn.modem_object.connect_to_signal("CallAdded", self.set_call_in_progress,
-                                                        dbus_interface='org.ofono.VoiceCallManager')
-            self.bt_conn.modem_object.connect_to_signal("CallRemoved", self.set_call_ended,
-                                                        dbus_interface='org.ofono.VoiceCallManager')
+            self.call_matches = [
+                self.bt_conn.modem_object.connect_to_signal("CallAdded", self.set_call_in_progress,
+                                                            dbus_interface='org.ofono.VoiceCallManager'),
+                self.bt_conn.modem_object.connect_to_signal("CallRemoved", self.set_call_ended,
+                                                            dbus_interface='org.ofono.VoiceCallManager')]
             self.active_call_path = self.bt_conn.modem_object.object_path
             self._setup_volume_control()
+            self._sync_contacts()
+            # Incoming calls can ring again from here on
+            self.watchdog.listening_for_calls()
+
+    def ofono_lost(self):
+        """
+        ofono has left the bus, taking any call with it: no CallRemoved will come, so stop the bells and forget the
+        call state and listeners here. They are rebuilt when ofono is back and the modem is ready.
+        """
+        with self._listen_lock:
+            for match in self.call_matches:
+                match.remove()
+            self.call_matches = []
+            self.voice_call_manager = None
+            self.volume_controller = None
+        self.tone_sender.clear()
+        self.live_calls.clear()
+        self.call_in_progress = False
+        self.call_ringing = False
+        self.ring(config.RING_STOP)
+
+    def _sync_contacts(self):
+        """ Pull the phone's address book in the background so it never delays the phone being ready. """
+        if self.contact_sync is None or not self.contact_sync.is_alive():
+            address = contacts.device_address(self.bt_conn.modem_object.object_path)
+            self.contact_sync = contacts.ContactSync(self.contact_cache, address)
+            self.contact_sync.start()
+
+    def add_ringer(self, ringer_manager):
+        self.ringers.append(ringer_manager)
+
+    def ring(self, value):
+        """
+        Start (config.RING_START) or stop (config.RING_STOP) every bell. The ringers are told directly; the ring
+        signal is still emitted on the phone status service for anything else listening.
+        """
+        for ringer_manager in self.ringers:
+            ringer_manager.control_ringer(value)
+        self.status_service.ring(value)
 
     def null_handler(self,value):
         pass
@@ -100,11 +268,18 @@ class PhoneManager(object):
         print("Call in progress")
         direction = properties['State']  # Incoming or dialing (outbound)
         print(f"Call direction: {direction}")
+        self.live_calls.add(path)
         self.call_in_progress = True
-        if direction == 'incoming':
+        if direction == 'waiting':
+            # A second call during this one: a hook flash answers it, the call in progress stays as it is
+            print(f"Call waiting on {path}")
+        elif direction == 'incoming':
             print(F"Inbound call detected on {path}")
+            caller = properties.get('LineIdentification', '')
+            print(f"Caller: {self.contact_cache.lookup(caller) or caller}")
             self.active_call_path = path
-            self.status_service.ring(config.RING_START)
+            self.call_ringing = True
+            self.ring(config.RING_START)
             #self.status_service.send_to_ringer(config.RING_START, reply_handler=self.null_handler,
             #                                   error_handler=self.null_handler)
         else:
@@ -119,9 +294,10 @@ class PhoneManager(object):
         """ First thing is to stop the ringer via the Dbus singalling."""
         #self.status_service.send_to_ringer(config.RING_STOP, reply_handler=self.null_handler,
         #                                   error_handler=self.null_handler)
-        self.status_service.ring(config.RING_STOP)
-        call = dbus.Interface(self.bus.get_object('org.ofono', self.active_call_path), 'org.ofono.VoiceCall')
-        time.sleep(2)
+        self.ring(config.RING_STOP)
+        self.call_ringing = False
+        call = self.proxy_cache.get_interface('org.ofono', self.active_call_path, 'org.ofono.VoiceCall')
+        time.sleep(config.ANSWER_DELAY)
         call.Answer()
         print(f"    Voice Call {self.active_call_path} Answered")
 
@@ -132,11 +308,47 @@ class PhoneManager(object):
         :return:
         """
         print("Call ended.")
+        self.live_calls.discard(object)
+        if len(self.live_calls) > 0:
+            # A held or waiting call is still up: hanging up must still end it and digits are still tones
+            print(f"{len(self.live_calls)} call(s) still up")
+            return
         self.call_in_progress = False
+        self.call_ringing = False
+        self.tone_sender.clear()
         """Send the ringer_stop signal to the RingerManager to stop the ringing"""
         #self.status_service.send_to_ringer(config.RING_STOP, reply_handler=self.null_handler,
         #                                   error_handler=self.null_handler)
-        self.status_service.ring(config.RING_STOP)
+        self.ring(config.RING_STOP)
+
+    def hook_flash(self):
+        """
+        Call waiting: answer a waiting call and put the active one on hold, otherwise swap between the active and
+        held calls.
+        """
+        try:
+            calls = self.voice_call_manager.GetCalls()
+            if any(properties['State'] == 'waiting' for _, properties in calls):
+                print("Answering waiting call")
+                self.voice_call_manager.HoldAndAnswer()
+            else:
+                print("Swapping calls")
+                self.voice_call_manager.SwapCalls()
+        except dbus.exceptions.DBusException as e:
+            print(e.get_dbus_name())
+
+    def send_tone(self, digit):
+        """ Queue a digit dialed during the call to be sent as a DTMF tone. """
+        self.tone_sender.put(digit)
+
+    def send_tones(self, tones):
+        voice_call_manager = self.voice_call_manager
+        if voice_call_manager is None:
+            # ofono went away after the digits were queued, and the call with it
+            print(f"No phone connected, tones {tones} not sent")
+            return
+        voice_call_manager.SendTones(tones)
+
     def end_call(self):
         """
         Method to finalize the current (all, actually) call
@@ -147,16 +359,23 @@ class PhoneManager(object):
         """
         Method to place call. It handles incorrectly dialed numbers thanks to ofono exceptions
         """
+        if self.voice_call_manager is None:
+            # Dialed during a warm start before the live modem state is known
+            self.reconciled.wait(config.WARM_START_RECONCILE_TIMEOUT)
+        if self.voice_call_manager is None:
+            print("No phone connected")
+            self.audio.start_file("/home/pi/Documents/repos/bluetooth-phone/not_connected.wav")
+            return
         try:
             self.voice_call_manager.Dial(str(number), hide_id)
         except dbus.exceptions.DBusException as e:
             name = e.get_dbus_name()
             if name == 'org.freedesktop.DBus.Error.UnknownMethod':
                 print("Ofono not running")
-                self.start_file("/home/pi/Documents/repos/bluetooth-phone/not_connected.wav")
+                self.audio.start_file("/home/pi/Documents/repos/bluetooth-phone/not_connected.wav")
             elif name == 'org.ofono.Error.InvalidFormat':
                 print("Invalid dialed number format!")
-                self.start_file("/home/pi/Documents/repos/bluetooth-phone/format_incorrect.wav")
+                self.audio.start_file("/home/pi/Documents/repos/bluetooth-phone/format_incorrect.wav")
             else:
                 print(name)
 
@@ -165,11 +384,17 @@ class PhoneManager(object):
     def _setup_volume_control(self):
         # if self.active_call_path is not None:
         if self.bt_conn.has_modems:
-            self.volume_controller = dbus.Interface(self.bus.get_object('org.ofono', self.active_call_path),
-                                                    'org.ofono.CallVolume')
-            self.speaker_volume = self.volume_controller.GetProperties()['SpeakerVolume']
-            self.mic_volume = self.volume_controller.GetProperties()['MicrophoneVolume']
-            self.muted = self.volume_controller.GetProperties()['Muted']
+            self.volume_controller = self.proxy_cache.get_interface('org.ofono', self.active_call_path,
+                                                                    'org.ofono.CallVolume')
+            properties = self.volume_controller.GetProperties()
+            self.speaker_volume = properties['SpeakerVolume']
+            self.mic_volume = properties['MicrophoneVolume']
+            self.muted = properties['Muted']
+            self._save_volume()
+
+    def _save_volume(self):
+        if self.snapshot is not None:
+            self.snapshot.update(speaker_volume=int(self.speaker_volume), mic_volume=int(self.mic_volume))
 
     """ API for controlling volume from handset."""
 
@@ -179,6 +404,7 @@ class PhoneManager(object):
             self.mic_volume += increment
             self.volume_controller.SetProperty('SpeakerVolume', dbus.Byte(int(self.speaker_volume)))
             self.volume_controller.SetProperty('MicrophoneVolume', dbus.Byte(int(self.mic_volume)))
+            self._save_volume()
 
     def volume_down(self, increment=5):
         if self.volume_controller is not None:
@@ -186,6 +412,7 @@ class PhoneManager(object):
             self.mic_volume -= increment
             self.volume_controller.SetProperty('SpeakerVolume', dbus.Byte(int(self.speaker_volume)))
             self.volume_controller.SetProperty('MicrophoneVolume', dbus.Byte(int(self.mic_volume)))
+            self._save_volume()
 
     def mute_toggle(self):
         """ There is a bug in ofono. Mute property setter is not implemented"""
@@ -195,54 +422,3 @@ class PhoneManager(object):
         #     self.muted = not self.muted
         #     print(f"muted {self.muted}")
         #     self.volume_controller.SetProperty('Muted', dbus.Boolean(self.muted))
-
-    def start_file(self, filename, loop=False):
-        """
-        Start a thread reproducing an audio file
-        :param filename: The name of the file to play
-        :param loop: If the file should be played as a loop (like in the case of the dial tone)
-        """
-        self._thread = Thread(target=self.__play_file, args=[filename, loop])
-        self._thread.start()
-        self.playing_audio = True
-
-    def __play_file(self, filename, loop):
-        """
-        Private function handling the wav file replay
-        :param filename: The name of the file to play
-        :param loop: If the file should be played as a loop (like in the case of the dial tone)
-        """
-        self.stop_audio = False
-        if not loop:
-            # open a wav format music
-            f = wave.open(filename, "rb")
-            # open stream
-            stream = alsaaudio.PCM(type=alsaaudio.PCM_PLAYBACK,
-                                   mode=alsaaudio.PCM_NORMAL)
-            stream.setchannels(f.getnchannels())
-            stream.setrate(f.getframerate())
-            # read data
-            data = f.readframes(self.CHUNK)
-
-            # play stream
-            while data and not self.stop_audio:
-                stream.write(data)
-                data = f.readframes(self.CHUNK)
-        else:
-            # open a wav format music
-            f = wave.open(filename, "rb")
-            # open stream
-            stream = alsaaudio.PCM(type=alsaaudio.PCM_PLAYBACK,
-                                   mode=alsaaudio.PCM_NORMAL)
-            stream.setchannels(f.getnchannels())
-            stream.setrate(f.getframerate())
-            # read data
-            data = f.readframes(self.CHUNK)
-
-            # play stream
-            while loop and not self.stop_audio:
-                f.rewind()
-                data = f.readframes(self.CHUNK)
-                while data and not self.stop_audio:
-                    stream.write(data)
-                    data = f.readframes(self.CHUNK)
\ No newline at end of file
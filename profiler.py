@@ -0,0 +1,134 @@
+"""
+On demand sampling profiler for finding out what the phone is busy with in the field.
+
+Nothing runs until profiling is requested, either by a signal:
+
+    kill -USR1 <pid of telefonoa.py>
+
+or, if config.PROFILER_SOCKET is set, over the control socket:
+
+    echo "profile 30" | nc -U /tmp/bluetooth-phone-profiler.sock
+
+Every thread's stack is sampled for the requested number of seconds and written in collapsed stack format
+(one "thread;outer;...;inner count" line per distinct stack), ready for flamegraph.pl or speedscope.
+The ringer runs in its own process and is not sampled.
+"""
+import collections
+import os
+import signal
+import socket
+import sys
+import time
+from threading import Thread
+from threading import Lock
+from threading import enumerate as all_threads
+
+import config
+
+_lock = Lock()
+_running = None
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)})"
+
+
+class SamplingProfiler(Thread):
+    """ Thread that samples the stacks of every other thread at a fixed interval for a fixed duration. """
+    def __init__(self, duration, interval=config.PROFILER_INTERVAL, output_dir=config.PROFILER_OUTPUT_DIR):
+        Thread.__init__(self, name="Profiler")
+        self.daemon = True
+        self.duration = duration
+        self.interval = interval
+        self.output = os.path.join(output_dir, time.strftime("profile-%Y%m%d-%H%M%S.folded"))
+        os.makedirs(output_dir, exist_ok=True)
+        self.stacks = collections.Counter()
+        self.samples = 0
+
+    def run(self):
+        global _running
+        print(f"Profiling for {self.duration} seconds")
+        deadline = time.monotonic() + self.duration
+        try:
+            while time.monotonic() < deadline:
+                self.sample()
+                time.sleep(self.interval)
+            self.write()
+            print(f"Profile of {self.samples} samples written to {self.output}")
+        finally:
+            with _lock:
+                _running = None
+
+    def sample(self):
+        names = {thread.ident: thread.name for thread in all_threads()}
+        for ident, frame in sys._current_frames().items():
+            if ident == self.ident:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            self.stacks[";".join(reversed(stack))] += 1
+        self.samples += 1
+
+    def write(self):
+        with open(self.output, "w") as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f"{stack} {count}\n")
+
+
+def start(duration=config.PROFILER_DURATION, blocking=True):
+    """
+    Start profiling unless a profile is already being taken.
+    :param blocking: False to give up instead of waiting if another start() is in progress.
+    :return: the file the profile will be written to, or None if one is already running.
+    """
+    global _running
+    if not _lock.acquire(blocking):
+        return None
+    try:
+        if _running is not None:
+            return None
+        _running = SamplingProfiler(duration)
+        _running.start()
+        return _running.output
+    finally:
+        _lock.release()
+
+
+def _signal_handler(signum, frame):
+    # The handler runs in the main thread between two bytecodes, possibly while start() there holds the lock.
+    # Waiting for it would never return.
+    start(blocking=False)
+
+
+def _serve(path):
+    """ Control socket: each connection sends "profile [seconds]" and gets back the output file name. """
+    if os.path.exists(path):
+        os.unlink(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen(1)
+    while True:
+        connection, _ = server.accept()
+        with connection:
+            words = connection.recv(256).decode(errors="replace").split()
+            if len(words) > 0 and words[0] == "profile":
+                duration = float(words[1]) if len(words) > 1 else config.PROFILER_DURATION
+                output = start(duration)
+                reply = output if output is not None else "already profiling"
+            else:
+                reply = "unknown command"
+            connection.sendall((reply + "\n").encode())
+
+
+def install():
+    """
+    Make profiling available: SIGUSR1 starts a profile and, if configured, so does the control socket.
+    Must be called from the main thread. Costs nothing until a profile is requested.
+    """
+    signal.signal(signal.SIGUSR1, _signal_handler)
+    if config.PROFILER_SOCKET is not None:
+        Thread(target=_serve, args=(config.PROFILER_SOCKET,), name="ProfilerSocket", daemon=True).start()
@@ -0,0 +1,266 @@
+"""
+Capture, replay and calibration of raw dial and hook switch edge traces.
+
+Every vintage dial runs at a slightly different speed and make/break ratio, so the bounce and gap constants in config
+are best derived from the phone itself:
+
+    python3 pulse_trace.py capture --pin 19 --expect 1234567890 traces/dial_1.trace
+    python3 pulse_trace.py replay traces/*.trace
+    python3 pulse_trace.py calibrate traces/*.trace
+
+A trace file is a one line text header followed by fixed size binary records:
+
+    PTRACE1 <kind> <pin> <initial level> <expected symbols>\n
+    <pin: uint8><level: uint8><microseconds since previous edge: uint32> ...
+
+kind is "dial" (expected symbols are the digits dialed) or "hook" (expected symbols are U/D for each settled handset
+up/down transition, F for a hook flash).
+"""
+import argparse
+import math
+import struct
+import time
+
+import config
+import gpio_input
+import hook_switch
+
+MAGIC = "PTRACE1"
+RECORD = struct.Struct("<BBI")
+
+
+class Trace(object):
+    """ Raw edges from one pin. Edges are (time in seconds from start of capture, level) tuples. """
+    def __init__(self, kind, pin, initial_level, expected, edges=None):
+        self.kind = kind
+        self.pin = pin
+        self.initial_level = initial_level
+        self.expected = expected
+        self.edges = edges if edges is not None else []
+
+    def save(self, filename):
+        with open(filename, "wb") as f:
+            f.write(f"{MAGIC} {self.kind} {self.pin} {self.initial_level} {self.expected or '-'}\n".encode())
+            last_us = 0
+            for t, level in self.edges:
+                t_us = int(round(t * 1e6))
+                f.write(RECORD.pack(self.pin, level, t_us - last_us))
+                last_us = t_us
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, "rb") as f:
+            header = f.readline().decode().split()
+            if len(header) != 5 or header[0] != MAGIC:
+                raise ValueError(f"{filename} is not a pulse trace")
+            data = f.read()
+        expected = "" if header[4] == "-" else header[4]
+        edges = []
+        t_us = 0
+        for pin, level, delta in RECORD.iter_unpack(data):
+            t_us += delta
+            edges.append((t_us / 1e6, level))
+        return cls(header[1], int(header[2]), int(header[3]), expected, edges)
+
+
+class TraceRecorder(object):
+    """
+    Records every edge on a pin, with no bounce filtering, through the input backend in config.GPIO_BACKEND.
+    With the gpiod backend the edges carry kernel timestamps.
+    """
+    def __init__(self, pin, kind, expected, pull_up=True):
+        self.inputs = gpio_input.create_inputs()
+        self.inputs.setup(pin, pull_up=pull_up)
+        self.start = time.monotonic()
+        self.trace = Trace(kind, pin, self.inputs.read(pin), expected)
+        self.inputs.add_event(pin, gpio_input.BOTH, self._edge)
+        self.inputs.start()
+
+    def _edge(self, pin_num, level, timestamp):
+        self.trace.edges.append((max(timestamp - self.start, 0.0), level))
+
+    def stop(self):
+        self.inputs.close()
+        return self.trace
+
+
+class DialDecoder(object):
+    """
+    Offline model of RotaryDial: falling edges closer than bounce_time (ms) to the previous accepted edge are dropped
+    (bouncetime), and a digit is reported by the first check of RotaryDial.run that finds no pulse for pulse_gap
+    seconds. RotaryDial.run checks every pulse_gap / 4 seconds; the checks are taken to start with the capture.
+    """
+    POLLS_PER_GAP = 4   # as in RotaryDial.run
+
+    def __init__(self, bounce_time=config.DIAL_BOUNCE_TIME, pulse_gap=config.DIAL_PULSE_GAP):
+        self.bounce_time = bounce_time
+        self.pulse_gap = pulse_gap
+
+    def _reported_at(self, last_pulse):
+        """ Time of the first check at least pulse_gap after last_pulse. """
+        poll = self.pulse_gap / self.POLLS_PER_GAP
+        return math.ceil((last_pulse + self.pulse_gap) / poll - 1e-9) * poll
+
+    def decode(self, trace):
+        """ :return: list of (symbol, latency in seconds from the last pulse to the digit being reported) """
+        digits = []
+        count = 0
+        last_accepted = None
+        level = trace.initial_level
+        for t, new_level in trace.edges:
+            falling = level == 1 and new_level == 0
+            level = new_level
+            if not falling:
+                continue
+            if last_accepted is not None and (t - last_accepted) * 1000 < self.bounce_time:
+                continue
+            if count > 0 and t >= self._reported_at(last_accepted):
+                digits.append((str(count % 10), self._reported_at(last_accepted) - last_accepted))
+                count = 0
+            count += 1
+            last_accepted = t
+        if count > 0:
+            digits.append((str(count % 10), self._reported_at(last_accepted) - last_accepted))
+        return digits
+
+
+class HookDecoder(object):
+    """
+    Replays a hook trace through hook_switch.HookDebouncer. Reports U (receiver up), D (receiver down) and F (hook
+    flash), with the latency from the edge that started the transition to it being confirmed.
+    """
+    def __init__(self, settle_time=config.HOOK_SETTLE_TIME, flash_max=config.HOOK_FLASH_MAX):
+        self.settle_time = settle_time
+        self.flash_max = flash_max
+
+    def decode(self, trace):
+        symbols = []
+        debouncer = hook_switch.HookDebouncer(trace.initial_level, self.settle_time, self.flash_max)
+        names = {hook_switch.OFF_HOOK: "U", hook_switch.ON_HOOK: "D", hook_switch.FLASH: "F"}
+        started = None
+        raw_level = trace.initial_level
+        edges = trace.edges + [(float("inf"), None)]
+        for t, level in edges:
+            deadline = debouncer.next_deadline()
+            while deadline is not None and deadline < t:
+                for event, confirmed_at in debouncer.poll(deadline):
+                    symbols.append((names[event], confirmed_at - started))
+                deadline = debouncer.next_deadline()
+            if level is not None:
+                if raw_level == debouncer.level and level != debouncer.level:
+                    started = t
+                raw_level = level
+                debouncer.edge(level, t)
+        return symbols
+
+
+def edit_distance(a, b):
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+def replay(traces, decoder):
+    """
+    Run decoder over every trace.
+    :return: (symbol error rate, mean decode latency in seconds)
+    """
+    errors = 0
+    expected = 0
+    latencies = []
+    for trace in traces:
+        decoded = decoder.decode(trace)
+        errors += edit_distance("".join(s for s, _ in decoded), trace.expected)
+        expected += len(trace.expected)
+        latencies.extend(latency for _, latency in decoded)
+    error_rate = errors / expected if expected > 0 else 0.0
+    latency = sum(latencies) / len(latencies) if len(latencies) > 0 else 0.0
+    return error_rate, latency
+
+
+def calibrate(traces):
+    """
+    Grid search bounce and gap parameters over a corpus of traces. Of the settings with the lowest error rate the
+    bounce time in the middle of the range is chosen (most noise margin either way), and the gap a quarter of the way
+    into its range, trading a little latency for margin against a slow dial.
+    :return: dict of config constant name -> best value
+    """
+    result = {}
+    dial = [t for t in traces if t.kind == "dial"]
+    hook = [t for t in traces if t.kind == "hook"]
+    if len(dial) > 0:
+        scores = {}
+        for bounce in range(5, 155, 5):
+            for gap_ms in range(50, 505, 10):
+                scores[(bounce, gap_ms)] = replay(dial, DialDecoder(bounce, gap_ms / 1000))
+        best_error = min(error_rate for error_rate, _ in scores.values())
+        bounces = sorted(set(b for (b, _), (e, _) in scores.items() if e == best_error))
+        bounce = bounces[len(bounces) // 2]
+        gaps = sorted(g for (b, g), (e, _) in scores.items() if b == bounce and e == best_error)
+        gap_ms = gaps[(len(gaps) - 1) // 4]
+        print(f"Dial: error rate {best_error:.3f}, latency {scores[(bounce, gap_ms)][1] * 1000:.0f} ms")
+        result["DIAL_BOUNCE_TIME"] = bounce
+        result["DIAL_PULSE_GAP"] = gap_ms / 1000
+    if len(hook) > 0:
+        scores = {}
+        for settle_ms in range(2, 102, 2):
+            scores[settle_ms] = replay(hook, HookDecoder(settle_ms / 1000))
+        best_error = min(error_rate for error_rate, _ in scores.values())
+        settles = sorted(s for s, (e, _) in scores.items() if e == best_error)
+        settle_ms = settles[len(settles) // 2]
+        print(f"Hook: error rate {best_error:.3f}, latency {scores[settle_ms][1] * 1000:.0f} ms")
+        result["HOOK_SETTLE_TIME"] = settle_ms / 1000
+    return result
+
+
+def _decoder_for(kind):
+    return DialDecoder() if kind == "dial" else HookDecoder()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dial and hook switch pulse trace tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    capture = commands.add_parser("capture", help="record raw edges from a pin to a trace file")
+    capture.add_argument("--pin", type=int, default=config.NS_PIN)
+    capture.add_argument("--kind", choices=["dial", "hook"], default="dial")
+    capture.add_argument("--expect", default="", help="digits (dial) or U/D transitions (hook) performed")
+    capture.add_argument("--duration", type=float, default=30, help="seconds to record for")
+    capture.add_argument("output")
+
+    for name, text in (("replay", "report error rate and latency of the current config"),
+                       ("calibrate", "derive bounce and gap constants from a corpus")):
+        command = commands.add_parser(name, help=text)
+        command.add_argument("traces", nargs="+")
+
+    args = parser.parse_args()
+    if args.command == "capture":
+        recorder = TraceRecorder(args.pin, args.kind, args.expect)
+        print(f"Recording pin {args.pin} for {args.duration} seconds")
+        try:
+            time.sleep(args.duration)
+        except KeyboardInterrupt:
+            pass
+        trace = recorder.stop()
+        trace.save(args.output)
+        print(f"Saved {len(trace.edges)} edges to {args.output}")
+        return
+
+    traces = [Trace.load(filename) for filename in args.traces]
+    if args.command == "replay":
+        for kind in ("dial", "hook"):
+            corpus = [t for t in traces if t.kind == kind]
+            if len(corpus) > 0:
+                error_rate, latency = replay(corpus, _decoder_for(kind))
+                print(f"{kind}: {len(corpus)} traces, error rate {error_rate:.3f}, latency {latency * 1000:.0f} ms")
+    else:
+        for name, value in calibrate(traces).items():
+            print(f"{name} = {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import os
+import random
+import time
+from threading import Thread
+from threading import Event
+
+import dbus
+import yaml
+
+import config
+
+
+def modem_to_device_path(modem_path):
+    """
+    ofono names hands free modems after the bluez device they belong to, e.g.
+    /hfp/org/bluez/hci0/dev_AA_BB_CC_DD_EE_FF -> /org/bluez/hci0/dev_AA_BB_CC_DD_EE_FF
+    """
+    modem_path = str(modem_path)
+    if modem_path.startswith("/hfp"):
+        return modem_path[len("/hfp"):]
+    return modem_path
+
+
+def load_last_devices(filename=config.LAST_DEVICES_FILE):
+    """ Return the list of most recently used bluez device paths, most recent first. """
+    if not os.path.exists(filename):
+        return []
+    with open(filename, 'r') as stream:
+        devices = yaml.safe_load(stream)
+    return devices if devices is not None else []
+
+
+def remember_device(device_path, filename=config.LAST_DEVICES_FILE, max_devices=config.RECONNECT_MAX_DEVICES):
+    """ Move device_path to the front of the most recently used list and save it. """
+    devices = [d for d in load_last_devices(filename) if d != device_path]
+    devices.insert(0, str(device_path))
+    with open(filename, 'w') as stream:
+        yaml.safe_dump(devices[:max_devices], stream)
+
+
+class ReconnectManager(Thread):
+    """
+    Thread that actively reconnects to the most recently used phone(s) after a reboot instead of waiting for the
+    phone to reconnect by itself. Each round tries every remembered device in turn, then waits with exponential
+    backoff (plus jitter, so several units don't hammer the adapter in lock step) before the next round.
+    The thread stops when stop() is called, which the bluetooth connection does once the modem goes Online.
+    """
+    def __init__(self, pairing_agent, device_paths):
+        Thread.__init__(self, name="Reconnect")
+        self.daemon = True
+        self.pairing_agent = pairing_agent
+        self.device_paths = device_paths
+        self.attempts = 0
+        self.start_time = None
+        self._stop_event = Event()
+
+    def run(self):
+        print(f"Reconnect manager started for {self.device_paths}")
+        self.start_time = time.monotonic()
+        delay = config.RECONNECT_INITIAL_DELAY
+        while not self._stop_event.is_set():
+            for path in self.device_paths:
+                if self._stop_event.is_set():
+                    break
+                self.attempts += 1
+                try:
+                    print(f"Reconnect attempt {self.attempts} to {path}")
+                    self.pairing_agent.dev_connect(path)
+                except dbus.exceptions.DBusException as e:
+                    print(f"Reconnect to {path} failed: {e.get_dbus_name()}")
+            wait = delay + random.uniform(0, config.RECONNECT_JITTER * delay)
+            self._stop_event.wait(wait)
+            delay = min(delay * 2, config.RECONNECT_MAX_DELAY)
+
+    def stop(self):
+        """
+        Stop reconnecting.
+        :return: seconds since reconnecting started, or None if the thread never ran.
+        """
+        elapsed = None
+        if self.start_time is not None and not self._stop_event.is_set():
+            elapsed = time.monotonic() - self.start_time
+            print(f"Reconnected after {elapsed:.1f} seconds and {self.attempts} attempts")
+        self._stop_event.set()
+        return elapsed
@@ -1,93 +1,173 @@
-import dbus
-import config
-from threading import Thread
-import RPi.GPIO as GPIO
-import dbus.mainloop.glib
-from gi.repository import GLib
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
 import time
+from threading import Lock, Thread
+
+import bell
+import config
 
+# The ringer process entry point (see bell.py)
+BELL_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bell.py")
 
-class Ringer(Thread):
+
+class Ringer(object):
     """
-    Thread to run the hardware ringer.
-    Used settings from config for pins and ringer frequency.
+    Runs the hardware ringer in a small dedicated process with a raised scheduling priority, so bell timing does not
+    share the GIL with D-Bus, audio and the rest of the phone. The process is started from bell.py, which imports
+    none of the phone, and is controlled through a pipe with no D-Bus hop. If the parent dies the ringer process
+    turns the bell off and exits. If the ringer process dies it is started again for the next command.
+    Used settings from config for ringer frequency and cadences.
     """
-    def __init__(self, ringer_pin, sequence):
-        Thread.__init__(self)
-        GPIO.setmode(GPIO.BCM)
+    def __init__(self, ringer_pin, enable_pin=config.RINGER_ENABLE_PIN, realtime=True, stats_file=None):
         self.pin = ringer_pin
-        GPIO.setup(self.pin, GPIO.OUT)
-        # set the PWM GPIO to control the ringer.
-        self.ringer = GPIO.PWM(self.pin, config.RINGER_FREQUENCY)
-        self.ringer.start(0)
-        # Configure the enable pin
-        GPIO.setup(config.RINGER_ENABLE_PIN, GPIO.OUT)
-        GPIO.output(config.RINGER_ENABLE_PIN,0)
-        self.is_enabled = False
-        self.seq = sequence
-        self.is_ringing = False # Gettable/Settable flag to start/stop ringing
-        self.finished = False
+        self.enable_pin = enable_pin
+        cadences = [list(cadence) for cadence in config.RINGER_CADENCES]
+        self._args = [sys.executable, BELL_SCRIPT, str(ringer_pin), str(enable_pin), str(config.RINGER_FREQUENCY),
+                      json.dumps(cadences)]
+        if realtime:
+            self._args += ["--priority", str(config.RINGER_RT_PRIORITY)]
+        if stats_file is not None:
+            self._args += ["--stats", stats_file]
+        self._process = None
+        self._ringing = False
+        self._lock = Lock()
 
-    def run(self):
-        """
-            Perpetual loop. Because the self.is_ringing can be changed asynchronously its important
-            to check that the status hasn't changed before ring continuing with the sequence of rings.
-        """
-        ringing = False
-        print("Ringer Thread Started")
-        while not self.finished:
-            if self.is_ringing:
-                for x in range(self.seq.size):
-                    if ringing:
-                        print("pulse off")
-                        self.ringer.ChangeDutyCycle(0)
-                        ringing = False
-                    else:
-                        ringing = True
-                        print("pulse on")
-                        if self.is_ringing:
-                            """
-                                Note there is a bug in the RPi.GPIO module that means you can not repeatedly turn the 
-                                ringer on an off.Changing teh duty cycle is the workaround
-                             """
-                            self.ringer.ChangeDutyCycle(50)
-                    if self.is_ringing:
-                        time.sleep(self.seq[x])
-            else:
+    def start(self):
+        self._process = subprocess.Popen(self._args, stdin=subprocess.PIPE)
+        print("Ringer process started")
+
+    def set_ringing(self, is_ringing, cadence=0):
+        self._ringing = is_ringing
+        self._send(f"ring {cadence}" if is_ringing else "quiet")
+
+    @property
+    def is_ringing(self):
+        return self._ringing
+
+    def close(self):
+        self._ringing = False
+        self._send("stop")
+        with self._lock:
+            try:
+                self._process.stdin.close()
+            except BrokenPipeError:
                 pass
+        try:
+            self._process.wait(1)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+            self._process.wait()
+
+    def _send(self, command):
+        with self._lock:
+            if self._process.poll() is not None and command != "stop":
+                # e.g. a GPIO error in the bell: without a new process the phone would never ring again
+                print(f"RINGER PROCESS DIED with exit code {self._process.returncode}, restarting it")
+                try:
+                    self._process.stdin.close()
+                except BrokenPipeError:
+                    pass
+                self.start()
+            try:
+                self._process.stdin.write(f"{command}\n".encode())
+                self._process.stdin.flush()
+            except (BrokenPipeError, ValueError):
+                print("Ringer process has gone")
 
 
 class RingerManager(object):
     """
-    Management object for controlling the ringer via the DBus.
+    Management object for controlling a ringer. The PhoneManager rings every registered ringer directly when a call
+    comes in; with several extensions each has its own RingerManager.
     """
-    def __init__(self):
-        self.bus = dbus.SystemBus()
-        self._setup_listeners()
+    def __init__(self, ringer_pin=config.RINGER_PIN, enable_pin=config.RINGER_ENABLE_PIN):
         self.finished = False
-        self.is_ringing = False
 
-        """ Create the ringer thread so that it is inscope for the _control ringer function"""
-        self._ringer = Ringer(config.RINGER_PIN, config.RINGER_PATTERN)
+        """ Create the ringer process so that it is inscope for the _control ringer function"""
+        self._ringer = Ringer(ringer_pin, enable_pin)
         self._ringer.start()
 
-    def _setup_listeners(self):
-        print("create ringer listeners")
-        self.ring_service_interface = dbus.Interface(self.bus.get_object('org.frank', '/'), "phone.status")
-        self.ring_service_interface.connect_to_signal('ring', self._control_ringer)
+    @property
+    def is_ringing(self):
+        return self._ringer.is_ringing
 
-    def _control_ringer(self, value):
-        """ Handler set flag (self.is_ringer) that will stop the loop in the Ringer thread."""
+    def control_ringer(self, value):
+        """ Start (config.RING_START) or stop (config.RING_STOP) the bell with the normal cadence. """
         print(f"Ringing Controller {value}")
-        if value == config.RING_START:
-            print("dbus ring start signal received")
-            self._ringer.is_ringing = True
+        self.ring(value == config.RING_START)
+
+    def ring(self, is_ringing, cadence=0):
+        """ Start or stop this bell only, e.g. for an intercom call to one extension. """
+        self._ringer.set_ringing(is_ringing, cadence)
+        if is_ringing:
             print("Apply power to ringer")
-            GPIO.output(config.RINGER_ENABLE_PIN,1)
         else:
-            print("dbus ringer stop signal received")
-            self._ringer.is_ringing = False
-            GPIO.output(config.RINGER_ENABLE_PIN,0)
             print("Remove power from ringer")
-            
 
+    def close(self):
+        self.finished = True
+        self._ringer.close()
+
+
+def benchmark(duration, load_threads, realtime):
+    """
+    Ring for duration seconds while the parent process is kept busy by load_threads pure Python threads, and
+    report how late the bell switched compared with the cadence. Compares the ringer process against running the
+    same loop in a thread of the loaded process, which is how the ringer used to work.
+    """
+    finish = []
+
+    def load():
+        x = 0
+        while not finish:
+            x = (x * 31 + 7) % 1000003
+
+    threads = [Thread(target=load, daemon=True) for _ in range(load_threads)]
+    for thread in threads:
+        thread.start()
+
+    results = {}
+    for mode in ("thread", "process"):
+        with tempfile.NamedTemporaryFile('r', suffix=".stats") as stats:
+            if mode == "process":
+                ringer = Ringer(config.RINGER_PIN, config.RINGER_ENABLE_PIN, realtime, stats.name)
+                ringer.start()
+                ringer.set_ringing(True)
+                time.sleep(duration)
+                ringer.close()
+            else:
+                read_fd, write_fd = os.pipe()
+                cadences = [list(cadence) for cadence in config.RINGER_CADENCES]
+                with open(stats.name, 'w') as stream:
+                    ringer_thread = Thread(target=bell.ring, args=(config.RINGER_PIN, config.RINGER_ENABLE_PIN,
+                                                                   bell.BellControl(read_fd, os.getppid()), cadences,
+                                                                   config.RINGER_FREQUENCY, stream), daemon=True)
+                    ringer_thread.start()
+                    os.write(write_fd, b"ring 0\n")
+                    time.sleep(duration)
+                    os.write(write_fd, b"stop\n")
+                    ringer_thread.join(1)
+                os.close(write_fd)
+                os.close(read_fd)
+            results[mode] = sorted(float(line) * 1000 for line in stats)
+
+    finish.append(True)
+    for mode, lateness in results.items():
+        if len(lateness) == 0:
+            print(f"{mode}: no pulses recorded")
+            continue
+        print(f"{mode}: {len(lateness)} pulses, lateness mean {sum(lateness) / len(lateness):.2f} ms, "
+              f"p99 {lateness[int(0.99 * (len(lateness) - 1))]:.2f} ms, max {lateness[-1]:.2f} ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark ringer cadence jitter under CPU load")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to ring for in each mode")
+    parser.add_argument("--load-threads", type=int, default=4, help="busy threads loading the parent process")
+    parser.add_argument("--no-realtime", action="store_true", help="do not raise the ringer process priority")
+    args = parser.parse_args()
+    benchmark(args.duration, args.load_threads, not args.no_realtime)
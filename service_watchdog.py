@@ -0,0 +1,72 @@
+import time
+
+
+class ServiceWatchdog(object):
+    """
+    Watches ofono and bluetoothd on the system bus. When either restarts every proxy and signal subscription made
+    against the old process is dead, so the phone would silently stop ringing. The watchdog rebuilds them as soon
+    as the service has a new owner.
+    Notes:
+        Rebuilding ofono re-emits config.READY when a modem is online, which makes the PhoneManager rebuild its call
+        listeners. Recovery time, kept in recovery_times, runs from the new owner appearing until incoming calls can
+        ring again (the PhoneManager calls listening_for_calls) for ofono, and until the agent is registered again
+        for bluez.
+    """
+    WATCHED_SERVICES = ('org.ofono', 'org.bluez')
+
+    def __init__(self, bus, bt_conn, ofono_lost=None, service_back=None):
+        self.bus = bus
+        self.bt_conn = bt_conn
+        self.ofono_lost = ofono_lost    # called when ofono leaves the bus, e.g. PhoneManager.ofono_lost
+        self.service_back = service_back    # called with the name of a service once it has been rebuilt
+        self.recovery_times = []
+        self._ofono_restarted = None    # time.monotonic() when ofono got its new owner, until calls can ring
+        self._matches = []
+        for name in self.WATCHED_SERVICES:
+            self._matches.append(self.bus.add_signal_receiver(self._name_owner_changed,
+                                                              signal_name='NameOwnerChanged',
+                                                              dbus_interface='org.freedesktop.DBus',
+                                                              bus_name='org.freedesktop.DBus',
+                                                              path='/org/freedesktop/DBus',
+                                                              arg0=name))
+
+    def _name_owner_changed(self, name, old_owner, new_owner):
+        if new_owner == '':
+            print(f"Watchdog: {name} has left the bus")
+            if name == 'org.ofono':
+                self._ofono_restarted = None
+                self.bt_conn.ofono_lost()
+                if self.ofono_lost is not None:
+                    self.ofono_lost()
+            return
+
+        print(f"Watchdog: {name} has a new owner {new_owner}, rebuilding subscriptions")
+        start = time.monotonic()
+        try:
+            if name == 'org.ofono':
+                self._ofono_restarted = start
+                self.bt_conn.rebuild_ofono()
+            elif name == 'org.bluez':
+                self.bt_conn.rebuild_bluez()
+        except Exception as e:
+            print(f"Watchdog: failed to rebuild {name}: {e}")
+            return
+        if self.service_back is not None:
+            self.service_back(name)
+        elapsed = time.monotonic() - start
+        print(f"Watchdog: {name} subscriptions rebuilt in {elapsed:.2f} seconds")
+        if name == 'org.bluez':
+            self.recovery_times.append((name, elapsed))
+
+    def listening_for_calls(self):
+        """ The PhoneManager is listening for calls again. If ofono had restarted it has now recovered. """
+        if self._ofono_restarted is not None:
+            elapsed = time.monotonic() - self._ofono_restarted
+            self._ofono_restarted = None
+            self.recovery_times.append(('org.ofono', elapsed))
+            print(f"Watchdog: org.ofono recovered, calls can ring again after {elapsed:.2f} seconds")
+
+    def close(self):
+        for match in self._matches:
+            match.remove()
+        self._matches = []
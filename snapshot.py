@@ -0,0 +1,49 @@
+"""
+Warm start state: the phone (modem) last online, volume levels and speed dial phonebook, saved whenever they
+change so the next start can use them straight away instead of waiting for ofono and bluez.
+
+The snapshot is only ever a starting point. Live ofono/bluez state replaces it as soon as it is available.
+"""
+import json
+import os
+from threading import Lock
+
+import config
+
+
+class StateSnapshot(object):
+    """
+    Key/value state persisted as JSON in filename. Writes go to a temporary file that is then renamed over the
+    snapshot, so a crash or power cut leaves either the old or the new snapshot, never a partial one.
+    Values must be plain JSON types (convert dbus types before storing them).
+    """
+    def __init__(self, filename=config.STATE_SNAPSHOT_FILE):
+        self.filename = filename
+        self._lock = Lock()
+        self._state = {}
+        self.loaded = False     # True if a snapshot from a previous run was found
+        try:
+            with open(filename, 'r') as stream:
+                self._state = json.load(stream)
+            self.loaded = isinstance(self._state, dict)
+        except (OSError, ValueError):
+            pass
+        if not self.loaded:
+            self._state = {}
+
+    def get(self, key, default=None):
+        with self._lock:
+            return self._state.get(key, default)
+
+    def update(self, **values):
+        """ Store values, writing the snapshot only if something has actually changed. """
+        with self._lock:
+            if all(key in self._state and self._state[key] == value for key, value in values.items()):
+                return
+            self._state.update(values)
+            temp = self.filename + ".tmp"
+            with open(temp, 'w') as stream:
+                json.dump(self._state, stream)
+                stream.flush()
+                os.fsync(stream.fileno())
+            os.replace(temp, self.filename)
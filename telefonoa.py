@@ -3,19 +3,19 @@
 # This file is released under the "MIT License Agreement".
 # More information on this license can be read under https://opensource.org/licenses/MIT
 
-import RPi.GPIO as GPIO
+import argparse
 import datetime
+import os
 import dbus
 import dbus.service
 import dbus.mainloop.glib
-import wave
-import alsaaudio
 import yaml
 from gi.repository import GLib
 
 import time
 from threading import Thread
 from threading import Event
+from threading import RLock
 import queue as Queue
 import numpy as np
 import struct
@@ -23,7 +23,10 @@ import struct
 import subprocess
 
 import config
+import gpio_input
+import hook_switch
 import manager
+import profiler
 import ringer
 
 class RotaryDial(Thread):
@@ -31,35 +34,36 @@ class RotaryDial(Thread):
     Thread class reading the dialed values and putting them into a thread queue
     """
 
-    def __init__(self, ns_pin, number_queue):
-        Thread.__init__(self)
+    def __init__(self, ns_pin, number_queue, inputs):
+        Thread.__init__(self, name="RotaryDial")
         self.pin = ns_pin
         """ 
             The number_queue is Queue.Queue instance passed in from another thread. 
             This appears to facilitate interprocess communications
         """
         self.number_q = number_queue
-        GPIO.setup(self.pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+        inputs.setup(self.pin, pull_up=True)
         self.value = 0
-        self.pulse_threshold = 0.2
-        # self.pulse_threshold = 0.2
+        self.last_pulse = 0.0   # time.monotonic() timestamp of the last pulse
+        self.pulse_threshold = config.DIAL_PULSE_GAP
         self.finish = False
-        GPIO.add_event_detect(ns_pin, GPIO.FALLING, callback=self.__increment, bouncetime=config.DIAL_BOUNCE_TIME)
+        inputs.add_event(ns_pin, gpio_input.FALLING, self.__increment, bouncetime=config.DIAL_BOUNCE_TIME)
 
-    def __increment(self, pin_num):
+    def __increment(self, pin_num, level, timestamp):
         """
         Increment function trigerred each time a falling pulse is detected.
         :param pin_num: GPIO pin triggering the event (Can only be self.ns_pin here)
+        :param timestamp: when the pulse happened, in time.monotonic() seconds
         """
+        self.last_pulse = timestamp
         self.value += 1
 
     def run(self):
+        """ A digit is complete once pulse_threshold has passed since its last pulse. """
+        poll = self.pulse_threshold / 4
         while not self.finish:
-            last_value = self.value
-            time.sleep(self.pulse_threshold)
-            if last_value != self.value:
-                pass
-            elif self.value != 0:
+            time.sleep(poll)
+            if self.value != 0 and time.monotonic() - self.last_pulse >= self.pulse_threshold:
                 if self.value == 10:
                     self.number_q.put(0)
                 else:
@@ -73,18 +77,23 @@ class Telephone(object):
     """
     Main Telephone class containing everything required for the Bluetooth telephone to work.
     """
-    CHUNK = 1024
 
-    def __init__(self, num_pin, receiver_pin, discoverable_pin=None, volume_pin_dict=None):
-        GPIO.setmode(GPIO.BCM)
+    def __init__(self, num_pin, receiver_pin, discoverable_pin=None, volume_pin_dict=None,
+                 ringer_pin=config.RINGER_PIN, ringer_enable_pin=config.RINGER_ENABLE_PIN, phone_manager=None,
+                 exchange=None):
+        """
+        phone_manager and exchange are only given when the telephone is one of several extensions (see Exchange),
+        which then share the one PhoneManager and GPIO inputs.
+        """
+        # dial, receiver and button inputs (see config.GPIO_BACKEND)
+        self.inputs = exchange.inputs if exchange is not None else gpio_input.create_inputs()
         self.receiver_pin = receiver_pin
+        self.exchange = exchange
         self.number_q = Queue.Queue()
 
         self.discoverable_pin = discoverable_pin  # white button to trigger discovery and pairing.
         self.discoverable = False
         self.has_volume_controller = False
-        self.stop_audio = False
-        self.playing_audio = False
         self.finish = False
 
         if volume_pin_dict is not None:
@@ -95,17 +104,18 @@ class Telephone(object):
         else:
             self.has_volume_controller = False
 
-        self.phone_manager = manager.PhoneManager()
+        self.phone_manager = phone_manager if phone_manager is not None else manager.PhoneManager()
         self.bt_conn = self.phone_manager.bt_conn
+        self.audio = self.phone_manager.audio
 
         """Instantiate the thread that monitors the dial"""
-        self.rotary_dial = RotaryDial(num_pin, self.number_q)
-        """ instantiate the ringermanager object which exposes the dbus api for the ringer control"""
-        self.ringer = ringer.RingerManager()
+        self.rotary_dial = RotaryDial(num_pin, self.number_q, self.inputs)
+        """ instantiate the ringermanager object, rung by the phone manager when a call comes in"""
+        self.ringer = ringer.RingerManager(ringer_pin, ringer_enable_pin)
+        self.phone_manager.add_ringer(self.ringer)
 
         # Load fast_dial numbers
-        with open("phonebook.yaml", 'r') as stream:
-            self.phonebook = yaml.safe_load(stream)
+        self.phonebook = self._load_phonebook()
 
         print(self.phonebook)
 
@@ -113,37 +123,54 @@ class Telephone(object):
         if discoverable_pin is not None:
             # Set up the button to make it discoverable by preiously unpaired BT device.
             print("Discoverable button available")
-            GPIO.setup(self.discoverable_pin, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-            GPIO.add_event_detect(self.discoverable_pin, GPIO.RISING, callback=self.make_discoverable, bouncetime=config.BUTTON_BOUNCE_TIME)
+            self.inputs.setup(self.discoverable_pin, pull_up=False)
+            self.inputs.add_event(self.discoverable_pin, gpio_input.RISING, self.make_discoverable, bouncetime=config.BUTTON_BOUNCE_TIME)
 
         if self.has_volume_controller:
             # Set volume up pin
             print("Set up volume controls")
-            GPIO.setup(self.volume_up_pin, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-            GPIO.add_event_detect(self.volume_up_pin, GPIO.RISING, callback=self.volume_up, bouncetime=config.BUTTON_BOUNCE_TIME)
+            self.inputs.setup(self.volume_up_pin, pull_up=False)
+            self.inputs.add_event(self.volume_up_pin, gpio_input.RISING, self.volume_up, bouncetime=config.BUTTON_BOUNCE_TIME)
             # Set volume down pin
-            GPIO.setup(self.volume_down_pin, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-            GPIO.add_event_detect(self.volume_down_pin, GPIO.RISING, callback=self.volume_down, bouncetime=config.BUTTON_BOUNCE_TIME)
+            self.inputs.setup(self.volume_down_pin, pull_up=False)
+            self.inputs.add_event(self.volume_down_pin, gpio_input.RISING, self.volume_down, bouncetime=config.BUTTON_BOUNCE_TIME)
             # set up mute toggling function
-            GPIO.setup(self.volume_mute_pin, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-            GPIO.add_event_detect(self.volume_mute_pin, GPIO.RISING, callback=self.volume_mute_toggle, bouncetime=config.BUTTON_BOUNCE_TIME)
+            self.inputs.setup(self.volume_mute_pin, pull_up=False)
+            self.inputs.add_event(self.volume_mute_pin, gpio_input.RISING, self.volume_mute_toggle, bouncetime=config.BUTTON_BOUNCE_TIME)
         else:
             print("No volume controls available")
 
         # Receiver relevant functions
-        GPIO.setup(self.receiver_pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-        if GPIO.input(self.receiver_pin) is GPIO.HIGH:
+        self.inputs.setup(self.receiver_pin, pull_up=True)
+        if self.inputs.read(self.receiver_pin) == 1:
             self.receiver_down = False
         else:
             self.receiver_down = True
-        # self.receiver_changed(self.receiver_pin)
         print("Initial receiver status = down ? {0}".format(self.receiver_down))
-        GPIO.add_event_detect(self.receiver_pin, GPIO.BOTH, callback=self.receiver_changed, bouncetime=config.RECEIVER_BOUNCE_TIME)
-
-        # Start rotary dial thread
+        # Every edge is timestamped and debounced in software, see hook_switch.HookDebouncer
+        self.hook_switch = hook_switch.HookSwitch(self.inputs.read(self.receiver_pin), self.receiver_changed,
+                                                  self.hook_flash)
+        self.inputs.add_event(self.receiver_pin, gpio_input.BOTH, self.receiver_edge)
+        self.hook_switch.start()
+
+        # Start reading the inputs (the exchange starts them once all extensions are set up) and the rotary dial
+        if self.exchange is None:
+            self.inputs.start()
         self.rotary_dial.start()
 
-    def make_discoverable(self, pin_num):
+    def _load_phonebook(self, filename="phonebook.yaml"):
+        """ Speed dial numbers, taken from the warm start snapshot unless the file has changed since it was saved. """
+        snapshot = self.phone_manager.snapshot
+        modified = os.stat(filename).st_mtime
+        if snapshot is not None and snapshot.get("phonebook_modified") == modified:
+            return snapshot.get("phonebook")
+        with open(filename, 'r') as stream:
+            phonebook = yaml.safe_load(stream)
+        if snapshot is not None:
+            snapshot.update(phonebook=phonebook, phonebook_modified=modified)
+        return phonebook
+
+    def make_discoverable(self, pin_num, level, timestamp):
         """
             Set the RPi BT device to discoverable and pairable for 30 seconds. This is used only for pairing
             device (e.g. a mobile phone) that has not previously been paired.
@@ -151,15 +178,15 @@ class Telephone(object):
         """
         self.bt_conn.make_discoverable(config.DISCOVERABLE_TIMEOUT)
 
-    def volume_up(self, pin):
+    def volume_up(self, pin, level, timestamp):
         self.phone_manager.volume_up(config.VOLUME_INCREMENT)
         print(f"Volume Up: Mic volume = {self.phone_manager.mic_volume}")
 
-    def volume_down(self, pin):
+    def volume_down(self, pin, level, timestamp):
         self.phone_manager.volume_down(config.VOLUME_INCREMENT)
         print(f"Volumne Down: Mic volume = {self.phone_manager.mic_volume}")
 
-    def volume_mute_toggle(self, pin):
+    def volume_mute_toggle(self, pin, level, timestamp):
         self.phone_manager.mute_toggle()
         print(f"Toggle mute: Current status = {self.phone_manager.muted}")
 
@@ -170,17 +197,29 @@ class Telephone(object):
         """
         pass
 
-    def receiver_changed(self, pin_num):
+    def receiver_edge(self, pin_num, level, timestamp):
         """
-        Event triggered when the receiver is hung of lifted.
+        GPIO callback for every edge on the receiver pin. The level is handed to the hook switch debouncer.
         :param pin_num: GPIO pin triggering the event (Can only be self.receiver_pin here)
+        :param level: pin level after the edge
+        :param timestamp: when the edge happened, in time.monotonic() seconds
+        """
+        self.hook_switch.edge(level, timestamp)
+
+    def receiver_changed(self, receiver_up):
+        """
+        Event triggered by the hook switch debouncer when the receiver is hung or lifted.
+        :param receiver_up: True if the receiver has been lifted, False if it has been put down
         :return: None
         """
         print("Receiver status changed..")
-        if GPIO.input(pin_num) is GPIO.HIGH:
+        if receiver_up:
             print("Receiver Up")
             self.receiver_down = False
-            if self.phone_manager.call_in_progress:
+            if self.exchange is not None:
+                if not self.exchange.off_hook(self):
+                    self.start_file("/home/pi/bluetooth-phone/dial_tone.wav", loop=True)
+            elif self.phone_manager.call_in_progress:
                 self.phone_manager.answer_call()
             else:
                 # else we're picking the receiver up to begin dialing
@@ -192,70 +231,46 @@ class Telephone(object):
                 self.start_file("/home/pi/bluetooth-phone/dial_tone.wav", loop=True)
         else:
             print("Receiver Down")
-            if self.phone_manager.call_in_progress:
+            if self.exchange is not None:
+                self.exchange.on_hook(self)
+            elif self.phone_manager.call_in_progress:
                 print("Hanging up")
                 self.phone_manager.end_call()
             self.receiver_down = True
             self.stop_file()  # kill thread that might be playing the dial tone.
 
-    def start_file(self, filename, loop=False):
+    def hook_flash(self):
         """
-        Start a thread reproducing an audio file
-        :param filename: The name of the file to play
-        :param loop: If the file should be played as a loop (like in the case of the dial tone)
+        Event triggered by the hook switch debouncer when the receiver is put down and lifted again quickly.
+        During a call this answers a waiting call or switches between calls. Otherwise it is ignored.
         """
-        print("Play file : telephone object {0}".format(filename))
-        self._thread = Thread(target=self.__play_file, args=[filename, loop])
-        self._thread.start()
-        self.playing_audio = True
+        print("Hook flash")
+        if self.phone_manager.call_in_progress:
+            self.phone_manager.hook_flash()
 
-    def __play_file(self, filename, loop):
+    def start_file(self, filename, loop=False):
         """
-        Private function handling the wav file replay
+        Play an audio file on the shared audio player
         :param filename: The name of the file to play
         :param loop: If the file should be played as a loop (like in the case of the dial tone)
         """
-        self.stop_audio = False
-        if not loop:
-            # open a wav format music
-            f = wave.open(filename, "rb")
-            # open stream
-            stream = alsaaudio.PCM(type=alsaaudio.PCM_PLAYBACK, mode=alsaaudio.PCM_NORMAL, device='plughw:1,0')
-            stream.setchannels(f.getnchannels())
-            stream.setrate(f.getframerate())
-            # read data
-            data = f.readframes(self.CHUNK)
-
-            # play stream
-            while data and not self.stop_audio:
-                stream.write(data)
-                data = f.readframes(self.CHUNK)
-            f.close()
-            stream = None
-        else:
-            # open a wav format music
-            f = wave.open(filename, "rb")
-            # open stream
-            stream = alsaaudio.PCM(type=alsaaudio.PCM_PLAYBACK, mode=alsaaudio.PCM_NORMAL, device='plughw:1,0')
-            stream.setchannels(f.getnchannels())
-            stream.setrate(f.getframerate())
-            # read data
-            data = f.readframes(self.CHUNK)
-
-            # play stream
-            while loop and not self.stop_audio:
-                f.rewind()
-                data = f.readframes(self.CHUNK)
-                while data and not self.stop_audio:
-                    stream.write(data)
-                    data = f.readframes(self.CHUNK)
-            f.close()
-            stream = None
+        self.audio.start_file(filename, loop)
 
     def stop_file(self):
-        self.stop_audio = True
-        self.playing_audio = False
-        print("stopping sound")
+        self.audio.stop_file()
+
+    def on_call(self):
+        """ True if this telephone is connected to an answered or outgoing bluetooth call. """
+        if self.exchange is not None:
+            return self in self.exchange.in_call and self.phone_manager.call_in_progress
+        return self.phone_manager.call_in_progress and not self.phone_manager.call_ringing
+
+    def place_call(self, number):
+        """ Dial number, through the exchange if this telephone is one of several extensions. """
+        if self.exchange is not None:
+            self.exchange.dial(self, number)
+        else:
+            self.phone_manager.call(number)
 
     def dialing_handler(self):
         """
@@ -268,7 +283,12 @@ class Telephone(object):
         while not self.finish:
             if not self.receiver_down:  # Handling of the dialing when the receiver is lifted
                 try:
-                    c = self.number_q.get(timeout=5)
+                    c = self.number_q.get(timeout=config.DIAL_TIMEOUT)
+                    if self.on_call():
+                        # Digits dialed during a call are tones for the far end (menus, PINs), not a new number
+                        self.phone_manager.send_tone(c)
+                        number = ''
+                        continue
                     # # turn off dial tone as soon as a number is dialed.
                     # if not number == '' and self.playing_audio:
                     #     self.stop_file()
@@ -278,10 +298,10 @@ class Telephone(object):
                         if len(number) > 1:
                             print("Dialing: %s" % number)
                             self.stop_file()
-                            self.phone_manager.call(number)
+                            self.place_call(number)
                             number = ''
                         else:  # Handling of the dialing for speed dial from phonebook
-                            if self.playing_audio:
+                            if self.audio.playing_audio:
                                 self.stop_file()
                             try:
                                 print("Selected %d" % c)
@@ -295,7 +315,7 @@ class Telephone(object):
                                     number = self.phonebook[c - 1]['number']
                                     print(number)
                                     time.sleep(4)
-                                    self.phone_manager.call(number)
+                                    self.place_call(number)
                                 number = ''
                             except Queue.Empty:
                                 pass
@@ -309,19 +329,148 @@ class Telephone(object):
                 if len(self.number_q.queue) >= 1:
                     self.number_q.queue.clear()
                     print("Queue Cleared")
+                # Don't spin while on hook; with several extensions every handset has one of these loops
+                time.sleep(0.05)
 
     def close(self):
         self.rotary_dial.finish = True
-        self.phone_manager.loop.quit()
-        GPIO.cleanup()
+        self.hook_switch.finish = True
+        self.ringer.close()
+        if self.exchange is None:
+            # Extensions share these, the exchange closes them once
+            self.phone_manager.close()
+            self.inputs.close()
 
 
-if __name__ == '__main__':
+class Exchange(object):
+    """
+    Several rotary handsets (extensions) on one RPi sharing a single PhoneManager, bluetooth connection and audio
+    player.
+    Notes:
+        An incoming call rings every extension and the first one off hook answers it. Other extensions going off hook
+        join the call, which is only hung up when the last extension in it goes back on hook.
+        Dialing config.INTERCOM_PREFIX followed by an extension number rings just that extension. The handsets share
+        the one audio line, so the two are connected as soon as it is picked up.
+    """
+    def __init__(self, extensions, discoverable_pin=None, volume_pin_dict=None):
+        self.phone_manager = manager.PhoneManager()
+        self.inputs = gpio_input.create_inputs()
+        self.in_call = []       # extensions taking part in the bluetooth call
+        self.intercom = None    # (calling, called) extensions while an intercom call is up
+        self.answering = False  # An extension is answering the ringing call
+        self._lock = RLock()
+        self._threads = []
+        self.extensions = []
+        for i, pins in enumerate(extensions):
+            # The discoverable and volume buttons are shared, they are only wired to the first extension.
+            self.extensions.append(Telephone(pins['NS_PIN'], pins['HOERER_PIN'],
+                                             discoverable_pin if i == 0 else None,
+                                             volume_pin_dict if i == 0 else None,
+                                             pins['RINGER_PIN'], pins['RINGER_ENABLE_PIN'],
+                                             self.phone_manager, self))
+        self.inputs.start()
+
+    def off_hook(self, extension):
+        """
+        An extension has gone off hook.
+        :return: True if it was connected to a call, False if it should get a dial tone.
+        """
+        with self._lock:
+            if self.intercom is not None and self.intercom[1] is extension:
+                print(f"Intercom answered on extension {self.extensions.index(extension) + 1}")
+                extension.ringer.ring(False)
+                return True
+            if self.phone_manager.call_ringing and not self.answering:
+                self.in_call = [extension]
+                self.answering = True
+            elif self.phone_manager.call_in_progress:
+                print(f"Extension {self.extensions.index(extension) + 1} joined the call")
+                self.in_call.append(extension)
+                return True
+            else:
+                return False
+        # Answering takes a while, other extensions must not wait for it to go on or off hook
+        try:
+            self.phone_manager.answer_call()
+        finally:
+            with self._lock:
+                self.answering = False
+        return True
+
+    def on_hook(self, extension):
+        """ An extension has gone on hook. Hang up once no extension is left on the call. """
+        with self._lock:
+            if self.intercom is not None and extension in self.intercom:
+                print("Intercom call ended")
+                self.intercom[1].ringer.ring(False)
+                self.intercom = None
+            if extension in self.in_call:
+                self.in_call.remove(extension)
+                if len(self.in_call) == 0 and self.phone_manager.call_in_progress:
+                    print("Hanging up")
+                    self.phone_manager.end_call()
+
+    def dial(self, extension, number):
+        """ Route a dialed number: an intercom call to another extension or a call out on the bluetooth phone. """
+        prefix = config.INTERCOM_PREFIX
+        if number.startswith(prefix) and len(number) == len(prefix) + 1:
+            self.intercom_call(extension, int(number[len(prefix):]))
+        else:
+            with self._lock:
+                self.in_call = [extension]
+            self.phone_manager.call(number)
+
+    def intercom_call(self, extension, called_number):
+        index = called_number - 1 if called_number > 0 else 9
+        with self._lock:
+            if index >= len(self.extensions) or self.extensions[index] is extension \
+                    or not self.extensions[index].receiver_down:
+                print(f"Extension {called_number} is not available")
+                extension.start_file("/home/pi/bluetooth-phone/format_incorrect.wav")
+                return
+            print(f"Intercom call to extension {called_number}")
+            self.intercom = (extension, self.extensions[index])
+            self.extensions[index].ringer.ring(True, config.INTERCOM_CADENCE)
+
+    def dialing_handler(self):
+        """ Run the dialing handler of every extension, the first one in the calling thread. """
+        for extension in self.extensions[1:]:
+            thread = Thread(target=extension.dialing_handler,
+                            name=f"DialingHandler-{self.extensions.index(extension) + 1}")
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+        self.extensions[0].dialing_handler()
 
+    def close(self):
+        for extension in self.extensions:
+            extension.finish = True
+            extension.close()
+        self.phone_manager.close()
+        self.inputs.close()
 
 
-    #create and instance of the telephone
-    t = Telephone(config.NS_PIN, config.HOERER_PIN, config.DISCOVERABLE_PIN, config.VOLUME_PIN_DICT)
+if __name__ == '__main__':
+    start_time = time.monotonic()
+    parser = argparse.ArgumentParser(description="Bluetooth rotary phone")
+    parser.add_argument("--cold-start", action="store_true",
+                        help="ignore the warm start snapshot and wait for ofono and bluez before taking calls")
+    args = parser.parse_args()
+    if args.cold_start:
+        config.WARM_START = False
+
+    # SIGUSR1 (or the control socket) takes a sampling profile of every thread
+    profiler.install()
+
+    if config.EXTENSIONS is not None:
+        # create an exchange for several handsets
+        t = Exchange(config.EXTENSIONS, config.DISCOVERABLE_PIN, config.VOLUME_PIN_DICT)
+    else:
+        #create and instance of the telephone
+        t = Telephone(config.NS_PIN, config.HOERER_PIN, config.DISCOVERABLE_PIN, config.VOLUME_PIN_DICT)
+    # Time to first dial tone: from here on lifting the receiver plays it
+    print(f"Dial tone ready {time.monotonic() - start_time:.2f} seconds after start "
+          f"({'warm' if config.WARM_START else 'cold'} start)")
 
     try:
         # enter the dialing handler loop
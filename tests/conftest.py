@@ -0,0 +1,112 @@
+"""
+Shared test setup. The tests run off the phone: modules that only exist on the Raspberry Pi (dbus-python, PyGObject,
+pyalsaaudio) are replaced by small stand-ins when they are not installed, and ofono/bluez are played by mock_ofono.
+"""
+import os
+import sys
+import types
+from threading import Event
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+
+def _installed(name):
+    try:
+        __import__(name)
+        return True
+    except ImportError:
+        return False
+
+
+def _module(name, **attributes):
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    sys.modules[name] = module
+    return module
+
+
+def _fake_dbus():
+    class DBusException(Exception):
+        def __init__(self, *args, name=None):
+            Exception.__init__(self, *args)
+            self._dbus_error_name = name
+
+        def get_dbus_name(self):
+            return self._dbus_error_name
+
+    class Interface(object):
+        """ Same dispatch as dbus.Interface: methods and signals go to the proxy with the interface name added. """
+        def __init__(self, obj, dbus_interface):
+            self._obj = obj
+            self._dbus_interface = dbus_interface
+
+        @property
+        def object_path(self):
+            return self._obj.object_path
+
+        def connect_to_signal(self, signal_name, handler_function, **keywords):
+            keywords.setdefault('dbus_interface', self._dbus_interface)
+            return self._obj.connect_to_signal(signal_name, handler_function, **keywords)
+
+        def __getattr__(self, member):
+            if member.startswith('__'):
+                raise AttributeError(member)
+            return self._obj.get_dbus_method(member, self._dbus_interface)
+
+    def no_bus(*args, **kwargs):
+        raise DBusException("No message bus in the tests", name='org.freedesktop.DBus.Error.NoServer')
+
+    class Object(object):
+        def __init__(self, conn=None, object_path=None, bus_name=None):
+            pass
+
+    def decorator(*args, **kwargs):
+        return lambda function: function
+
+    class BusName(object):
+        def __init__(self, name, bus=None):
+            self.name = name
+
+    exceptions = _module('dbus.exceptions', DBusException=DBusException)
+    service = _module('dbus.service', Object=Object, method=decorator, signal=decorator, BusName=BusName)
+    glib = _module('dbus.mainloop.glib', DBusGMainLoop=lambda set_as_default=False: None)
+    mainloop = _module('dbus.mainloop', glib=glib)
+    _module('dbus', exceptions=exceptions, service=service, mainloop=mainloop, Interface=Interface,
+            SystemBus=no_bus, SessionBus=no_bus, String=str, Byte=int, UInt32=int,
+            Boolean=lambda value, variant_level=0: bool(value),
+            Array=lambda value, signature=None: list(value))
+
+
+def _fake_glib():
+    class MainLoop(object):
+        def __init__(self):
+            self._quit = Event()
+
+        def run(self):
+            self._quit.wait()
+
+        def quit(self):
+            self._quit.set()
+
+    glib = types.SimpleNamespace(MainLoop=MainLoop)
+    repository = _module('gi.repository', GLib=glib)
+    _module('gi', repository=repository)
+
+
+def _fake_alsaaudio():
+    class ALSAAudioError(Exception):
+        pass
+
+    def pcm(*args, **kwargs):
+        raise ALSAAudioError("No sound card in the tests")
+
+    _module('alsaaudio', ALSAAudioError=ALSAAudioError, PCM=pcm, PCM_PLAYBACK=0, PCM_NONBLOCK=1, PCM_NORMAL=0,
+            PCM_FORMAT_S16_LE=2)
+
+
+if not _installed('dbus'):
+    _fake_dbus()
+if not _installed('gi'):
+    _fake_glib()
+if not _installed('alsaaudio'):
+    _fake_alsaaudio()
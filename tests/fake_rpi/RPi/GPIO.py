@@ -0,0 +1,44 @@
+"""
+Stand-in for RPi.GPIO in the ringer process started by the tests. Every output change is appended to the file named
+by FAKE_GPIO_LOG as "<time.monotonic()> <kind> <pin> <value>", kind being "output" or "duty".
+"""
+import os
+import time
+
+BCM = "BCM"
+OUT = "OUT"
+
+
+def _log(kind, pin, value):
+    with open(os.environ['FAKE_GPIO_LOG'], 'a') as log:
+        log.write(f"{time.monotonic()} {kind} {pin} {value}\n")
+
+
+def setmode(mode):
+    pass
+
+
+def setup(pin, direction):
+    pass
+
+
+def output(pin, value):
+    _log("output", pin, value)
+
+
+def cleanup(pins=None):
+    pass
+
+
+class PWM(object):
+    def __init__(self, pin, frequency):
+        self.pin = pin
+
+    def start(self, duty):
+        self.ChangeDutyCycle(duty)
+
+    def ChangeDutyCycle(self, duty):
+        _log("duty", self.pin, duty)
+
+    def stop(self):
+        pass
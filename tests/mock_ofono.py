@@ -0,0 +1,407 @@
+"""
+A mock system bus with ofono and bluez on it, for driving the PhoneManager and bluetooth.connection off the phone.
+
+FakeBus routes method calls and signals the way dbus-python does (proxies, dbus.Interface, connect_to_signal and
+add_signal_receiver with arg0). MockOfono keeps modems, calls, dialed numbers and sent tones, and can be killed and
+restarted like the real daemon. Signal subscriptions made on proxies of a killed service are dropped, as they are
+dead after a restart. MockObex plays obexd on a session bus for contact syncs.
+"""
+import itertools
+import os
+import time
+from types import SimpleNamespace
+
+import dbus
+
+import bluetooth
+import config
+import contacts
+import manager
+import reconnect
+
+MODEM = "/hfp/org/bluez/hci0/dev_AA_BB_CC_DD_EE_FF"
+REPO = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+
+class SignalMatch(object):
+    def __init__(self, bus, rule, handler, on_proxy):
+        self.bus = bus
+        self.rule = rule
+        self.handler = handler
+        self.on_proxy = on_proxy
+
+    def remove(self):
+        if self in self.bus.matches:
+            self.bus.matches.remove(self)
+
+
+class FakeProxy(object):
+    def __init__(self, bus, bus_name, object_path):
+        self.bus = bus
+        self.bus_name = bus_name
+        self.object_path = object_path
+
+    def get_dbus_method(self, member, dbus_interface=None):
+        def call(*args, **kwargs):
+            return self.bus.call(self.bus_name, self.object_path, dbus_interface, member, *args)
+        return call
+
+    def connect_to_signal(self, signal_name, handler_function, dbus_interface=None, **keywords):
+        return self.bus.add_signal_receiver(handler_function, signal_name=signal_name, dbus_interface=dbus_interface,
+                                            bus_name=self.bus_name, path=self.object_path, _on_proxy=True)
+
+
+class FakeBus(object):
+    def __init__(self):
+        self.services = {'org.freedesktop.DBus': MockBusDaemon(self)}  # well known name -> mock service
+        self.owners = {}        # well known name -> unique name
+        self.matches = []
+        self._unique_names = itertools.count(1)
+
+    def get_unique_name(self):
+        return ":1.0"
+
+    def get_object(self, bus_name, object_path):
+        return FakeProxy(self, bus_name, object_path)
+
+    def add_signal_receiver(self, handler_function, signal_name=None, dbus_interface=None, bus_name=None, path=None,
+                            arg0=None, _on_proxy=False, **keywords):
+        rule = {'signal_name': signal_name, 'dbus_interface': dbus_interface, 'bus_name': bus_name, 'path': path,
+                'arg0': arg0}
+        match = SignalMatch(self, rule, handler_function, _on_proxy)
+        self.matches.append(match)
+        return match
+
+    def count_matches(self, signal_name):
+        """ Number of subscriptions to signal_name made with connect_to_signal on a proxy. """
+        return len([m for m in self.matches if m.on_proxy and m.rule['signal_name'] == signal_name])
+
+    def call(self, bus_name, path, interface, member, *args):
+        service = self.services.get(bus_name)
+        if service is None:
+            raise dbus.exceptions.DBusException(f"The name {bus_name} was not provided",
+                                                name='org.freedesktop.DBus.Error.ServiceUnknown')
+        return service.call(path, interface, member, *args)
+
+    def emit(self, bus_name, path, interface, signal_name, *args):
+        for match in list(self.matches):
+            rule = match.rule
+            if match not in self.matches:
+                continue    # removed by an earlier handler
+            if rule['signal_name'] not in (None, signal_name) or rule['dbus_interface'] not in (None, interface):
+                continue
+            if rule['bus_name'] not in (None, bus_name) or rule['path'] not in (None, path):
+                continue
+            if rule['arg0'] is not None and (len(args) == 0 or args[0] != rule['arg0']):
+                continue
+            match.handler(*args)
+
+    def own(self, name, service):
+        old_owner = self.owners.get(name, '')
+        self.services[name] = service
+        self.owners[name] = f":1.{next(self._unique_names)}"
+        self._name_owner_changed(name, old_owner, self.owners[name])
+
+    def release(self, name):
+        old_owner = self.owners.pop(name, '')
+        self.services.pop(name, None)
+        self.matches = [m for m in self.matches if not (m.on_proxy and m.rule['bus_name'] == name)]
+        self._name_owner_changed(name, old_owner, '')
+
+    def _name_owner_changed(self, name, old_owner, new_owner):
+        self.emit('org.freedesktop.DBus', '/org/freedesktop/DBus', 'org.freedesktop.DBus', 'NameOwnerChanged',
+                  name, old_owner, new_owner)
+
+
+class MockService(object):
+    """ Records every method call; methods defined on subclasses answer them. """
+    NAME = None
+
+    def __init__(self, bus):
+        self.bus = bus
+        self.method_calls = []
+
+    def start(self):
+        self.bus.own(self.NAME, self)
+
+    def kill(self):
+        self.bus.release(self.NAME)
+
+    def call(self, path, interface, member, *args):
+        self.method_calls.append((path, interface, member, args))
+        method = getattr(self, member, None)
+        return method(path, *args) if method is not None else None
+
+    def emit(self, path, interface, signal_name, *args):
+        self.bus.emit(self.NAME, path, interface, signal_name, *args)
+
+
+class MockBusDaemon(MockService):
+    """ The bus daemon's statistics interface, as read by tests/resource_monitor.py. """
+    NAME = 'org.freedesktop.DBus'
+
+    def GetConnectionStats(self, path, unique_name):
+        return {'MatchRules': len(self.bus.matches)}
+
+
+class MockBluez(MockService):
+    NAME = 'org.bluez'
+
+    def Get(self, path, interface, name):
+        return 0
+
+
+class MockOfono(MockService):
+    NAME = 'org.ofono'
+
+    def __init__(self, bus):
+        MockService.__init__(self, bus)
+        self.modems = {}        # path -> properties
+        self.volume = {'SpeakerVolume': 50, 'MicrophoneVolume': 50, 'Muted': False}
+        self.dialed = []
+        self.tones = []         # (time.monotonic(), tones) for every SendTones call
+        self.active_calls = {}  # call path -> modem path
+        self.call_states = {}   # call path -> State property
+        self._call_numbers = itertools.count(1)
+
+    def add_modem(self, path=MODEM, name="Test phone", online=True):
+        self.modems[path] = {'Name': name, 'Online': online}
+
+    def set_online(self, path, online):
+        self.modems[path]['Online'] = online
+        self.emit(path, 'org.ofono.Modem', 'PropertyChanged', 'Online', dbus.Boolean(online, variant_level=1))
+
+    def incoming_call(self, modem_path=MODEM, number="0419239384", state='incoming'):
+        """ A call coming in: state is 'waiting' for one arriving during another call. """
+        call_path = f"{modem_path}/voicecall{next(self._call_numbers):02d}"
+        self.active_calls[call_path] = modem_path
+        self.call_states[call_path] = state
+        self.emit(modem_path, 'org.ofono.VoiceCallManager', 'CallAdded', call_path,
+                  {'State': state, 'LineIdentification': number})
+        return call_path
+
+    def call_removed(self, call_path, modem_path=MODEM):
+        self.active_calls.pop(call_path, None)
+        self.call_states.pop(call_path, None)
+        self.emit(modem_path, 'org.ofono.VoiceCallManager', 'CallRemoved', call_path)
+
+    def GetModems(self, path):
+        return [(p, dict(properties)) for p, properties in self.modems.items()]
+
+    def Dial(self, path, number, hide_id):
+        self.dialed.append(number)
+        call_path = f"{path}/voicecall{next(self._call_numbers):02d}"
+        self.active_calls[call_path] = path
+        self.call_states[call_path] = 'dialing'
+        self.emit(path, 'org.ofono.VoiceCallManager', 'CallAdded', call_path, {'State': 'dialing'})
+        return call_path
+
+    def Answer(self, path):
+        self.call_states[path] = 'active'
+
+    def HoldAndAnswer(self, path):
+        for call_path, state in self._calls(path):
+            self.call_states[call_path] = {'active': 'held', 'waiting': 'active'}.get(state, state)
+
+    def SwapCalls(self, path):
+        for call_path, state in self._calls(path):
+            self.call_states[call_path] = {'active': 'held', 'held': 'active'}.get(state, state)
+
+    def _calls(self, modem_path):
+        return [(p, self.call_states[p]) for p, m in list(self.active_calls.items()) if m == modem_path]
+
+    def HangupAll(self, path):
+        for call_path, modem_path in list(self.active_calls.items()):
+            if modem_path == path:
+                self.call_removed(call_path, modem_path)
+
+    def SendTones(self, path, tones):
+        self.tones.append((time.monotonic(), tones))
+
+    def GetCalls(self, path):
+        return [(call_path, {'State': state}) for call_path, state in self._calls(path)]
+
+    def GetProperties(self, path):
+        return dict(self.volume)
+
+    def SetProperty(self, path, name, value):
+        self.volume[name] = value
+
+
+class MockObex(MockService):
+    """ obexd serving a phonebook over PBAP: PullAll writes vcards to the requested file. """
+    NAME = 'org.bluez.obex'
+
+    def __init__(self, bus, vcards="", version=None):
+        MockService.__init__(self, bus)
+        self.vcards = vcards        # text of the phonebook
+        self.version = version      # (DatabaseIdentifier, PrimaryCounter) or None for a phone without counters
+        self.sessions = []
+        self._numbers = itertools.count(1)
+
+    def CreateSession(self, path, address, options):
+        session = f"/org/bluez/obex/client/session{next(self._numbers)}"
+        self.sessions.append(session)
+        return session
+
+    def RemoveSession(self, path, session):
+        self.sessions.remove(session)
+
+    def Select(self, path, location, phonebook):
+        pass
+
+    def GetAll(self, path, interface):
+        if self.version is None:
+            return {}
+        return {'DatabaseIdentifier': self.version[0], 'PrimaryCounter': self.version[1]}
+
+    def PullAll(self, path, filename, filters):
+        with open(filename, 'w', encoding='utf-8') as stream:
+            stream.write(self.vcards)
+        return f"{path}/transfer{next(self._numbers)}", {}
+
+    def Get(self, path, interface, name):
+        return "complete"
+
+
+class FakeStatusService(object):
+    """ Stands in for dbus_custom_services.phone_status_service: its signals go out on the fake bus. """
+    def __init__(self, bus):
+        self.bus = bus
+
+    def emit(self, value):
+        self.bus.emit('org.frank', '/', 'phone.status', 'emit', value)
+
+    def ring(self, value):
+        self.bus.emit('org.frank', '/', 'phone.status', 'ring', value)
+
+
+class FakeAgent(object):
+    def __init__(self, bus, path, proxy_cache):
+        self.connected = []
+
+    def dev_connect(self, path):
+        self.connected.append(path)
+
+
+class FakeRinger(object):
+    """ Stands in for ringer.RingerManager and records whether the bell is on. """
+    def __init__(self, *args):
+        self.is_ringing = False
+        self.rings = 0
+
+    def control_ringer(self, value):
+        self.ring(value == config.RING_START)
+
+    def ring(self, is_ringing, cadence=0):
+        if is_ringing and not self.is_ringing:
+            self.rings += 1
+        self.is_ringing = is_ringing
+
+    def close(self):
+        self.is_ringing = False
+
+
+class FakeAudio(object):
+    def __init__(self, *args, **kwargs):
+        self.played = []
+        self.playing_audio = False
+
+    def prepare(self):
+        pass
+
+    def start_file(self, filename, loop=False):
+        self.played.append(filename)
+
+    def stop_file(self):
+        pass
+
+
+class StubPCM(object):
+    """
+    Stands in for alsaaudio.PCM so the real audio.AudioPlayer can play: writes take a little time, as a sound card
+    takes a chunk, and every stream opened and closed is counted.
+    """
+    opened = 0
+    closed = 0
+
+    def __init__(self, *args, **kwargs):
+        StubPCM.opened += 1
+        self.frames = 0
+        self.channels = None
+
+    def setformat(self, format):
+        pass
+
+    def setchannels(self, channels):
+        self.channels = channels
+        return channels
+
+    def setrate(self, rate):
+        return rate
+
+    def write(self, data):
+        self.frames += len(data) // (2 * self.channels)
+        time.sleep(0.002)
+
+    def close(self):
+        StubPCM.closed += 1
+
+
+class FakeContactSync(object):
+    def __init__(self, cache, address):
+        self.address = address
+
+    def start(self):
+        pass
+
+    def is_alive(self):
+        return False
+
+
+def patch_services(monkeypatch, tmp_path, bus):
+    """
+    Point the phone's modules at bus and keep every file they write under tmp_path.
+    :return: list the bluez device paths passed to reconnect.remember_device are appended to.
+    """
+    monkeypatch.setattr(dbus, 'SystemBus', lambda: bus)
+    monkeypatch.setattr(manager.dbus_custom_services, 'phone_status_service', lambda: FakeStatusService(bus))
+    monkeypatch.setattr(manager.audio, 'AudioPlayer', FakeAudio)
+    monkeypatch.setattr(manager.contacts, 'ContactSync', FakeContactSync)
+    contact_cache = contacts.ContactCache
+    monkeypatch.setattr(manager.contacts, 'ContactCache', lambda: contact_cache(str(tmp_path / "contacts.db")))
+    monkeypatch.setattr(bluetooth.dbus_custom_services, 'AutoAcceptAgent', FakeAgent)
+    monkeypatch.setattr(bluetooth.connection, '_refresh_pulseaudio_cards', lambda self: None)
+    remembered = []
+    monkeypatch.setattr(reconnect, 'remember_device', lambda path, *args, **kwargs: remembered.append(str(path)))
+    monkeypatch.setattr(reconnect, 'load_last_devices', lambda *args, **kwargs: [])
+    monkeypatch.setattr(config, 'STATE_SNAPSHOT_FILE', str(tmp_path / "state_snapshot.json"))
+    monkeypatch.setattr(config, 'WARM_START', False)
+    return remembered
+
+
+def start_phone(monkeypatch, tmp_path, modems=((MODEM, True),)):
+    """
+    Start mock ofono and bluez with the given (path, online) modems and a PhoneManager with one fake ringer on them.
+    :return: namespace of bus, ofono, bluez, manager, ringer and the remembered devices. Pass it to stop_phone when
+             done.
+    """
+    bus = FakeBus()
+    remembered = patch_services(monkeypatch, tmp_path, bus)
+    ofono = MockOfono(bus)
+    for path, online in modems:
+        ofono.add_modem(path, online=online)
+    bluez = MockBluez(bus)
+    ofono.start()
+    bluez.start()
+    phone_manager = manager.PhoneManager()
+    phone_manager.reconciled.wait(5)
+    ringer = FakeRinger()
+    phone_manager.add_ringer(ringer)
+    return SimpleNamespace(bus=bus, ofono=ofono, bluez=bluez, manager=phone_manager, ringer=ringer,
+                           remembered=remembered)
+
+
+def stop_phone(phone):
+    phone.manager.bt_conn._stop_reconnect()
+    phone.manager.close()
@@ -0,0 +1,67 @@
+import os
+import threading
+
+import dbus
+
+
+class ResourceMonitor(object):
+    """
+    Samples the resources that grow when something leaks: threads, open file descriptors, resident memory and the
+    D-Bus match rules our connection holds. The phone is meant to run for months, so any steady growth over many
+    call cycles is a bug.
+    Notes:
+        Match rules are read from the bus daemon's org.freedesktop.DBus.Debug.Stats interface. It is only there if
+        dbus-daemon was built with statistics, otherwise match_rules is None and is not checked.
+    """
+    # Largest growth from the baseline sample that is not a leak
+    LIMITS = {'threads': 2,
+              'fds': 5,
+              'rss_kb': 10240,
+              'match_rules': 2}
+
+    def __init__(self, bus=None):
+        self.bus = bus
+        self.baseline = None
+        self.samples = []
+
+    def sample(self):
+        sample = {'threads': threading.active_count(),
+                  'fds': len(os.listdir('/proc/self/fd')),
+                  'rss_kb': self._rss_kb(),
+                  'match_rules': self._match_rules()}
+        self.samples.append(sample)
+        if self.baseline is None:
+            self.baseline = sample
+        return sample
+
+    def check(self, sample=None):
+        """
+        Compare a sample (by default the latest) with the first one.
+        :return: list of messages, one for each resource that has grown by more than its limit.
+        """
+        sample = sample if sample is not None else self.samples[-1]
+        failures = []
+        for name, limit in self.LIMITS.items():
+            if sample[name] is None or self.baseline[name] is None:
+                continue
+            growth = sample[name] - self.baseline[name]
+            if growth > limit:
+                failures.append(f"{name} grew by {growth} ({self.baseline[name]} -> {sample[name]}), limit {limit}")
+        return failures
+
+    def _rss_kb(self):
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+        return None
+
+    def _match_rules(self):
+        if self.bus is None:
+            return None
+        try:
+            stats = dbus.Interface(self.bus.get_object('org.freedesktop.DBus', '/org/freedesktop/DBus'),
+                                   'org.freedesktop.DBus.Debug.Stats')
+            return int(stats.GetConnectionStats(self.bus.get_unique_name())['MatchRules'])
+        except (dbus.exceptions.DBusException, KeyError):
+            return None
@@ -0,0 +1,65 @@
+"""
+Simulated handsets: a stand-in for gpio_input whose pin levels are set by the tests, and helpers to lift, hang up
+and dial on it.
+"""
+import time
+
+import config
+import gpio_input
+
+
+class SimulatedInputs(object):
+    """ Stands in for gpio_input: pins of all handsets, with edges injected by the test. """
+    def __init__(self):
+        self.levels = {}
+        self.callbacks = {}
+        self.closed = 0
+
+    def setup(self, pin, pull_up=True):
+        self.levels.setdefault(pin, 1 if pull_up else 0)
+
+    def read(self, pin):
+        return self.levels[pin]
+
+    def add_event(self, pin, edge, callback, bouncetime=None):
+        self.callbacks[pin] = (edge, callback)
+
+    def start(self):
+        pass
+
+    def close(self):
+        self.closed += 1
+
+    def set_level(self, pin, level):
+        self.levels[pin] = level
+        edge, callback = self.callbacks[pin]
+        if edge == gpio_input.BOTH or (edge == gpio_input.RISING) == (level == 1):
+            callback(pin, level, time.monotonic())
+
+
+class Handset(object):
+    def __init__(self, inputs, pins):
+        self.inputs = inputs
+        self.pins = pins
+
+    def lift(self):
+        self.inputs.set_level(self.pins['HOERER_PIN'], 1)
+
+    def hang_up(self):
+        self.inputs.set_level(self.pins['HOERER_PIN'], 0)
+
+    def dial(self, number):
+        for digit in number:
+            for _ in range(int(digit) or 10):
+                self.inputs.set_level(self.pins['NS_PIN'], 0)
+                self.inputs.set_level(self.pins['NS_PIN'], 1)
+            time.sleep(config.DIAL_PULSE_GAP * 1.5)
+
+
+def wait_for(condition, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+import audio
+
+write_wav = audio.write_wav     # for writing the source files, the cache's conversions are counted
+
+
+def tone(frequency, rate, seconds=0.5, channels=1):
+    t = np.arange(int(rate * seconds)) / rate
+    return np.repeat(0.5 * np.sin(2 * np.pi * frequency * t)[:, None], channels, axis=1)
+
+
+def rms(samples):
+    # the ends are left out, the filter only has half its taps there
+    return np.sqrt(np.mean(samples[100:-100] ** 2))
+
+
+def test_mix_channels():
+    stereo = np.array([[0.2, 0.4], [-0.5, 0.1]])
+    assert audio.mix_channels(stereo, 1) == pytest.approx(np.array([[0.3], [-0.2]]))
+    mono = np.array([[0.25], [-0.75]])
+    assert audio.mix_channels(mono, 2) == pytest.approx(np.array([[0.25, 0.25], [-0.75, -0.75]]))
+    assert audio.mix_channels(stereo, 2) is stereo
+
+
+@pytest.mark.parametrize("rate, target_rate, frames, expected", [
+    (8000, 48000, 8000, 48000),
+    (44100, 48000, 441, 480),
+    (48000, 16000, 1000, 333),
+    (16000, 16000, 1000, 1000),
+])
+def test_resampled_length(rate, target_rate, frames, expected):
+    samples = np.zeros((frames, 2))
+    resampled = audio.resample(samples, rate, target_rate)
+    assert resampled.shape == (expected, 2)
+
+
+def test_upsampling_keeps_the_tone():
+    resampled = audio.resample(tone(440, 8000), 8000, 48000)
+    assert rms(resampled) == pytest.approx(rms(tone(440, 48000)), rel=0.01)
+
+
+def test_downsampling_removes_tones_above_the_new_nyquist_frequency():
+    # 7 kHz is above the 4 kHz Nyquist frequency of 8 kHz and would alias to 1 kHz without the low pass
+    kept = audio.resample(tone(1000, 48000), 48000, 8000)
+    removed = audio.resample(tone(7000, 48000), 48000, 8000)
+    assert rms(kept) == pytest.approx(0.5 / np.sqrt(2), rel=0.05)
+    assert rms(removed) < 0.01 * rms(kept)
+
+
+@pytest.fixture
+def conversions(monkeypatch):
+    converted = []
+
+    def counting_write_wav(filename, samples, rate):
+        converted.append((samples.shape[1], rate))
+        write_wav(filename, samples, rate)
+    monkeypatch.setattr(audio, 'write_wav', counting_write_wav)
+    return converted
+
+
+def test_transcode_cache_converts_once_per_source_and_format(tmp_path, conversions):
+    source = str(tmp_path / "prompt.wav")
+    write_wav(source, tone(440, 16000, seconds=0.1), 16000)
+    cache = audio.TranscodeCache(str(tmp_path / "cache"))
+
+    cached = cache.get(source, 48000, 2)
+    samples, rate = audio.read_wav(cached)
+    assert (rate, samples.shape) == (48000, (4800, 2))
+    assert cache.get(source, 48000, 2) == cached
+    assert conversions == [(2, 48000)]
+
+    # another sound card
+    assert cache.get(source, 44100, 2) != cached
+    assert cache.get(source, 48000, 1) != cached
+    assert conversions == [(2, 48000), (2, 44100), (1, 48000)]
+
+    # an edited prompt under the same name
+    write_wav(source, tone(880, 16000, seconds=0.1), 16000)
+    assert cache.get(source, 48000, 2) != cached
+    assert len(conversions) == 4
+
+    # and a new cache on the same directory, as after a restart, finds every conversion done
+    assert audio.TranscodeCache(str(tmp_path / "cache")).get(source, 48000, 2) is not None
+    assert len(conversions) == 4
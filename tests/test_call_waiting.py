@@ -0,0 +1,83 @@
+"""
+Call waiting on a single telephone: a second call comes in during one, the hook flash answers it and puts the first
+on hold, and the calls end one at a time.
+"""
+import threading
+import time
+
+import pytest
+
+import config
+import gpio_input
+import hook_switch
+import mock_ofono
+import telefonoa
+from simulated_handset import Handset, SimulatedInputs, wait_for
+
+PINS = {'NS_PIN': 300, 'HOERER_PIN': 301}
+FLASH_MAX = 0.2
+
+
+def calls(ofono, member):
+    return [c for c in ofono.method_calls if c[2] == member]
+
+
+@pytest.fixture
+def telephone(monkeypatch, tmp_path):
+    bus = mock_ofono.FakeBus()
+    mock_ofono.patch_services(monkeypatch, tmp_path, bus)
+    ofono = mock_ofono.MockOfono(bus)
+    ofono.add_modem()
+    ofono.start()
+    mock_ofono.MockBluez(bus).start()
+    inputs = SimulatedInputs()
+    inputs.levels[PINS['HOERER_PIN']] = 0
+    monkeypatch.setattr(gpio_input, 'create_inputs', lambda: inputs)
+    monkeypatch.setattr(telefonoa.ringer, 'RingerManager', mock_ofono.FakeRinger)
+    monkeypatch.setattr(config, 'ANSWER_DELAY', 0)
+    monkeypatch.setattr(config, 'DIAL_PULSE_GAP', 0.05)
+    monkeypatch.setattr(config, 'DIAL_TIMEOUT', 0.25)
+    monkeypatch.setattr(hook_switch.HookDebouncer.__init__, '__defaults__', (config.HOOK_SETTLE_TIME, FLASH_MAX))
+    monkeypatch.chdir(mock_ofono.REPO)
+    telephone = telefonoa.Telephone(PINS['NS_PIN'], PINS['HOERER_PIN'])
+    telephone.phone_manager.reconciled.wait(5)
+    threading.Thread(target=telephone.dialing_handler, daemon=True).start()
+    yield telephone, ofono, Handset(inputs, PINS)
+    telephone.finish = True
+    telephone.close()
+
+
+def flash(handset):
+    handset.hang_up()
+    time.sleep(FLASH_MAX / 2)
+    handset.lift()
+
+
+def test_held_call_outlives_the_party_that_hangs_up(telephone):
+    telephone, ofono, handset = telephone
+    phone_manager = telephone.phone_manager
+    first = ofono.incoming_call()
+    handset.lift()
+    assert wait_for(lambda: ofono.call_states[first] == 'active')
+
+    second = ofono.incoming_call(number="0400000002", state='waiting')
+    assert phone_manager.call_in_progress
+    assert not telephone.ringer.is_ringing
+    flash(handset)
+    assert wait_for(lambda: len(calls(ofono, 'HoldAndAnswer')) == 1)
+    assert ofono.call_states == {first: 'held', second: 'active'}
+
+    # the caller on the line hangs up: the held call is still there, so digits are still tones for it
+    ofono.call_removed(second)
+    assert phone_manager.call_in_progress
+    assert phone_manager.live_calls == {first}
+    handset.dial("5")
+    assert wait_for(lambda: [tones for _, tones in ofono.tones] == ["5"])
+    assert ofono.dialed == []
+
+    # going on hook hangs up the held call as well
+    handset.hang_up()
+    assert wait_for(lambda: len(calls(ofono, 'HangupAll')) == 1, timeout=FLASH_MAX + 1)
+    assert ofono.active_calls == {}
+    assert not phone_manager.call_in_progress
+    assert phone_manager.live_calls == set()
@@ -0,0 +1,125 @@
+import io
+import time
+
+import pytest
+
+import contacts
+import mock_ofono
+
+ADDRESS = "AA:BB:CC:DD:EE:FF"
+
+
+def vcard(i, name=None):
+    name = name if name is not None else f"Contact {i}"
+    return (f"BEGIN:VCARD\r\nVERSION:3.0\r\nFN:{name}\r\nN:{i};Contact;;;\r\n"
+            f"TEL;TYPE=CELL:+61 4{i:08d}\r\nTEL;TYPE=HOME:02 {i:08d}\r\nEND:VCARD\r\n")
+
+
+def phonebook(indices):
+    return "".join(vcard(i) for i in indices)
+
+
+def parse(text):
+    return list(contacts.parse_vcards(io.StringIO(text)))
+
+
+@pytest.mark.parametrize("escaped, plain", [
+    (r"Smith\, John", "Smith, John"),
+    (r"A\;B", "A;B"),
+    (r"Line\nbreak", "Line break"),
+    (r"Line\Nbreak", "Line break"),
+    (r"back\\slash", "back\\slash"),
+    (r"back\\nslash", "back\\nslash"),     # an escaped backslash followed by n, not a newline
+    (r"end\\", "end\\"),
+])
+def test_unescape(escaped, plain):
+    assert contacts._unescape(escaped) == plain
+
+
+def test_parse_vcards():
+    text = (vcard(1) +
+            "BEGIN:VCARD\nVERSION:2.1\nN:Doe;Jane;;;\nTEL;CELL:0419 239 384\nTEL:\nEND:VCARD\n" +
+            "junk outside a card\n" +
+            "BEGIN:VCARD\r\nVERSION:3.0\r\nFN:A very long name that the phone has\r\n  folded\r\n"
+            "TEL:123\r\nEND:VCARD\r\n" +
+            "BEGIN:VCARD\r\nVERSION:3.0\r\nTEL:555\r\nEND:VCARD\r\n")
+    cards = parse(text)
+    assert [(name, numbers) for _, name, numbers in cards] == [
+        ("Contact 1", ["+61 400000001", "02 00000001"]),
+        ("Jane Doe", ["0419 239 384"]),
+        ("A very long name that the phone has folded", ["123"]),
+        (None, ["555"]),
+    ]
+    assert len(set(key for key, _, _ in cards)) == 4
+    assert parse(vcard(1))[0][0] == cards[0][0]
+    assert parse(vcard(1, name="Renamed"))[0][0] != cards[0][0]
+
+
+def test_cache_update_adds_and_removes_only_changes(tmp_path):
+    cache = contacts.ContactCache(str(tmp_path / "contacts.db"))
+    assert cache.update(ADDRESS, contacts.parse_vcards(io.StringIO(phonebook(range(1, 4)))), "id:1") == (3, 0)
+    assert cache.lookup("0400000002") == "Contact 2"
+    assert cache.lookup("+61 (2) 0000 0003") == "Contact 3"
+    assert cache.version(ADDRESS) == "id:1"
+
+    assert cache.update(ADDRESS, contacts.parse_vcards(io.StringIO(phonebook(range(1, 4)))), "id:1") == (0, 0)
+    text = phonebook([1, 3]) + vcard(2, name="Contact Two") + vcard(4)
+    assert cache.update(ADDRESS, contacts.parse_vcards(io.StringIO(text)), "id:2") == (2, 1)
+    assert cache.lookup("0400000002") == "Contact Two"
+    assert cache.lookup("0400000004") == "Contact 4"
+    assert cache.version(ADDRESS) == "id:2"
+
+
+def test_cache_keeps_phones_apart(tmp_path):
+    cache = contacts.ContactCache(str(tmp_path / "contacts.db"))
+    cache.update(ADDRESS, contacts.parse_vcards(io.StringIO(phonebook([1]))), None)
+    cache.update("11:22:33:44:55:66", contacts.parse_vcards(io.StringIO(phonebook([2]))), None)
+    cache.update(ADDRESS, iter([]), None)
+    assert cache.lookup("0400000001") is None
+    assert cache.lookup("0400000002") == "Contact 2"
+
+
+@pytest.fixture
+def obex(monkeypatch, tmp_path):
+    bus = mock_ofono.FakeBus()
+    obex = mock_ofono.MockObex(bus)
+    obex.start()
+    monkeypatch.setattr(contacts.dbus, 'SessionBus', lambda: bus)
+    monkeypatch.chdir(tmp_path)
+    return obex
+
+
+def pulls(obex):
+    return [c for c in obex.method_calls if c[2] == 'PullAll']
+
+
+def test_sync_large_phonebook_from_obex(obex, tmp_path):
+    obex.vcards = phonebook(range(1, 5001))
+    obex.version = ("db1", "7")
+    cache = contacts.ContactCache(str(tmp_path / "contacts.db"))
+
+    started = time.monotonic()
+    contacts.ContactSync(cache, ADDRESS).run()
+    assert time.monotonic() - started < 10
+    assert cache.lookup("0400004321") == "Contact 4321"
+    assert cache.version(ADDRESS) == "db1:7"
+    assert obex.sessions == []
+    assert not (tmp_path / "contacts_transfer.vcf").exists()
+
+    # unchanged counters: nothing is transferred
+    contacts.ContactSync(cache, ADDRESS).run()
+    assert len(pulls(obex)) == 1
+
+    obex.vcards = phonebook(range(2, 5002))
+    obex.version = ("db1", "8")
+    contacts.ContactSync(cache, ADDRESS).run()
+    assert len(pulls(obex)) == 2
+    assert cache.lookup("0400000001") is None
+    assert cache.lookup("0400005001") == "Contact 5001"
+
+
+def test_sync_without_obex(obex, tmp_path):
+    obex.kill()
+    cache = contacts.ContactCache(str(tmp_path / "contacts.db"))
+    contacts.ContactSync(cache, ADDRESS).run()
+    assert cache.version(ADDRESS) is None
@@ -0,0 +1,94 @@
+import dbus_cache
+import dbus_custom_services
+import mock_ofono
+
+MODEM = mock_ofono.MODEM
+CALL = MODEM + "/voicecall01"
+
+
+def owner_matches(bus, name=None):
+    return [m for m in bus.matches if m.rule['signal_name'] == 'NameOwnerChanged'
+            and (name is None or m.rule['arg0'] == name)]
+
+
+def make_cache():
+    bus = mock_ofono.FakeBus()
+    ofono = mock_ofono.MockOfono(bus)
+    ofono.start()
+    mock_ofono.MockBluez(bus).start()
+    return bus, ofono, dbus_cache.ProxyCache(bus)
+
+
+def test_proxies_are_built_once():
+    bus, _, cache = make_cache()
+    manager = cache.get_interface('org.ofono', '/', 'org.ofono.Manager')
+    assert cache.get_interface('org.ofono', '/', 'org.ofono.Manager') is manager
+    assert cache.get_object('org.ofono', '/') is manager._obj
+    assert cache.get_interface('org.ofono', '/', 'org.ofono.Other') is not manager
+    # the interface and its object missed once each, then interface, object and the object again under Other hit
+    assert cache.stats() == {'hits': 3, 'misses': 3, 'invalidations': 0, 'entries': 3}
+
+
+def test_owner_changes_are_watched_per_cached_name():
+    bus, _, cache = make_cache()
+    assert owner_matches(bus) == []
+    for path in ('/', MODEM, CALL):
+        cache.get_object('org.ofono', path)
+    cache.get_object('org.bluez', '/org/bluez/hci0')
+    assert len(owner_matches(bus, 'org.ofono')) == 1
+    assert len(owner_matches(bus, 'org.bluez')) == 1
+    assert len(owner_matches(bus)) == 2
+
+
+def test_other_clients_on_the_bus_are_ignored():
+    bus, ofono, cache = make_cache()
+    cache.get_object('org.ofono', '/')
+    woken = []
+    for match in owner_matches(bus):
+        match.handler = lambda *args: woken.append(args)
+    bus.own('org.example.Other', object())
+    bus.release('org.example.Other')
+    assert woken == []
+    ofono.kill()
+    assert [args[0] for args in woken] == ['org.ofono']
+
+
+def test_restart_drops_only_that_services_proxies():
+    bus, ofono, cache = make_cache()
+    manager = cache.get_interface('org.ofono', '/', 'org.ofono.Manager')
+    adapter = cache.get_object('org.bluez', '/org/bluez/hci0')
+    ofono.kill()
+    ofono.start()
+    assert cache.get_interface('org.ofono', '/', 'org.ofono.Manager') is not manager
+    assert cache.get_object('org.bluez', '/org/bluez/hci0') is adapter
+    assert len(owner_matches(bus, 'org.ofono')) == 1
+
+
+def test_removed_modem_and_call_are_dropped():
+    bus, ofono, cache = make_cache()
+    manager = cache.get_object('org.ofono', '/')
+    modem = cache.get_object('org.ofono', MODEM)
+    call = cache.get_object('org.ofono', CALL)
+    other = cache.get_object('org.ofono', MODEM + "_2")
+
+    ofono.emit(MODEM, 'org.ofono.VoiceCallManager', 'CallRemoved', CALL)
+    assert cache.get_object('org.ofono', CALL) is not call
+    assert cache.get_object('org.ofono', MODEM) is modem
+
+    ofono.emit('/', 'org.ofono.Manager', 'ModemRemoved', MODEM)
+    assert cache.get_object('org.ofono', MODEM) is not modem
+    assert cache.get_object('org.ofono', MODEM + "_2") is other
+    assert cache.get_object('org.ofono', '/') is manager
+
+
+def test_pairing_agent_shares_the_bus_and_cache():
+    bus, _, cache = make_cache()
+    agent = dbus_custom_services.AutoAcceptAgent(bus, "/test/agent", cache)
+    device = "/org/bluez/hci0/dev_AA_BB_CC_DD_EE_FF"
+    agent.dev_connect(device)
+    agent.dev_connect(device)
+    assert agent.bus is bus
+    assert cache.get_interface('org.bluez', device, 'org.bluez.Device1') is not None
+    assert cache.stats()['hits'] == 2
+    bluez = bus.services['org.bluez']
+    assert [(c[0], c[2]) for c in bluez.method_calls] == [(device, 'Connect'), (device, 'Connect')]
@@ -0,0 +1,120 @@
+"""
+ToneSender against the mock ofono: digits dialed during a call go out through VoiceCallManager.SendTones, which the
+mock records with the time of each call.
+"""
+import time
+
+import pytest
+
+import config
+import dtmf
+import mock_ofono
+from simulated_handset import wait_for
+
+# A digit dialed after a quiet spell must reach ofono within this many seconds
+FIRST_DIGIT_LATENCY = 0.05
+
+
+@pytest.fixture
+def phone(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, 'ANSWER_DELAY', 0)
+    phone = mock_ofono.start_phone(monkeypatch, tmp_path)
+    phone.ofono.incoming_call()
+    phone.manager.answer_call()
+    yield phone
+    mock_ofono.stop_phone(phone)
+
+
+def test_first_digit_is_sent_straight_away(phone):
+    dialed = time.monotonic()
+    phone.manager.send_tone(5)
+    assert wait_for(lambda: len(phone.ofono.tones) == 1, timeout=1)
+    sent, tones = phone.ofono.tones[0]
+    assert tones == "5"
+    assert sent - dialed < FIRST_DIGIT_LATENCY
+
+
+def test_digits_within_the_batch_window_are_sent_together(phone):
+    window = phone.manager.tone_sender.window
+    phone.manager.send_tone(1)
+    assert wait_for(lambda: len(phone.ofono.tones) == 1, timeout=1)
+    for digit in (2, 3, 4):
+        phone.manager.send_tone(digit)
+    assert wait_for(lambda: len(phone.ofono.tones) == 2, timeout=2 * window)
+    (first, tones1), (second, tones2) = phone.ofono.tones
+    assert (tones1, tones2) == ("1", "234")
+    assert window <= second - first < window + 0.1
+
+
+def test_digits_after_the_window_are_sent_on_their_own(phone):
+    window = phone.manager.tone_sender.window
+    phone.manager.send_tone(1)
+    time.sleep(window + 0.1)
+    phone.manager.send_tone(2)
+    assert wait_for(lambda: len(phone.ofono.tones) == 2, timeout=1)
+    assert [tones for _, tones in phone.ofono.tones] == ["1", "2"]
+    assert phone.ofono.tones[1][0] - phone.ofono.tones[0][0] < window + 0.1 + FIRST_DIGIT_LATENCY
+
+
+def test_digits_not_yet_sent_are_dropped_when_the_call_ends(phone):
+    window = phone.manager.tone_sender.window
+    phone.manager.send_tone(1)
+    assert wait_for(lambda: len(phone.ofono.tones) == 1, timeout=1)
+    phone.manager.send_tone(2)
+    phone.manager.send_tone(3)
+    phone.ofono.call_removed(phone.manager.active_call_path)
+    time.sleep(window + 0.1)
+    assert [tones for _, tones in phone.ofono.tones] == ["1"]
+
+    phone.manager.send_tone(4)
+    assert wait_for(lambda: len(phone.ofono.tones) == 2, timeout=1)
+    assert phone.ofono.tones[1][1] == "4"
+
+
+def test_sender_keeps_going_after_ofono_refuses_tones(phone):
+    send_tones = phone.ofono.SendTones
+
+    def refuse_once(path, tones):
+        phone.ofono.SendTones = send_tones
+        raise mock_ofono.dbus.exceptions.DBusException("No active call", name='org.ofono.Error.Failed')
+    phone.ofono.SendTones = refuse_once
+    phone.manager.send_tone(1)
+    assert wait_for(lambda: phone.ofono.SendTones == send_tones, timeout=1)
+    time.sleep(config.DTMF_BATCH_WINDOW + 0.1)
+    phone.manager.send_tone(2)
+    assert wait_for(lambda: len(phone.ofono.tones) == 1, timeout=1)
+    assert phone.ofono.tones[0][1] == "2"
+
+
+def test_digit_queued_after_ofono_is_lost_leaves_the_sender_running(phone):
+    phone.manager.ofono_lost()
+    phone.manager.send_tone(1)
+    time.sleep(0.1)
+    assert phone.manager.tone_sender.is_alive()
+    assert phone.ofono.tones == []
+
+    # ofono back with the modem ready: tones go out again
+    phone.manager._listen_for_calls(config.READY)
+    time.sleep(config.DTMF_BATCH_WINDOW)
+    phone.manager.send_tone(2)
+    assert wait_for(lambda: len(phone.ofono.tones) == 1, timeout=1)
+    assert phone.ofono.tones[0][1] == "2"
+
+
+def test_sender_keeps_going_after_an_unexpected_error():
+    sent = []
+
+    def send_tones(tones):
+        sent.append(tones)
+        if len(sent) == 1:
+            raise RuntimeError("proxy gone")
+    sender = dtmf.ToneSender(send_tones, window=0.05)
+    sender.start()
+    try:
+        sender.put(1)
+        assert wait_for(lambda: sent == ["1"], timeout=1)
+        time.sleep(0.1)
+        sender.put(2)
+        assert wait_for(lambda: sent == ["1", "2"], timeout=1)
+    finally:
+        sender.finish = True
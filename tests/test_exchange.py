@@ -0,0 +1,134 @@
+"""
+Load test of the multi-handset Exchange with simulated handsets: the GPIO inputs of every extension are driven from
+the test and the extensions share one PhoneManager on the mock ofono.
+"""
+import random
+import threading
+import time
+
+import pytest
+
+import config
+import gpio_input
+import mock_ofono
+import telefonoa
+from simulated_handset import Handset, SimulatedInputs, wait_for
+
+
+def extension_pins(n):
+    return [{'NS_PIN': 100 + 4 * i, 'HOERER_PIN': 101 + 4 * i, 'RINGER_PIN': 102 + 4 * i,
+             'RINGER_ENABLE_PIN': 103 + 4 * i} for i in range(n)]
+
+
+@pytest.fixture
+def exchange_factory(monkeypatch, tmp_path):
+    exchanges = []
+
+    def make(n, answer_delay=0):
+        bus = mock_ofono.FakeBus()
+        mock_ofono.patch_services(monkeypatch, tmp_path, bus)
+        ofono = mock_ofono.MockOfono(bus)
+        ofono.add_modem()
+        ofono.start()
+        mock_ofono.MockBluez(bus).start()
+        inputs = SimulatedInputs()
+        for pins in extension_pins(n):
+            inputs.levels[pins['HOERER_PIN']] = 0   # every receiver starts on hook
+        monkeypatch.setattr(gpio_input, 'create_inputs', lambda: inputs)
+        monkeypatch.setattr(telefonoa.ringer, 'RingerManager', mock_ofono.FakeRinger)
+        monkeypatch.setattr(config, 'ANSWER_DELAY', answer_delay)
+        monkeypatch.setattr(config, 'DIAL_TIMEOUT', 1.0)
+        monkeypatch.chdir(mock_ofono.REPO)
+        exchange = telefonoa.Exchange(extension_pins(n))
+        dialer = threading.Thread(target=exchange.dialing_handler, daemon=True)
+        dialer.start()
+        exchanges.append(exchange)
+        handsets = [Handset(inputs, pins) for pins in extension_pins(n)]
+        return exchange, ofono, handsets, inputs
+
+    yield make
+    for exchange in exchanges:
+        exchange.close()
+
+
+def calls(ofono, member):
+    return [c for c in ofono.method_calls if c[2] == member]
+
+
+def test_incoming_call_rings_all_and_first_off_hook_answers(exchange_factory):
+    exchange, ofono, handsets, _ = exchange_factory(3)
+    ofono.incoming_call()
+    assert all(e.ringer.is_ringing for e in exchange.extensions)
+
+    handsets[1].lift()
+    assert wait_for(lambda: len(calls(ofono, 'Answer')) == 1)
+    assert not any(e.ringer.is_ringing for e in exchange.extensions)
+    handsets[2].lift()
+    assert wait_for(lambda: len(exchange.in_call) == 2)
+
+    handsets[1].hang_up()
+    assert wait_for(lambda: len(exchange.in_call) == 1)
+    assert calls(ofono, 'HangupAll') == []
+    handsets[2].hang_up()
+    assert wait_for(lambda: len(calls(ofono, 'HangupAll')) == 1)
+    assert len(calls(ofono, 'Answer')) == 1
+
+
+def test_other_extensions_are_not_held_up_while_a_call_is_answered(exchange_factory):
+    exchange, ofono, handsets, _ = exchange_factory(2, answer_delay=1.0)
+    ofono.incoming_call()
+    handsets[0].lift()
+    assert wait_for(lambda: exchange.answering)
+    started = time.monotonic()
+    handsets[1].lift()
+    assert wait_for(lambda: len(exchange.in_call) == 2, timeout=0.5)
+    assert time.monotonic() - started < 0.5
+    assert calls(ofono, 'Answer') == []
+    assert wait_for(lambda: len(calls(ofono, 'Answer')) == 1)
+
+
+def test_intercom_rings_only_the_called_extension(exchange_factory):
+    exchange, ofono, handsets, _ = exchange_factory(3)
+    handsets[0].lift()
+    assert wait_for(lambda: not exchange.extensions[0].receiver_down)
+    handsets[0].dial(config.INTERCOM_PREFIX + "3")
+    assert wait_for(lambda: exchange.extensions[2].ringer.is_ringing)
+    assert not exchange.extensions[1].ringer.is_ringing
+    handsets[2].lift()
+    assert wait_for(lambda: not exchange.extensions[2].ringer.is_ringing)
+    handsets[0].hang_up()
+    assert wait_for(lambda: exchange.intercom is None)
+    assert ofono.dialed == []
+
+
+def test_load_many_handsets_many_calls(exchange_factory):
+    exchange, ofono, handsets, _ = exchange_factory(8)
+    rng = random.Random(31)
+    threads_before = threading.active_count()
+    for cycle in range(10):
+        call_path = ofono.incoming_call()
+        assert all(e.ringer.is_ringing for e in exchange.extensions)
+        lifted = rng.sample(handsets, rng.randint(1, len(handsets)))
+        for handset in lifted:
+            handset.lift()
+        assert wait_for(lambda: len(calls(ofono, 'Answer')) == cycle + 1)
+        assert wait_for(lambda: len(exchange.in_call) == len(lifted))
+        assert not any(e.ringer.is_ringing for e in exchange.extensions)
+        for handset in lifted:
+            handset.hang_up()
+        assert wait_for(lambda: len(calls(ofono, 'HangupAll')) == cycle + 1)
+        ofono.call_removed(call_path)
+        assert wait_for(lambda: all(e.receiver_down for e in exchange.extensions))
+    assert len(calls(ofono, 'Answer')) == 10
+    assert len(calls(ofono, 'HangupAll')) == 10
+    assert threading.active_count() <= threads_before
+
+
+def test_close_shuts_shared_phone_manager_and_inputs_once(exchange_factory, monkeypatch):
+    exchange, _, _, inputs = exchange_factory(3)
+    closes = []
+    close = exchange.phone_manager.close
+    monkeypatch.setattr(exchange.phone_manager, 'close', lambda: closes.append(True) or close())
+    exchange.close()
+    assert closes == [True]
+    assert inputs.closed == 1
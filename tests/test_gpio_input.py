@@ -0,0 +1,161 @@
+"""
+The gpiod backend with the line requests replaced by fakes: edge events with kernel timestamps are fed in by the
+test, either straight to _dispatch or through the file descriptor the reading thread waits on.
+"""
+import os
+import queue
+import time
+
+import pytest
+
+import config
+import gpio_input
+import telefonoa
+from simulated_handset import wait_for
+
+gpiod = pytest.importorskip("gpiod")
+from gpiod.line import Value  # noqa: E402
+
+PIN = 19
+PULSE_PERIOD = 0.1  # 10 pulses per second, as a rotary dial
+
+
+class FakeLineRequest(object):
+    """ A requested line whose edge events are pushed by the test. The fd becomes readable when events wait. """
+    def __init__(self, chip, consumer=None, config=None):
+        self.value = Value.ACTIVE
+        self.settings = dict(config)
+        self.events = []
+        self.fd, self._write_fd = os.pipe()
+
+    def push(self, events):
+        self.events.extend(events)
+        os.write(self._write_fd, b"x")
+
+    def read_edge_events(self, max_events=None):
+        batch, self.events = self.events[:max_events], self.events[max_events:]
+        if len(self.events) == 0:
+            os.read(self.fd, 4096)
+        return batch
+
+    def get_value(self, offset):
+        return self.value
+
+    def reconfigure_lines(self, config):
+        self.settings.update(config)
+
+    def release(self):
+        os.close(self.fd)
+        os.close(self._write_fd)
+
+
+def edge(rising, timestamp, pin=PIN):
+    event_type = gpiod.EdgeEvent.Type.RISING_EDGE if rising else gpiod.EdgeEvent.Type.FALLING_EDGE
+    return gpiod.EdgeEvent(event_type, int(timestamp * 1e9), pin, 0, 0)
+
+
+def pulse(at, bounce=0.002):
+    """ Falling edge of a dial pulse at at, followed by contact bounce. """
+    return [edge(False, at), edge(True, at + bounce / 2), edge(False, at + bounce)]
+
+
+@pytest.fixture
+def inputs(monkeypatch):
+    requests = []
+
+    def request_lines(chip, consumer=None, config=None):
+        requests.append(FakeLineRequest(chip, consumer, config))
+        return requests[-1]
+    monkeypatch.setattr(gpiod, 'request_lines', request_lines)
+    inputs = gpio_input.GpiodInputs("/dev/gpiochip-test")
+    yield inputs
+    inputs.close()
+
+
+def test_dispatch_drops_edges_within_bouncetime(inputs):
+    seen = []
+    inputs.setup(PIN)
+    inputs.add_event(PIN, gpio_input.BOTH, lambda *args: seen.append(args), bouncetime=10)
+    for rising, at in ((False, 1.000), (True, 1.004), (False, 1.009), (True, 1.010), (False, 1.025)):
+        inputs._dispatch(edge(rising, at))
+    assert [(pin, level) for pin, level, _ in seen] == [(PIN, 0), (PIN, 1), (PIN, 0)]
+    assert [timestamp for _, _, timestamp in seen] == pytest.approx([1.0, 1.01, 1.025])
+
+
+def test_dispatch_without_bouncetime_passes_every_edge(inputs):
+    seen = []
+    inputs.setup(PIN, pull_up=False)
+    inputs.add_event(PIN, gpio_input.RISING, lambda *args: seen.append(args))
+    for at in (2.0, 2.0001, 2.0002):
+        inputs._dispatch(edge(True, at))
+    assert [level for _, level, _ in seen] == [1, 1, 1]
+
+
+def test_read_and_edge_settings(inputs):
+    inputs.setup(PIN)
+    request = inputs._requests[PIN]
+    assert inputs.read(PIN) == 1
+    request.value = Value.INACTIVE
+    assert inputs.read(PIN) == 0
+    inputs.add_event(PIN, gpio_input.FALLING, lambda *args: None)
+    assert request.settings[PIN].edge_detection == gpiod.line.Edge.FALLING
+    assert request.settings[PIN].event_clock == gpiod.line.Clock.MONOTONIC
+
+
+@pytest.fixture
+def dial(inputs):
+    number_q = queue.Queue()
+    rotary_dial = telefonoa.RotaryDial(PIN, number_q, inputs)
+    rotary_dial.start()
+    inputs.start()
+    yield inputs._requests[PIN], number_q
+    rotary_dial.finish = True
+    rotary_dial.join(1)
+
+
+def test_dialed_digits_through_the_reading_thread(dial):
+    request, number_q = dial
+    for digit in (3, 10, 1):
+        for _ in range(digit):
+            request.push(pulse(time.monotonic()))
+            time.sleep(PULSE_PERIOD)
+        assert number_q.get(timeout=1) == digit % 10
+    assert number_q.empty()
+
+
+def test_digit_completes_from_the_pulse_timestamp(dial):
+    """ A pulse read late completes the digit a gap after the pulse happened, not a gap after it was read. """
+    request, number_q = dial
+    late = 0.1
+    delivered = time.monotonic()
+    request.push(pulse(delivered - late))
+    assert number_q.get(timeout=1) == 1
+    # at most a poll of the dial thread after the gap, counted from the pulse
+    assert time.monotonic() - delivered < config.DIAL_PULSE_GAP - late + config.DIAL_PULSE_GAP / 4 + 0.03
+
+
+
+def test_raising_handler_leaves_the_reading_thread_running(inputs):
+    button = PIN + 1
+    pressed = []
+
+    def make_discoverable(*args):
+        pressed.append(args)
+        raise RuntimeError("org.bluez not on the bus")
+    inputs.setup(button)
+    inputs.add_event(button, gpio_input.FALLING, make_discoverable)
+    number_q = queue.Queue()
+    rotary_dial = telefonoa.RotaryDial(PIN, number_q, inputs)
+    rotary_dial.start()
+    inputs.start()
+    try:
+        inputs._requests[button].push([edge(False, time.monotonic(), pin=button)])
+        assert wait_for(lambda: len(pressed) == 1)
+        for _ in range(2):
+            inputs._requests[PIN].push(pulse(time.monotonic()))
+            time.sleep(PULSE_PERIOD)
+        assert number_q.get(timeout=1) == 2
+        assert inputs.is_alive()
+    finally:
+        rotary_dial.finish = True
+        rotary_dial.join(1)
@@ -0,0 +1,87 @@
+import time
+
+import pytest
+
+import hook_switch
+from hook_switch import FLASH, OFF_HOOK, ON_HOOK
+from simulated_handset import wait_for
+
+SETTLE = 0.02
+FLASH_MAX = 0.6
+
+
+def bouncy(t, level, bounces=3, spacing=0.003):
+    """ Edges of a contact closing or opening at t that chatters bounces times before settling at level. """
+    edges = []
+    for i in range(bounces):
+        edges.append((t + 2 * i * spacing, level))
+        edges.append((t + (2 * i + 1) * spacing, 1 - level))
+    edges.append((t + 2 * bounces * spacing, level))
+    return edges
+
+
+def run(initial_level, edges, until=10.0):
+    """ Feed edges to a HookDebouncer, polling at every deadline as HookSwitch.run does. """
+    debouncer = hook_switch.HookDebouncer(initial_level, SETTLE, FLASH_MAX)
+    events = []
+    for t, level in edges + [(until, None)]:
+        deadline = debouncer.next_deadline()
+        while deadline is not None and deadline <= t:
+            events.extend(debouncer.poll(deadline))
+            deadline = debouncer.next_deadline()
+        if level is not None:
+            debouncer.edge(level, t)
+    return events
+
+
+def test_bounce_on_lift_gives_one_off_hook_soon_after_last_bounce():
+    edges = bouncy(1.0, 1)
+    events = run(0, edges)
+    assert [event for event, _ in events] == [OFF_HOOK]
+    assert events[0][1] == pytest.approx(edges[-1][0] + SETTLE)
+
+
+def test_bounce_on_hang_up_gives_one_on_hook():
+    edges = bouncy(5.0, 0)
+    events = run(1, edges)
+    assert [event for event, _ in events] == [ON_HOOK]
+    assert events[0][1] == pytest.approx(edges[-1][0] + FLASH_MAX)
+
+
+def test_short_on_hook_pulse_is_a_flash_not_a_hang_up():
+    events = run(1, bouncy(2.0, 0) + bouncy(2.0 + FLASH_MAX / 2, 1))
+    assert [event for event, _ in events] == [FLASH]
+
+
+def test_on_hook_longer_than_flash_max_is_hang_up_then_lift():
+    events = run(1, bouncy(2.0, 0) + bouncy(2.0 + FLASH_MAX * 2, 1))
+    assert [event for event, _ in events] == [ON_HOOK, OFF_HOOK]
+
+
+@pytest.mark.parametrize("initial_level", [0, 1])
+def test_glitch_shorter_than_settle_time_is_ignored(initial_level):
+    glitch = [(3.0, 1 - initial_level), (3.0 + SETTLE / 2, initial_level)]
+    assert run(initial_level, glitch) == []
+
+
+def test_hook_switch_survives_a_failing_handler():
+    changes = []
+
+    def on_change(receiver_up):
+        changes.append(receiver_up)
+        if receiver_up:
+            raise RuntimeError("org.ofono.Error.Failed")     # e.g. the caller hung up before the answer
+    switch = hook_switch.HookSwitch(0, on_change, lambda: None)
+    switch.debouncer = hook_switch.HookDebouncer(0, SETTLE, FLASH_MAX)
+    switch.start()
+    try:
+        now = time.monotonic()
+        switch.edge(1, now)
+        assert wait_for(lambda: changes == [True])
+        switch.edge(0, now + 0.05)
+        assert wait_for(lambda: changes == [True, False])
+        assert switch.is_alive()
+    finally:
+        switch.finish = True
+        switch.edge(0)
+        switch.join(2)
@@ -0,0 +1,84 @@
+import faulthandler
+import os
+import signal
+import threading
+import time
+
+import pytest
+
+import profiler
+
+
+def busy_loop(stop):
+    x = 0
+    while not stop.is_set():
+        for _ in range(100000):
+            x = (x * 31 + 7) % 1000003
+
+
+def idle_wait(stop):
+    stop.wait()
+
+
+@pytest.fixture
+def in_tmp(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    yield tmp_path
+    if profiler._running is not None:
+        profiler._running.join(5)
+
+
+def read_profile(filename):
+    with open(filename) as f:
+        return {stack: int(count) for stack, count in (line.rsplit(" ", 1) for line in f)}
+
+
+def test_busy_thread_shows_up_in_the_profile(tmp_path):
+    stop = threading.Event()
+    threads = [threading.Thread(target=busy_loop, args=(stop,), name="Busy"),
+               threading.Thread(target=idle_wait, args=(stop,), name="Idle")]
+    for thread in threads:
+        thread.start()
+    sampler = profiler.SamplingProfiler(0.5, interval=0.005, output_dir=str(tmp_path))
+    sampler.start()
+    sampler.join(5)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    stacks = read_profile(sampler.output)
+    busy = {stack: count for stack, count in stacks.items() if stack.startswith("Busy;")}
+    assert len(busy) > 0
+    assert all("busy_loop (test_profiler.py)" in stack for stack in busy)
+    # the thread is sampled every time, mostly in the loop itself
+    assert sum(busy.values()) == sampler.samples
+    in_loop = sum(count for stack, count in busy.items() if stack.endswith("busy_loop (test_profiler.py)"))
+    assert in_loop > sampler.samples / 2
+    assert any(stack.startswith("Idle;") and "idle_wait (test_profiler.py)" in stack for stack in stacks)
+    assert not any(stack.startswith("Profiler;") for stack in stacks)
+
+
+def test_second_start_while_profiling_is_refused(in_tmp):
+    output = profiler.start(0.2)
+    assert output is not None
+    assert profiler.start(0.2) is None
+    profiler._running.join(5)
+    assert os.path.exists(output)
+
+
+def test_signal_during_start_does_not_deadlock(in_tmp, monkeypatch):
+    monkeypatch.setattr(profiler.start, '__defaults__', (0.2, True))
+    previous = signal.signal(signal.SIGUSR1, profiler._signal_handler)
+    faulthandler.dump_traceback_later(10, exit=True)   # fail the run rather than hang it if the handler blocks
+    try:
+        with profiler._lock:
+            # a SIGUSR1 arriving while the main thread is inside start(), e.g. from the first of two signals
+            os.kill(os.getpid(), signal.SIGUSR1)
+            time.sleep(0.01)
+            assert profiler._running is None
+        os.kill(os.getpid(), signal.SIGUSR1)
+        time.sleep(0.01)
+        assert profiler._running is not None
+    finally:
+        faulthandler.cancel_dump_traceback_later()
+        signal.signal(signal.SIGUSR1, previous)
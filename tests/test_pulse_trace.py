@@ -0,0 +1,41 @@
+import pulse_trace
+
+
+def dial_trace(digits, pulse_period=0.1, break_time=0.06, digit_gap=0.7, bounces=2):
+    """ Synthetic dial trace: each pulse breaks the line (high to low) with a few bounces on the falling edge. """
+    edges = []
+    t = 0.5
+    for digit in digits:
+        for _ in range(digit if digit != 0 else 10):
+            for b in range(bounces):
+                edges.append((t + b * 0.002, 0))
+                edges.append((t + b * 0.002 + 0.001, 1))
+            edges.append((t + bounces * 0.002, 0))
+            edges.append((t + break_time, 1))
+            t += pulse_period
+        t += digit_gap
+    return pulse_trace.Trace("dial", 19, 1, "".join(str(d) for d in digits), edges)
+
+
+def test_dial_decoder_reads_digits_through_bounce():
+    decoded = pulse_trace.DialDecoder(bounce_time=20, pulse_gap=0.2).decode(dial_trace([1, 2, 0, 9]))
+    assert "".join(symbol for symbol, _ in decoded) == "1209"
+
+
+def test_dial_decoder_latency_follows_the_polling_loop():
+    decoder = pulse_trace.DialDecoder(bounce_time=20, pulse_gap=0.2)
+    latencies = [latency for _, latency in decoder.decode(dial_trace([3, 5, 7], digit_gap=0.737))]
+    poll = 0.2 / pulse_trace.DialDecoder.POLLS_PER_GAP
+    assert all(0.2 - 1e-9 <= latency < 0.2 + poll for latency in latencies)
+    # the check phase differs digit to digit, so the latency is not just the gap parameter echoed back
+    assert len(set(round(latency, 6) for latency in latencies)) > 1
+
+
+def test_replay_and_calibrate_on_synthetic_corpus():
+    traces = [dial_trace([1, 2, 3, 4, 5, 6, 7, 8, 9, 0]), dial_trace([4, 0, 8])]
+    error_rate, latency = pulse_trace.replay(traces, pulse_trace.DialDecoder(20, 0.2))
+    assert error_rate == 0.0
+    assert 0.2 <= latency < 0.25
+    constants = pulse_trace.calibrate(traces)
+    assert pulse_trace.replay(traces, pulse_trace.DialDecoder(constants["DIAL_BOUNCE_TIME"],
+                                                              constants["DIAL_PULSE_GAP"]))[0] == 0.0
@@ -0,0 +1,145 @@
+from types import SimpleNamespace
+
+import pytest
+
+import config
+import manager
+import mock_ofono
+import reconnect
+from simulated_handset import wait_for
+
+DEVICE = reconnect.modem_to_device_path(mock_ofono.MODEM)
+
+
+class RecordingAgent(object):
+    """ Pairing agent whose connects fail a given number of times. """
+    def __init__(self, failures=0):
+        self.connected = []
+        self.failures = failures
+
+    def dev_connect(self, path):
+        self.connected.append(path)
+        if len(self.connected) <= self.failures:
+            raise mock_ofono.dbus.exceptions.DBusException("Page timeout", name='org.bluez.Error.Failed')
+
+
+class RoundLimit(object):
+    """ Stands in for the stop event: records each backoff wait and stops the manager after rounds of them. """
+    def __init__(self, rounds):
+        self.rounds = rounds
+        self.waits = []
+
+    def is_set(self):
+        return len(self.waits) >= self.rounds
+
+    def wait(self, timeout):
+        self.waits.append(timeout)
+
+    def set(self):
+        self.rounds = 0
+
+
+@pytest.fixture
+def no_jitter(monkeypatch):
+    monkeypatch.setattr(config, 'RECONNECT_INITIAL_DELAY', 2)
+    monkeypatch.setattr(config, 'RECONNECT_MAX_DELAY', 10)
+    monkeypatch.setattr(config, 'RECONNECT_JITTER', 0)
+
+
+def test_backoff_doubles_up_to_the_cap(no_jitter):
+    agent = RecordingAgent(failures=100)
+    reconnector = reconnect.ReconnectManager(agent, ["/org/bluez/hci0/dev_1", "/org/bluez/hci0/dev_2"])
+    reconnector._stop_event = RoundLimit(6)
+    reconnector.run()
+    assert reconnector._stop_event.waits == [2, 4, 8, 10, 10, 10]
+    # every device is tried in every round, failures and all
+    assert agent.connected == ["/org/bluez/hci0/dev_1", "/org/bluez/hci0/dev_2"] * 6
+    assert reconnector.attempts == 12
+
+
+def test_jitter_stays_within_its_share_of_the_delay(monkeypatch, no_jitter):
+    monkeypatch.setattr(config, 'RECONNECT_JITTER', 0.5)
+    reconnector = reconnect.ReconnectManager(RecordingAgent(), ["/org/bluez/hci0/dev_1"])
+    reconnector._stop_event = RoundLimit(5)
+    reconnector.run()
+    for wait, delay in zip(reconnector._stop_event.waits, [2, 4, 8, 10, 10]):
+        assert delay <= wait <= 1.5 * delay
+
+
+def test_stop_reports_the_time_taken_once():
+    reconnector = reconnect.ReconnectManager(RecordingAgent(), [])
+    assert reconnector.stop() is None   # never ran
+    reconnector = reconnect.ReconnectManager(RecordingAgent(), [])
+    reconnector.start()
+    assert wait_for(lambda: reconnector.start_time is not None)
+    assert reconnector.stop() >= 0
+    assert reconnector.stop() is None
+    reconnector.join(1)
+    assert not reconnector.is_alive()
+
+
+def test_last_devices_round_trip(tmp_path):
+    filename = str(tmp_path / "last_devices.yaml")
+    assert reconnect.load_last_devices(filename) == []
+    for device in ("/org/bluez/hci0/dev_1", "/org/bluez/hci0/dev_2", "/org/bluez/hci0/dev_1"):
+        reconnect.remember_device(device, filename, max_devices=2)
+    assert reconnect.load_last_devices(filename) == ["/org/bluez/hci0/dev_1", "/org/bluez/hci0/dev_2"]
+    reconnect.remember_device("/org/bluez/hci0/dev_3", filename, max_devices=2)
+    assert reconnect.load_last_devices(filename) == ["/org/bluez/hci0/dev_3", "/org/bluez/hci0/dev_1"]
+
+
+@pytest.fixture
+def offline_phone(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, 'RECONNECT_INITIAL_DELAY', 0.05)
+    phone = mock_ofono.start_phone(monkeypatch, tmp_path, modems=((mock_ofono.MODEM, False),))
+    yield phone
+    mock_ofono.stop_phone(phone)
+
+
+def test_offline_phone_is_reconnected_until_online(offline_phone):
+    bt_conn = offline_phone.manager.bt_conn
+    agent = bt_conn.pairing_agent
+    # last_devices.yaml is empty, so the modems known to ofono are tried
+    assert wait_for(lambda: len(agent.connected) >= 2)
+    assert set(agent.connected) == {DEVICE}
+    assert bt_conn.reconnect_manager is not None
+
+    offline_phone.ofono.set_online(mock_ofono.MODEM, True)
+    assert bt_conn.reconnect_manager is None
+    assert len(bt_conn.reconnect_times) == 1
+    assert bt_conn.reconnect_times[0] > 0
+    assert offline_phone.remembered == [DEVICE]
+    tries = len(agent.connected)
+    assert not wait_for(lambda: len(agent.connected) > tries, timeout=0.3)
+
+
+def test_remembered_devices_are_tried_first(monkeypatch, tmp_path):
+    other = "/hfp/org/bluez/hci0/dev_11_22_33_44_55_66"
+    monkeypatch.setattr(config, 'RECONNECT_INITIAL_DELAY', 10)
+    bus = mock_ofono.FakeBus()
+    mock_ofono.patch_services(monkeypatch, tmp_path, bus)
+    monkeypatch.setattr(reconnect, 'load_last_devices',
+                        lambda *args: ["/org/bluez/hci0/dev_gone", reconnect.modem_to_device_path(other)])
+    ofono = mock_ofono.MockOfono(bus)
+    ofono.add_modem(mock_ofono.MODEM, online=False)
+    ofono.add_modem(other, online=False)
+    ofono.start()
+    mock_ofono.MockBluez(bus).start()
+    phone = SimpleNamespace(manager=manager.PhoneManager())
+    try:
+        # only remembered devices ofono still knows, so the one it has forgotten is skipped
+        assert phone.manager.bt_conn.reconnect_manager.device_paths == [reconnect.modem_to_device_path(other)]
+    finally:
+        mock_ofono.stop_phone(phone)
+
+
+def test_phone_online_at_startup_is_remembered(monkeypatch, tmp_path):
+    phone = mock_ofono.start_phone(monkeypatch, tmp_path)
+    try:
+        assert phone.remembered == [DEVICE]
+        assert phone.manager.bt_conn.reconnect_manager is None
+        # refreshing the modem list does not remember it again
+        phone.manager.bt_conn.get_all_modem_objects()
+        assert phone.remembered == [DEVICE]
+    finally:
+        mock_ofono.stop_phone(phone)
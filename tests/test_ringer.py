@@ -0,0 +1,125 @@
+"""
+The ringer process, run with the stand-in RPi.GPIO from tests/fake_rpi that logs every pin change with its time.
+"""
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+import config
+import ringer
+from simulated_handset import wait_for
+
+FAKE_RPI = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_rpi")
+# Allowed error of a cadence switch (units: s)
+CADENCE_TOLERANCE = 0.03
+
+
+@pytest.fixture
+def gpio_log(monkeypatch, tmp_path):
+    log = tmp_path / "gpio.log"
+    log.touch()
+    monkeypatch.setenv('PYTHONPATH', FAKE_RPI)
+    monkeypatch.setenv('FAKE_GPIO_LOG', str(log))
+
+    def read():
+        return [(float(t), kind, int(pin), float(value))
+                for t, kind, pin, value in (line.split() for line in log.read_text().splitlines())]
+    return read
+
+
+@pytest.fixture
+def bell(gpio_log):
+    bell = ringer.Ringer(config.RINGER_PIN, config.RINGER_ENABLE_PIN, realtime=False)
+    bell.start()
+    # started once the bell has been switched off at start up
+    assert wait_for(lambda: any(kind == "output" for _, kind, _, _ in gpio_log()), timeout=5)
+    yield bell
+    if bell._process.poll() is None:
+        bell.close()
+
+
+def duty_changes(log):
+    return [(t, value) for t, kind, pin, value in log if kind == "duty"]
+
+
+def context_switches(pid):
+    with open(f"/proc/{pid}/status") as status:
+        return sum(int(line.split()[1]) for line in status if line.split(":")[0].endswith("ctxt_switches"))
+
+
+def test_ringer_process_does_not_import_the_phone(monkeypatch):
+    monkeypatch.setenv('PYTHONPATH', FAKE_RPI)
+    result = subprocess.run([sys.executable, "-X", "importtime", ringer.BELL_SCRIPT, "12", "18", "25", "[[1, 1]]"],
+                            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+                            env=dict(os.environ, FAKE_GPIO_LOG=os.devnull), timeout=10)
+    assert result.returncode == 0
+    imported = {line.split("|")[-1].strip() for line in result.stderr.splitlines() if line.startswith("import time:")}
+    assert "RPi.GPIO" in imported
+    for module in ("config", "numpy", "dbus", "alsaaudio", "manager", "telefonoa", "multiprocessing"):
+        assert module not in imported
+
+
+def test_bell_follows_the_cadence(bell, gpio_log):
+    started = time.monotonic()
+    bell.set_ringing(True)
+    assert bell.is_ringing
+    time.sleep(0.7)
+    bell.set_ringing(False)
+    assert wait_for(lambda: gpio_log()[-1][1:] == ("output", config.RINGER_ENABLE_PIN, 0))
+
+    changes = [(t - started, value) for t, value in duty_changes(gpio_log()) if t >= started]
+    on, off, on_again = changes[:3]
+    assert on[1] == 50 and off[1] == 0 and on_again[1] == 50
+    pattern = config.RINGER_CADENCES[0]
+    assert off[0] - on[0] == pytest.approx(pattern[0], abs=CADENCE_TOLERANCE)
+    assert on_again[0] - off[0] == pytest.approx(pattern[1], abs=CADENCE_TOLERANCE)
+    assert changes[-1][1] == 0
+
+
+def test_bell_stops_at_once_when_told(bell, gpio_log):
+    bell.set_ringing(True)
+    time.sleep(0.1)
+    stopped = time.monotonic()
+    bell.set_ringing(False)
+    assert wait_for(lambda: duty_changes(gpio_log())[-1][1] == 0 and duty_changes(gpio_log())[-1][0] > stopped)
+    assert duty_changes(gpio_log())[-1][0] - stopped < CADENCE_TOLERANCE
+
+
+def test_idle_ringer_sleeps_instead_of_polling(bell):
+    before = context_switches(bell._process.pid)
+    time.sleep(1)
+    # woken about once a second for the parent check, where polling woke it every few milliseconds
+    assert context_switches(bell._process.pid) - before <= 5
+
+
+def test_bell_goes_off_when_the_parent_goes(bell, gpio_log):
+    bell.set_ringing(True)
+    time.sleep(0.1)
+    bell._process.stdin.close()     # what the ringer process sees when the phone process dies
+    bell._process.wait(1)
+    log = gpio_log()
+    assert duty_changes(log)[-1][1] == 0
+    assert [entry for entry in log if entry[1] == "output"][-1][3] == 0
+
+
+def test_close_stops_the_process(bell):
+    bell.set_ringing(True)
+    bell.close()
+    assert bell._process.returncode == 0
+    assert not bell.is_ringing
+
+
+def test_dead_ringer_process_is_restarted(bell, gpio_log):
+    dead = bell._process
+    dead.kill()
+    dead.wait(1)
+    rang = time.monotonic()
+    bell.set_ringing(True)
+    assert bell._process is not dead
+    assert bell._process.poll() is None
+    assert wait_for(lambda: any(value == 50 and t > rang for t, value in duty_changes(gpio_log())), timeout=5)
+    bell.set_ringing(False)
+    assert wait_for(lambda: duty_changes(gpio_log())[-1][1] == 0)
@@ -0,0 +1,58 @@
+import time
+
+import pytest
+
+import mock_ofono
+
+# Recovery SLO: after ofono restarts an incoming call must ring again within this many seconds
+RECOVERY_SLO = 1.0
+
+
+@pytest.fixture
+def phone(monkeypatch, tmp_path):
+    phone = mock_ofono.start_phone(monkeypatch, tmp_path)
+    yield phone
+    mock_ofono.stop_phone(phone)
+
+
+def test_incoming_call_rings_again_after_ofono_restart(phone):
+    phone.ofono.incoming_call()
+    assert phone.ringer.is_ringing
+
+    restarted = time.monotonic()
+    phone.ofono.kill()
+    phone.ofono.start()
+    phone.ofono.incoming_call()
+    rung_again = time.monotonic() - restarted
+
+    assert phone.ringer.is_ringing
+    assert phone.ringer.rings == 2
+    assert rung_again < RECOVERY_SLO
+    name, recovery = phone.manager.watchdog.recovery_times[-1]
+    assert name == 'org.ofono'
+    assert recovery < RECOVERY_SLO
+
+
+def test_bell_stops_when_ofono_dies_while_ringing(phone):
+    phone.ofono.incoming_call()
+    phone.ofono.kill()
+    assert not phone.ringer.is_ringing
+    assert not phone.manager.call_in_progress
+    assert not phone.manager.call_ringing
+    assert phone.manager.call_matches == []
+
+
+def test_restart_leaves_one_set_of_call_listeners(phone):
+    for _ in range(3):
+        phone.ofono.kill()
+        phone.ofono.start()
+    assert phone.bus.count_matches('CallAdded') == 1
+    assert phone.bus.count_matches('CallRemoved') == 1
+    assert phone.bus.count_matches('PropertyChanged') == 1
+
+
+def test_bluez_restart_registers_agent_again(phone):
+    phone.bluez.kill()
+    phone.bluez.start()
+    assert [c[2] for c in phone.bluez.method_calls].count('RegisterAgent') == 2
+    assert phone.manager.watchdog.recovery_times[-1][0] == 'org.bluez'
@@ -0,0 +1,110 @@
+"""
+Soak test for thread, file descriptor, memory and D-Bus match rule leaks.
+
+A single telephone runs on simulated GPIO inputs, a fake ringer and the mock ofono/bluez, so no cycle touches the
+real bell, bluetoothd, ofono or the connected mobile. Prompts and the dial tone are played by the real AudioPlayer,
+with its threads and wav files, on a stub sound card. Each cycle lifts the receiver, dials a number, hangs up,
+answers an incoming call, takes the modem offline and online again and, every few cycles, kills and restarts ofono.
+Resources are sampled every SOAK_INTERVAL cycles after a warmup and must stay within the limits in resource_monitor.
+
+The default is a short run for the regular suite. For a long soak set SOAK_CYCLES, e.g.
+
+    SOAK_CYCLES=5000 python3 -m pytest -q tests/test_soak.py
+"""
+import os
+import threading
+
+import audio
+import config
+import gpio_input
+import hook_switch
+import mock_ofono
+import resource_monitor
+import telefonoa
+from simulated_handset import Handset, SimulatedInputs, wait_for
+
+CYCLES = int(os.environ.get('SOAK_CYCLES', 30))
+INTERVAL = int(os.environ.get('SOAK_INTERVAL', 10))
+WARMUP = 10
+OFONO_RESTART_EVERY = 15
+PINS = {'NS_PIN': 200, 'HOERER_PIN': 201}
+AudioPlayer = audio.AudioPlayer     # the real one, patch_services replaces it with a fake
+
+
+def calls(ofono, member):
+    return [c for c in ofono.method_calls if c[2] == member]
+
+
+def run_cycle(cycle, telephone, handset, ofono, ringer):
+    # off hook, dial a number and hang up
+    handset.lift()
+    assert wait_for(lambda: not telephone.receiver_down)
+    dialed = len(ofono.dialed)
+    handset.dial("12")
+    assert wait_for(lambda: len(ofono.dialed) == dialed + 1)
+    assert wait_for(lambda: telephone.phone_manager.call_in_progress)
+    handset.hang_up()
+    assert wait_for(lambda: not telephone.phone_manager.call_in_progress)
+    # incoming call, answered and hung up
+    answered = len(calls(ofono, 'Answer'))
+    ofono.incoming_call()
+    assert wait_for(lambda: ringer.is_ringing)
+    handset.lift()
+    assert wait_for(lambda: len(calls(ofono, 'Answer')) == answered + 1)
+    assert not ringer.is_ringing
+    handset.hang_up()
+    assert wait_for(lambda: not telephone.phone_manager.call_in_progress)
+    # the mobile dropping off and coming back, and now and then ofono restarting
+    ofono.set_online(mock_ofono.MODEM, False)
+    ofono.set_online(mock_ofono.MODEM, True)
+    if cycle % OFONO_RESTART_EVERY == 0:
+        ofono.kill()
+        ofono.start()
+        assert wait_for(lambda: telephone.phone_manager.voice_call_manager is not None)
+
+
+def test_soak_call_cycles_do_not_leak(monkeypatch, tmp_path):
+    bus = mock_ofono.FakeBus()
+    mock_ofono.patch_services(monkeypatch, tmp_path, bus)
+    ofono = mock_ofono.MockOfono(bus)
+    ofono.add_modem()
+    ofono.start()
+    mock_ofono.MockBluez(bus).start()
+    monkeypatch.setattr(audio, 'AudioPlayer', AudioPlayer)
+    monkeypatch.setattr(audio.alsaaudio, 'PCM', mock_ofono.StubPCM)
+    monkeypatch.setattr(audio.TranscodeCache.__init__, '__defaults__', (str(tmp_path / "audio_cache"),))
+    inputs = SimulatedInputs()
+    inputs.levels[PINS['HOERER_PIN']] = 0
+    monkeypatch.setattr(gpio_input, 'create_inputs', lambda: inputs)
+    monkeypatch.setattr(telefonoa.ringer, 'RingerManager', mock_ofono.FakeRinger)
+    monkeypatch.setattr(config, 'ANSWER_DELAY', 0)
+    # a quick dialer: digits complete after 50 ms and the number is dialed 250 ms after the last one
+    monkeypatch.setattr(config, 'DIAL_PULSE_GAP', 0.05)
+    monkeypatch.setattr(config, 'DIAL_TIMEOUT', 0.25)
+    # hanging up is only reported once it can no longer be a hook flash, which would otherwise take most of a cycle
+    monkeypatch.setattr(hook_switch.HookDebouncer.__init__, '__defaults__', (config.HOOK_SETTLE_TIME, 0.1))
+    monkeypatch.chdir(mock_ofono.REPO)
+
+    telephone = telefonoa.Telephone(PINS['NS_PIN'], PINS['HOERER_PIN'])
+    telephone.phone_manager.reconciled.wait(5)
+    dialer = threading.Thread(target=telephone.dialing_handler, daemon=True)
+    dialer.start()
+    handset = Handset(inputs, PINS)
+    monitor = resource_monitor.ResourceMonitor(bus)
+    streams = mock_ofono.StubPCM.opened
+    try:
+        for cycle in range(1, CYCLES + 1):
+            run_cycle(cycle, telephone, handset, ofono, telephone.ringer)
+            if cycle == WARMUP or (cycle > WARMUP and cycle % INTERVAL == 0):
+                sample = monitor.sample()
+                print(f"cycle {cycle}: {sample}")
+                assert monitor.check() == []
+        assert len(ofono.dialed) == CYCLES
+        assert monitor.samples[-1]['match_rules'] is not None
+        # a dial tone every cycle, and every sound card stream closed again
+        assert mock_ofono.StubPCM.opened - streams >= CYCLES
+        assert wait_for(lambda: mock_ofono.StubPCM.closed == mock_ofono.StubPCM.opened)
+    finally:
+        telephone.audio.stop_file()
+        telephone.finish = True
+        telephone.close()
@@ -0,0 +1,160 @@
+"""
+Warm start from a saved snapshot with ofono slow to answer or bluez not up yet, and the call listeners being replaced
+from two threads.
+"""
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import config
+import manager
+import mock_ofono
+from simulated_handset import wait_for
+
+
+class SlowOfono(mock_ofono.MockOfono):
+    """ ofono that does not answer GetModems until released, as when it is still starting up. """
+    def __init__(self, bus):
+        mock_ofono.MockOfono.__init__(self, bus)
+        self.release = threading.Event()
+
+    def GetModems(self, path):
+        self.release.wait(5)
+        return mock_ofono.MockOfono.GetModems(self, path)
+
+
+@pytest.fixture
+def warm_phone(monkeypatch, tmp_path):
+    phones = []
+
+    def make(snapshot, online=True, bluez=True):
+        bus = mock_ofono.FakeBus()
+        mock_ofono.patch_services(monkeypatch, tmp_path, bus)
+        monkeypatch.setattr(config, 'WARM_START', snapshot is not None)
+        if snapshot is not None:
+            with open(config.STATE_SNAPSHOT_FILE, 'w') as stream:
+                json.dump(snapshot, stream)
+        ofono = SlowOfono(bus)
+        ofono.add_modem(online=online)
+        ofono.start()
+        if bluez:
+            mock_ofono.MockBluez(bus).start()
+        phone = SimpleNamespace(bus=bus, ofono=ofono, manager=manager.PhoneManager())
+        phones.append(phone)
+        return phone
+
+    yield make
+    for phone in phones:
+        phone.ofono.release.set()
+        phone.manager.reconciled.wait(5)
+        mock_ofono.stop_phone(phone)
+
+
+SNAPSHOT = {'online_modem': mock_ofono.MODEM, 'modem_name': "Test phone", 'speaker_volume': 40, 'mic_volume': 30}
+
+
+def test_warm_start_dials_and_sets_volume_before_ofono_answers(warm_phone):
+    phone = warm_phone(SNAPSHOT)
+    assert not phone.manager.reconciled.is_set()
+
+    started = time.monotonic()
+    phone.manager.call("0419239384")
+    assert phone.ofono.dialed == ["0419239384"]
+    assert time.monotonic() - started < 0.5
+    phone.manager.volume_up(5)
+    assert phone.ofono.volume['SpeakerVolume'] == 45
+    assert phone.ofono.volume['MicrophoneVolume'] == 35
+    assert not phone.manager.reconciled.is_set()
+
+    phone.ofono.release.set()
+    assert phone.manager.reconciled.wait(5)
+    assert phone.bus.count_matches('CallAdded') == 1
+    phone.ofono.incoming_call()
+    assert phone.manager.call_ringing
+
+
+def test_live_state_replaces_a_stale_snapshot(warm_phone):
+    phone = warm_phone(SNAPSHOT, online=False)
+    assert phone.manager.voice_call_manager is not None
+    phone.ofono.release.set()
+    assert phone.manager.reconciled.wait(5)
+    assert phone.manager.voice_call_manager is None
+    assert phone.manager.volume_controller is None
+    phone.manager.call("0419239384")
+    assert phone.ofono.dialed == []
+    assert any("not_connected" in played for played in phone.manager.audio.played)
+
+
+def test_cold_snapshot_waits_for_the_live_state(warm_phone):
+    phone = warm_phone({'online_modem': None, 'modem_name': None})
+    assert phone.manager.voice_call_manager is None
+    threading.Timer(0.2, phone.ofono.release.set).start()
+    phone.manager.call("0419239384")
+    assert phone.ofono.dialed == ["0419239384"]
+
+
+@pytest.mark.parametrize("snapshot", [SNAPSHOT, None], ids=["warm", "cold"])
+def test_bluez_starting_late_is_waited_for(warm_phone, monkeypatch, snapshot):
+    # long enough that only bluez coming up can start the next try within the test
+    monkeypatch.setattr(config, 'RECONCILE_RETRY_INITIAL_DELAY', 10)
+    phone = warm_phone(snapshot, bluez=False)
+    phone.ofono.release.set()
+    # registering the pairing agent failed: dialing does not wait for the live state while it is retried
+    assert phone.manager.reconciled.wait(5)
+    assert phone.bus.count_matches('CallAdded') == 0
+
+    mock_ofono.MockBluez(phone.bus).start()
+    assert wait_for(lambda: phone.bus.count_matches('CallAdded') == 1)
+    ringer = mock_ofono.FakeRinger()
+    phone.manager.add_ringer(ringer)
+    phone.ofono.incoming_call()
+    assert ringer.is_ringing
+    started = time.monotonic()
+    phone.manager.call("0419239384")
+    assert phone.ofono.dialed == ["0419239384"]
+    assert time.monotonic() - started < 0.5
+
+
+def test_concurrent_modem_ready_leaves_one_listener(monkeypatch, tmp_path):
+    phone = mock_ofono.start_phone(monkeypatch, tmp_path)
+    try:
+        get_interface = phone.manager.proxy_cache.get_interface
+
+        def slow_get_interface(*args):
+            time.sleep(0.005)   # widen the window between removing the old listeners and adding the new
+            return get_interface(*args)
+        monkeypatch.setattr(phone.manager.proxy_cache, 'get_interface', slow_get_interface)
+
+        for _ in range(20):
+            barrier = threading.Barrier(2)
+
+            def listen(value):
+                barrier.wait()
+                phone.manager._listen_for_calls(value)
+            threads = [threading.Thread(target=listen, args=(value,)) for value in (config.READY, config.ALREADY_ON)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            assert phone.bus.count_matches('CallAdded') == 1
+            assert phone.bus.count_matches('CallRemoved') == 1
+    finally:
+        mock_ofono.stop_phone(phone)
+
+
+def test_ofono_lost_while_listeners_are_replaced(monkeypatch, tmp_path):
+    phone = mock_ofono.start_phone(monkeypatch, tmp_path)
+    try:
+        listener = threading.Thread(target=phone.manager._listen_for_calls, args=(config.READY,))
+        listener.start()
+        phone.manager.ofono_lost()
+        listener.join()
+        # whichever came last wins, never a mix of the two
+        listening = len(phone.manager.call_matches) > 0
+        assert (phone.manager.voice_call_manager is not None) == listening
+        assert wait_for(lambda: phone.bus.count_matches('CallAdded') == (1 if listening else 0))
+    finally:
+        mock_ofono.stop_phone(phone)